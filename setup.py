@@ -19,6 +19,7 @@ setup(
         'vmail',
         'vmail.management',
         'vmail.management.commands',
+        'vmail.benchmarks',
         'vmail.migrations',
         'vmail.tests',
     ],
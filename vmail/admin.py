@@ -1,37 +1,281 @@
 """
 Virtual mail administration interface configuration.
+
+The changelists are built to stay fast on tables of millions of rows:
+searches match address prefixes, which the address indexes can answer,
+counts of unfiltered tables are estimated from the database statistics,
+and pages are read from a first primary key found by an OFFSET over the
+primary key index alone, rather than by an OFFSET over the rows.
 """
 
+import operator
+
+from django import forms
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.helpers import ActionForm, ACTION_CHECKBOX_NAME
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.paginator import Paginator, Page, EmptyPage
+from django.db import connections
+from django.db.models import Q
+from django.db.models.query import QuerySet
+from django.template.response import TemplateResponse
+from django.utils.encoding import force_text
 
+from . import bulk
 from .models import Domain, MailUser, Alias
+from .routers import shards
+
+# Queries of the estimated number of rows in a table, by database vendor.
+ESTIMATE_QUERIES = {
+    'postgresql': 'SELECT reltuples FROM pg_class WHERE relname = %s',
+    'mysql': ('SELECT table_rows FROM information_schema.tables'
+              ' WHERE table_schema = DATABASE() AND table_name = %s'),
+}
+
+
+class EstimatedCountQuerySet(QuerySet):
+    """
+    A queryset which estimates the count of an unfiltered table from the
+    database statistics, if the estimate is at least
+    VMAIL_ADMIN_ESTIMATE_COUNT_ABOVE rows.  Smaller tables, filtered
+    querysets, and databases without statistics are counted exactly.
+    """
+
+    def count(self):
+        query = self.query
+        if (query.where or query.having or query.distinct or
+                query.low_mark or query.high_mark is not None):
+            return super(EstimatedCountQuerySet, self).count()
+        estimate = self.estimate_count()
+        threshold = getattr(settings, 'VMAIL_ADMIN_ESTIMATE_COUNT_ABOVE', 100000)
+        if estimate is None or estimate < threshold:
+            return super(EstimatedCountQuerySet, self).count()
+        return estimate
+
+    def estimate_count(self):
+        """Return the estimated number of rows in the table, or None."""
+        connection = connections[self.db]
+        sql = ESTIMATE_QUERIES.get(connection.vendor)
+        if sql is None:
+            return None
+        cursor = connection.cursor()
+        cursor.execute(sql, [self.model._meta.db_table])
+        row = cursor.fetchone()
+        return int(row[0]) if row and row[0] is not None else None
+
+
+class PrimaryKeyOffsetPaginator(Paginator):
+    """
+    Reads a page of a queryset ordered by primary key by finding the
+    first primary key of the page, with an OFFSET over the primary keys
+    alone, and then reading the page's rows from that key on, so the
+    rows before the page are not read and discarded.  The OFFSET still
+    walks the primary key index up to the page, as the admin's page
+    links carry a page number rather than the previous page's last key.
+    Querysets with any other ordering are paged as usual.
+    """
+
+    def page(self, number):
+        ordering = list(self.object_list.query.order_by)
+        if ordering not in (['pk'], ['-pk'], ['id'], ['-id']):
+            return super(PrimaryKeyOffsetPaginator, self).page(number)
+
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        first = self.object_list.values_list('pk', flat=True)[bottom:bottom + 1]
+        if not first:
+            raise EmptyPage('That page contains no results')
+        lookup = 'pk__lte' if ordering[0].startswith('-') else 'pk__gte'
+        object_list = self.object_list.filter(**{lookup: first[0]})[:self.per_page]
+        return Page(object_list, number, self)
+
+
+class PrefixSearchChangeList(ChangeList):
+    """
+    A changelist which searches each field of `search_fields` for values
+    starting with each search term.  The fields hold lowercase values,
+    so the match is case sensitive and can use the field's index, unlike
+    the admin's case insensitive searches; on PostgreSQL, the pattern
+    index of the 0008 migration.
+    """
+
+    def get_query_set(self, request):
+        search_fields, self.search_fields = self.search_fields, ()
+        try:
+            qs = super(PrefixSearchChangeList, self).get_query_set(request)
+        finally:
+            self.search_fields = search_fields
+
+        for bit in self.query.lower().split():
+            qs = qs.filter(reduce(operator.or_, [
+                Q(**{'{0}__startswith'.format(field): bit}) for field in search_fields]))
+        return qs
+
+
+class ScalableModelAdmin(admin.ModelAdmin):
+    list_select_related = True
+    paginator = PrimaryKeyOffsetPaginator
+
+    def queryset(self, request):
+        qs = super(ScalableModelAdmin, self).queryset(request)
+        return qs._clone(klass=EstimatedCountQuerySet)
+
+    def get_changelist(self, request, **kwargs):
+        return PrefixSearchChangeList
+
+
+def activate_domains(modeladmin, request, queryset):
+    count = bulk.set_domains_active(queryset, True)[0]
+    modeladmin.message_user(request, 'Activated {0} domains.'.format(count))
+activate_domains.short_description = 'Activate selected domains'
 
 
-class DomainAdmin(admin.ModelAdmin):
+def deactivate_domains(modeladmin, request, queryset):
+    count = bulk.set_domains_active(queryset, False)[0]
+    modeladmin.message_user(request, 'Deactivated {0} domains, and their mailboxes and'
+                                     ' aliases.'.format(count))
+deactivate_domains.short_description = 'Deactivate selected domains, and their mail'
+
+
+def delete_domains(modeladmin, request, queryset):
+    """
+    Delete the selected domains with `bulk.delete_domain`, once confirmed
+    on the admin's confirmation page.  The page lists each domain with
+    its number of mail users and aliases, rather than every row the
+    ORM's cascade would collect.
+    """
+    if not modeladmin.has_delete_permission(request):
+        raise PermissionDenied
+    if request.POST.get('post'):
+        count = 0
+        for domain in queryset:
+            modeladmin.log_deletion(request, domain, force_text(domain))
+            bulk.delete_domain(domain)
+            count += 1
+        modeladmin.message_user(request, 'Deleted {0} domains, and their mailboxes and'
+                                         ' aliases.'.format(count))
+        return None
+    opts = modeladmin.model._meta
+    domains = ['{0} ({1} mail users, {2} aliases)'.format(
+        domain.fqdn, MailUser.objects.using(domain.shard or None).filter(domain=domain).count(),
+        Alias.objects.using(domain.shard or None).filter(domain=domain).count())
+        for domain in queryset]
+    context = {
+        'title': 'Are you sure?',
+        'objects_name': force_text(opts.verbose_name_plural),
+        'deletable_objects': [domains],
+        'queryset': queryset,
+        'perms_lacking': [],
+        'protected': [],
+        'opts': opts,
+        'app_label': opts.app_label,
+        'action_checkbox_name': ACTION_CHECKBOX_NAME,
+    }
+    return TemplateResponse(request, 'admin/delete_selected_confirmation.html', context,
+                            current_app=modeladmin.admin_site.name)
+delete_domains.short_description = 'Delete selected domains, and their mail'
+
+
+def activate(modeladmin, request, queryset):
+    count = bulk.set_active(queryset, True)
+    modeladmin.message_user(request, 'Activated {0} {1}.'.format(
+        count, queryset.model._meta.verbose_name_plural))
+activate.short_description = 'Activate selected %(verbose_name_plural)s'
+
+
+def deactivate(modeladmin, request, queryset):
+    count = bulk.set_active(queryset, False)
+    modeladmin.message_user(request, 'Deactivated {0} {1}.'.format(
+        count, queryset.model._meta.verbose_name_plural))
+deactivate.short_description = 'Deactivate selected %(verbose_name_plural)s'
+
+
+class MoveActionForm(ActionForm):
+    domain = forms.ModelChoiceField(Domain.objects.all(), required=False,
+                                    label='Domain', empty_label='(move to domain)')
+
+
+def move_to_domain(modeladmin, request, queryset):
+    try:
+        domain = MoveActionForm.base_fields['domain'].clean(request.POST.get('domain'))
+    except ValidationError:
+        domain = None
+    if domain is None:
+        modeladmin.message_user(request, 'Choose a domain to move the mail users to.')
+        return
+    try:
+        count, conflicts = bulk.move_mailboxes(queryset, domain)
+    except ValueError as e:
+        modeladmin.message_user(request, str(e))
+        return
+    message = 'Moved {0} mail users to {1}.'.format(count, domain)
+    if conflicts:
+        message += '  Usernames already taken: {0}.'.format(', '.join(conflicts))
+    modeladmin.message_user(request, message)
+move_to_domain.short_description = 'Move selected mail users to the domain'
+
+
+class DomainAdmin(ScalableModelAdmin):
     fields = ['fqdn', 'active']
     list_display = ['fqdn', 'active', 'created']
-    list_filter = ['fqdn', 'active', 'created']
-    search_fields = ['fqdn', 'active', 'created']
+    list_filter = ['active', 'created']
+    search_fields = ['fqdn']
     date_hierarchy = 'created'
+    actions = [activate_domains, deactivate_domains]
+
+    def get_actions(self, request):
+        actions = super(DomainAdmin, self).get_actions(request)
+        if 'delete_selected' in actions:
+            # replaces the cascading delete, under its name, which the confirmation page posts
+            actions['delete_selected'] = (delete_domains, 'delete_selected',
+                                          delete_domains.short_description)
+        return actions
+
+    def delete_model(self, request, obj):
+        # in batches, rather than by the ORM's cascade, holding locks throughout
+        bulk.delete_domain(obj)
 
 admin.site.register(Domain, DomainAdmin)
 
 
-class MailUserAdmin(admin.ModelAdmin):
+class UnshardedModelAdmin(ScalableModelAdmin):
+    """
+    Administers the mail users or aliases only while VMAIL_SHARDS is not
+    set: the changelists and forms read the default database, and would
+    miss the rows of the sharded domains, or edit a row of another
+    domain with the same id.  Use the vmail commands with sharding.
+    """
+
+    def has_add_permission(self, request):
+        return not shards() and super(UnshardedModelAdmin, self).has_add_permission(request)
+
+    def has_change_permission(self, request, obj=None):
+        return not shards() and super(UnshardedModelAdmin, self).has_change_permission(
+            request, obj)
+
+    def has_delete_permission(self, request, obj=None):
+        return not shards() and super(UnshardedModelAdmin, self).has_delete_permission(
+            request, obj)
+
+
+class MailUserAdmin(UnshardedModelAdmin):
     fields = ['username', 'domain', 'active', 'shadigest', 'salt']
-    list_display = ['username', 'domain', 'active', 'created']
-    list_filter = ['username', 'domain', 'active', 'created']
-    search_fields = ['username', 'domain__fqdn', 'active', 'created']
-    date_hierarchy = 'created'
+    list_display = ['email', 'domain', 'active', 'created']
+    list_filter = ['active', 'domain']
+    search_fields = ['email']
+    actions = [activate, deactivate, move_to_domain]
+    action_form = MoveActionForm
 
 admin.site.register(MailUser, MailUserAdmin)
 
 
-class AliasAdmin(admin.ModelAdmin):
+class AliasAdmin(UnshardedModelAdmin):
     fields = ['domain', 'source', 'active', 'destination']
     list_display = ['source', 'destination', 'domain', 'active', 'created']
-    list_filter = ['domain', 'active', 'created']
-    search_fields = ['source', 'destination', 'domain__fqdn', 'active', 'created']
-    date_hierarchy = 'created'
+    list_filter = ['active', 'domain']
+    search_fields = ['source']
+    actions = [activate, deactivate]
 
 admin.site.register(Alias, AliasAdmin)
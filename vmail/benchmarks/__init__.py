@@ -0,0 +1,8 @@
+"""
+Benchmarks of the virtual mail lookups and provisioning.
+
+`vmail.benchmarks.data` generates synthetic datasets of any size, and
+`vmail.benchmarks.suite` times the lookups, password checks, management
+commands and admin changelists against them.  The `vmail-benchmark`
+command runs both in a throwaway test database.
+"""
@@ -0,0 +1,85 @@
+"""
+Synthetic datasets of domains, mail users and aliases.
+"""
+
+import random
+
+from .. import hashers, lookup
+from ..db import commit_on_success_unless_managed
+from ..models import Domain, MailUser, Alias
+
+# The password of every generated mail user.
+PASSWORD = 'benchmark password'
+
+# Rows created per INSERT.
+BATCH_SIZE = 500
+
+
+def domain_name(i):
+    return 'bench{0}.example'.format(i)
+
+
+def generate(domains=10, users=100, aliases=20, fanout=3, catchalls=0.5,
+             external=0.1, seed=0):
+    """
+    Create `domains` domains, each with `users` mail users and `aliases`
+    aliases.  Each alias forwards to between 1 and `fanout` destinations,
+    mostly mail users of its domain, and a fraction `external` of them
+    addresses of other mail systems.  A fraction `catchalls` of the
+    domains also get a catch-all alias.  The rows are created with
+    bulk_create, and every mail user's password is `PASSWORD`, hashed
+    once with the current scheme.  The same arguments always generate
+    the same dataset.
+
+    Returns a dictionary of the number of each kind of row created.
+    """
+    rng = random.Random(seed)
+    salt, digest = hashers.make_password(PASSWORD)
+    counts = {'domains': 0, 'mailboxes': 0, 'aliases': 0, 'catchalls': 0}
+
+    with commit_on_success_unless_managed():
+        fqdns = [domain_name(i) for i in range(domains)]
+        Domain.objects.bulk_create([Domain(fqdn=fqdn) for fqdn in fqdns])
+        counts['domains'] = len(fqdns)
+
+        pending = {MailUser: [], Alias: []}
+
+        def add(obj):
+            obj.set_domain_fields()
+            objs = pending[type(obj)]
+            objs.append(obj)
+            if len(objs) >= BATCH_SIZE:
+                type(obj).objects.bulk_create(objs)
+                del objs[:]
+
+        for domain in Domain.objects.filter(fqdn__in=fqdns).order_by('pk'):
+            emails = []
+            for j in range(users):
+                user = MailUser(username='user{0}'.format(j), domain=domain,
+                                salt=salt, shadigest=digest)
+                add(user)
+                emails.append('user{0}@{1}'.format(j, domain.fqdn))
+            counts['mailboxes'] += users
+
+            for j in range(aliases):
+                destinations = set()
+                for _ in range(rng.randint(1, fanout)):
+                    if not emails or rng.random() < external:
+                        destinations.add('user{0}@external.example'.format(rng.randrange(1000)))
+                    else:
+                        destinations.add(rng.choice(emails))
+                for destination in sorted(destinations):
+                    add(Alias(domain=domain, source='alias{0}@{1}'.format(j, domain.fqdn),
+                              destination=destination))
+            counts['aliases'] += aliases
+
+            if rng.random() < catchalls:
+                add(Alias(domain=domain, source='@' + domain.fqdn,
+                          destination=emails[0] if emails else
+                          'postmaster@external.example'))
+                counts['catchalls'] += 1
+
+        for model, objs in pending.items():
+            model.objects.bulk_create(objs)
+        lookup.rebuild()
+    return counts
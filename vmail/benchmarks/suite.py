@@ -0,0 +1,208 @@
+"""
+Timings of the lookups, password checks, commands and admin changelists.
+
+Each benchmark is a function registered by name in `BENCHMARKS`, which
+is given a `Sample` of the dataset and a number of rounds, and returns
+the time in seconds of each round, or None if it cannot run here.
+"""
+
+import random
+import shutil
+import tempfile
+from StringIO import StringIO
+from collections import OrderedDict
+from timeit import default_timer
+
+from django.core.management import call_command
+from django.core.urlresolvers import reverse, NoReverseMatch
+from django.db import connection
+
+from ..maps import LOOKUP_QUERIES, VIRTUAL_ALIAS_MAPS
+from ..matcher import AliasMatcher, candidate_sources
+from ..models import Domain, MailUser, Alias
+from .data import PASSWORD
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name):
+    """Register a benchmark function under `name`."""
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+class Sample(object):
+    """
+    Random mail user addresses, alias sources and domain names of the
+    dataset, to run the benchmarks with.
+    """
+
+    def __init__(self, rounds, seed=0):
+        rng = random.Random(seed)
+        emails = list(MailUser.objects.values_list('email', flat=True).order_by('pk'))
+        sources = list(Alias.objects.values_list('source', flat=True).order_by('pk'))
+        fqdns = list(Domain.objects.values_list('fqdn', flat=True).order_by('pk'))
+        self.emails = [rng.choice(emails) for _ in range(rounds)] if emails else []
+        self.sources = [rng.choice(sources) for _ in range(rounds)] if sources else []
+        self.fqdns = [rng.choice(fqdns) for _ in range(rounds)] if fqdns else []
+
+
+def _time(func, calls):
+    timings = []
+    for args in calls:
+        start = default_timer()
+        func(*args)
+        timings.append(default_timer() - start)
+    return timings
+
+
+@benchmark('get_from_email')
+def get_from_email(sample, rounds):
+    Domain.objects.clear_cache()
+    return _time(MailUser.get_from_email, [(email,) for email in sample.emails])
+
+
+@benchmark('get_from_email.select_related')
+def get_from_email_select_related(sample, rounds):
+    return _time(lambda email: MailUser.get_from_email(email, select_related=True),
+                 [(email,) for email in sample.emails])
+
+
+@benchmark('check_password')
+def check_password(sample, rounds):
+    users = [MailUser.objects.get(email=email) for email in sample.emails]
+    return _time(lambda user: user.check_password(PASSWORD), [(user,) for user in users])
+
+
+@benchmark('set_password')
+def set_password(sample, rounds):
+    users = [MailUser.objects.get(email=email) for email in sample.emails]
+    return _time(lambda user: user.set_password(PASSWORD), [(user,) for user in users])
+
+
+def _query_benchmark(sql, param_names):
+    def run(sample, rounds):
+        cursor = connection.cursor()
+
+        def query(params):
+            cursor.execute(sql, params)
+            cursor.fetchall()
+
+        calls = []
+        for email, source in zip(sample.emails, sample.sources):
+            values = {'email': email, 'fqdn': email.split('@', 1)[1],
+                      'source': source, 'active': True}
+            calls.append(([values[p] for p in param_names],))
+        return _time(query, calls)
+    return run
+
+for _name, (_sql, _param_names) in LOOKUP_QUERIES.items():
+    benchmark('query.' + _name)(_query_benchmark(_sql, _param_names))
+
+
+def _match_addresses(sample):
+    # alias sources match exactly, and mailbox addresses fall through to catch-alls
+    return [(address,) for pair in zip(sample.sources, sample.emails) for address in pair]
+
+
+@benchmark('match.sql')
+def match_sql(sample, rounds):
+    """The virtual_alias_maps query of each candidate source, until one matches."""
+    cursor = connection.cursor()
+    sql = LOOKUP_QUERIES[VIRTUAL_ALIAS_MAPS][0]
+
+    def match(address):
+        for source in candidate_sources(address):
+            cursor.execute(sql, [source, True, True])
+            if cursor.fetchall():
+                return source
+    return _time(match, _match_addresses(sample))
+
+
+@benchmark('match.memory')
+def match_memory(sample, rounds):
+    matcher = AliasMatcher.load()
+    return _time(matcher.match, _match_addresses(sample))
+
+
+def _call(name, *args, **options):
+    call_command(name, *args, stdout=StringIO(), stderr=StringIO(), **options)
+
+
+@benchmark('command.vmail-addmbox')
+def command_addmbox(sample, rounds):
+    return _time(_call, [('vmail-addmbox', 'bench-new{0}@{1}'.format(i, fqdn))
+                         for i, fqdn in enumerate(sample.fqdns)])
+
+
+@benchmark('command.vmail-export-maps')
+def command_export_maps(sample, rounds):
+    directory = tempfile.mkdtemp()
+    try:
+        return _time(lambda: _call('vmail-export-maps', directory, force=True),
+                     [()] * min(rounds, 5))
+    finally:
+        shutil.rmtree(directory)
+
+
+@benchmark('command.vmail-resolve')
+def command_resolve(sample, rounds):
+    return _time(lambda: _call('vmail-resolve', all=True), [()] * min(rounds, 5))
+
+
+def _admin_benchmark(model_name):
+    def run(sample, rounds):
+        from django.contrib.auth.models import User
+        from django.test.client import Client
+
+        try:
+            url = reverse('admin:vmail_{0}_changelist'.format(model_name))
+        except NoReverseMatch:
+            return None
+        if not User.objects.filter(username='vmail-benchmark').exists():
+            User.objects.create_superuser('vmail-benchmark', 'benchmark@example.org',
+                                          PASSWORD)
+        client = Client()
+        client.login(username='vmail-benchmark', password=PASSWORD)
+        queries = [{}, {'p': 1}, {'q': 'user1'}]
+        return _time(lambda params: client.get(url, params),
+                     [(queries[i % len(queries)],) for i in range(min(rounds, 30))])
+    return run
+
+for _model_name in ('domain', 'mailuser', 'alias'):
+    benchmark('admin.' + _model_name)(_admin_benchmark(_model_name))
+
+
+def summarize(name, timings):
+    """Return a dictionary of the statistics, in seconds, of a benchmark's timings."""
+    timings = sorted(timings)
+    count = len(timings)
+    return OrderedDict([
+        ('name', name),
+        ('rounds', count),
+        ('total', round(sum(timings), 6)),
+        ('mean', round(sum(timings) / count, 6)),
+        ('median', round(timings[count // 2], 6)),
+        ('p95', round(timings[min(count - 1, int(count * 0.95))], 6)),
+        ('min', round(timings[0], 6)),
+        ('max', round(timings[-1], 6)),
+    ])
+
+
+def run(names=None, rounds=100, seed=0):
+    """
+    Run the benchmarks whose names start with any of `names`, or all of
+    them, and return a list of the statistics of each.  Benchmarks which
+    cannot run here, or have nothing to run on, are left out.
+    """
+    sample = Sample(rounds, seed)
+    results = []
+    for name, func in BENCHMARKS.items():
+        if names and not any(name.startswith(prefix) for prefix in names):
+            continue
+        timings = func(sample, rounds)
+        if timings:
+            results.append(summarize(name, timings))
+    return results
@@ -0,0 +1,262 @@
+"""
+Bulk operations on the virtual mail models.
+"""
+
+import multiprocessing
+from functools import partial
+from itertools import islice
+
+from django.db import connections, router
+from django.utils import timezone
+
+from . import changes, hashers, lookup, shards
+from .db import commit_on_success_unless_managed
+from .models import Domain, MailUser, Alias, Change
+
+
+def _hash_password(args):
+    name, cost, raw_password, salt = args
+    return hashers.get_scheme(name).encode(raw_password, salt, cost)
+
+
+def set_passwords(passwords, workers=None, batch_size=1000, scheme=None):
+    """
+    Set the password of many mail users.  `passwords` is an iterable of
+    (email, raw_password) pairs, read `batch_size` pairs at a time.  The
+    mail users of each batch are found with one query, the passwords
+    are hashed with the password scheme `scheme` across a pool of
+    `workers` processes (one per CPU by default, or in this process if
+    `workers` is 1), and each batch is written in a single transaction
+    per shard.
+
+    Returns a (count, missing) tuple, the number of passwords set, and
+    a list of the email addresses with no mail user.
+    """
+    pool = None
+    if workers != 1:
+        pool = multiprocessing.Pool(workers)
+    mapper = pool.map if pool is not None else map
+    scheme = hashers.get_scheme(scheme)
+    cost = hashers.get_cost(scheme)
+
+    count, missing = 0, []
+    passwords = iter(passwords)
+    try:
+        while True:
+            batch = [(email.strip().lower(), raw_password) for email, raw_password
+                     in islice(passwords, batch_size)]
+            if not batch:
+                break
+            users = _find_users(email for email, _ in batch)
+            found = [(email, raw_password) for email, raw_password in batch if email in users]
+            missing.extend(email for email, _ in batch if email not in users)
+
+            salts = [scheme.make_salt() for _ in found]
+            digests = mapper(_hash_password, [(scheme.name, cost, raw_password, salt)
+                                              for (_, raw_password), salt in zip(found, salts)])
+
+            now = timezone.now()
+            written = {}
+            for (email, _), salt, digest in zip(found, salts, digests):
+                pk, using = users[email]
+                written.setdefault(using, []).append((pk, email, salt, digest))
+            for using, rows in written.items():
+                with commit_on_success_unless_managed(using):
+                    _update_passwords([(pk, salt, digest) for pk, _, salt, digest in rows],
+                                      now, using)
+                    lookup.sync_addresses([email for _, email, _, _ in rows], using)
+                    changes.record_rows(MailUser, 'pk', [pk for pk, _, _, _ in rows],
+                                        using=using)
+            count += len(found)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return count, missing
+
+
+def _update_passwords(rows, now, using=None):
+    """
+    Write the salt and digest of each (id, salt, digest) of `rows` to the
+    mail users on the database `using`, with one UPDATE per batch of as
+    many rows as the database takes parameters for, choosing each row's
+    values by primary key with CASE.
+    """
+    using = using or router.db_for_write(MailUser)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    opts = MailUser._meta
+    pk, salt, digest, modified = [qn(opts.get_field(name).column) for name in
+                                  ('id', 'salt', 'shadigest', 'modified')]
+    # each row takes five parameters, two in each CASE and one in the IN list
+    size = max(connection.ops.bulk_batch_size(range(5), rows), 1)
+    cursor = connection.cursor()
+    for i in range(0, len(rows), size):
+        batch = rows[i:i + size]
+        case = 'CASE {0} {1} END'.format(pk, ' '.join(['WHEN %s THEN %s'] * len(batch)))
+        sql = 'UPDATE {0} SET {1} = {2}, {3} = {2}, {4} = %s WHERE {5} IN ({6})'.format(
+            qn(opts.db_table), salt, case, digest, modified, pk, ', '.join(['%s'] * len(batch)))
+        params = ([value for row_pk, row_salt, _ in batch for value in (row_pk, row_salt)] +
+                  [value for row_pk, _, row_digest in batch for value in (row_pk, row_digest)] +
+                  [connection.ops.value_to_db_datetime(now)] +
+                  [row_pk for row_pk, _, _ in batch])
+        cursor.execute(sql, params)
+
+
+def _find_users(emails):
+    """
+    Return a dictionary of the (id, shard) of each mail user, keyed by
+    email address, with one query per shard.
+    """
+    users = {}
+    for using, addresses in shards.group_addresses(emails).items():
+        for pk, email in (MailUser.objects.using(using).filter(email__in=addresses)
+                          .values_list('pk', 'email')):
+            users[email] = (pk, using)
+    return users
+
+
+def set_domains_active(domains, active, members=False):
+    """
+    Set the active flag of each domain of the queryset `domains`, and
+    copy it to the domains' mail users and aliases, with set-based
+    updates in a single transaction, and one per shard of the domains.
+    If `members` is True the active flag of the mail users and aliases
+    themselves is set too.  Rows which already have the flag are not
+    written.
+
+    Returns a (domains, mail users, aliases) tuple of the number of
+    rows whose active flag was set.
+    """
+    now = timezone.now()
+    with commit_on_success_unless_managed():
+        pks = list(domains.values_list('pk', flat=True))
+        changed = {Domain: list(Domain.objects.filter(pk__in=pks).exclude(active=active)
+                                .values_list('pk', flat=True))}
+        count = Domain.objects.filter(pk__in=changed[Domain]).update(
+            active=active, modified=now)
+        shards.copy_domains(changed[Domain])
+        changes.record_rows(Domain, 'pk', changed[Domain])
+        counts = [count, 0, 0]
+        by_shard = {}
+        for pk, shard in Domain.objects.filter(pk__in=pks).values_list('pk', 'shard'):
+            by_shard.setdefault(shard or None, []).append(pk)
+        for using, shard_pks in sorted(by_shard.items()):
+            with commit_on_success_unless_managed(using):
+                for i, model in enumerate((MailUser, Alias), 1):
+                    rows = model.objects.using(using).filter(domain__in=shard_pks)
+                    unchanged = {'domain_active': active}
+                    if members:
+                        unchanged['active'] = active
+                    changed_pks = list(rows.exclude(**unchanged).values_list('pk', flat=True))
+                    rows.exclude(domain_active=active).update(domain_active=active,
+                                                              modified=now)
+                    if members:
+                        counts[i] += rows.exclude(active=active).update(active=active,
+                                                                        modified=now)
+                    changes.record_rows(model, 'pk', changed_pks, using=using)
+                for pk in shard_pks:
+                    lookup.sync_domain(pk, using)
+    Domain.objects.clear_cache()
+    return tuple(counts)
+
+
+def set_active(queryset, active):
+    """
+    Set the active flag of each mail user or alias of `queryset` with a
+    set-based update in a single transaction.  Returns the number of
+    rows whose active flag was set.
+    """
+    field = 'email' if queryset.model is MailUser else 'source'
+    # the database the queryset was sent to, such as a shard, else the one it writes to
+    using = queryset._db or router.db_for_write(queryset.model)
+    with commit_on_success_unless_managed(using):
+        queryset = queryset.using(using).exclude(active=active)
+        rows = list(queryset.values_list('pk', field))
+        count = queryset.update(active=active, modified=timezone.now())
+        lookup.sync_addresses([address for _, address in rows], using)
+        changes.record_rows(queryset.model, 'pk', [pk for pk, _ in rows], using=using)
+    return count
+
+
+def move_mailboxes(users, domain, batch_size=500):
+    """
+    Move each mail user of the queryset `users` into `domain`, keeping
+    their usernames, in a single transaction.  The mail users are
+    updated `batch_size` at a time by primary key.  Mail users whose
+    username is already taken in `domain` are not moved.
+
+    Returns a (count, conflicts) tuple, the number of mail users moved,
+    and a sorted list of the email addresses which were not moved.
+    Raises ValueError if any of the mail users is on another shard than
+    `domain`; move the domain with `vmail.shards.move_domain` first.
+    """
+    using = domain.shard or None
+    domains = set(users.values_list('domain', flat=True))
+    if Domain.objects.filter(pk__in=domains).exclude(shard=domain.shard).exists():
+        raise ValueError("Mail users can only be moved to '{0}' from domains on the"
+                         " same shard.".format(domain.fqdn))
+    users = users.using(using).exclude(domain=domain)
+    taken = MailUser.objects.using(using).filter(domain=domain).values('username')
+    with commit_on_success_unless_managed(using):
+        conflicts = sorted(users.filter(username__in=taken).values_list('email', flat=True))
+        moving = list(users.exclude(username__in=taken).values_list('pk', 'username', 'email'))
+        now = timezone.now()
+        for i in range(0, len(moving), batch_size):
+            MailUser.objects.using(using).filter(
+                pk__in=[pk for pk, _, _ in moving[i:i + batch_size]]).update(
+                    domain=domain, domain_active=domain.active, modified=now)
+        domain.update_emails(using)
+        addresses = [email for _, _, email in moving]
+        addresses.extend('{0}@{1}'.format(username, domain.fqdn) for _, username, _ in moving)
+        lookup.sync_addresses(addresses, using)
+        changes.record_rows(MailUser, 'pk', [pk for pk, _, _ in moving], using=using)
+    return len(moving), conflicts
+
+
+def delete_rows(queryset, batch_size=500, progress=None):
+    """
+    Delete each mail user or alias of `queryset`, `batch_size` rows at
+    a time by primary key, each batch in its own short transaction with
+    a single DELETE, rather than collecting the rows in memory and
+    deleting them one at a time, as `queryset.delete()` does.  The
+    lookup entries and change log are updated with each batch.  If
+    given, `progress` is called with the number of rows deleted so far
+    after each batch.  Returns the number of rows deleted.
+    """
+    model = queryset.model
+    field = 'email' if model is MailUser else 'source'
+    using = queryset._db or router.db_for_write(model)
+    rows = queryset.using(using).order_by('pk').values_list('pk', field)
+    count, cursor = 0, 0
+    while True:
+        batch = list(rows.filter(pk__gt=cursor)[:batch_size])
+        if not batch:
+            break
+        cursor = batch[-1][0]
+        pks = [pk for pk, _ in batch]
+        with commit_on_success_unless_managed(using):
+            changes.record_rows(model, 'pk', pks, Change.DELETE, using=using)
+            model.objects.using(using).filter(pk__in=pks)._raw_delete(using)
+            lookup.sync_addresses([address for _, address in batch], using)
+        count += len(batch)
+        if progress is not None:
+            progress(count)
+    return count
+
+
+def delete_domain(domain, batch_size=500, progress=None):
+    """
+    Delete a domain, after deleting its aliases and mail users with
+    `delete_rows`, so the domain's own delete has nothing left to
+    cascade to.  `progress` is called with the model and the number of
+    its rows deleted so far.  Returns a (mail users, aliases) tuple of
+    the number of rows deleted.
+    """
+    using = domain.shard or None
+    counts = []
+    for model in (Alias, MailUser):
+        counts.append(delete_rows(model.objects.using(using).filter(domain=domain), batch_size,
+                                  progress and partial(progress, model)))
+    domain.delete()
+    return counts[1], counts[0]
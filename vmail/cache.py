@@ -0,0 +1,66 @@
+"""
+A small thread-safe cache used by the lookup services.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    A bounded least-recently-used cache.  Once `maxsize` entries are
+    held the least recently used entry is evicted.  If `ttl` is given,
+    entries older than `ttl` seconds are treated as missing.  The
+    number of `get` calls which found, and did not find, an entry are
+    counted in `hits` and `misses`.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= time.time():
+                self.misses += 1
+                return default
+            self._data[key] = (value, expires)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires = None if self.ttl is None else time.time() + self.ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_matching(self, predicate):
+        """Delete every entry for which `predicate(key, value)` is true."""
+        with self._lock:
+            keys = [key for key, (value, expires) in self._data.iteritems()
+                    if predicate(key, value)]
+            for key in keys:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,88 @@
+"""
+Constant database (cdb) writer and reader.
+
+Postfix reads cdb files directly as 'cdb:' lookup tables.  See
+http://cr.yp.to/cdb/cdb.txt for the file format.
+"""
+
+import struct
+
+HEADER_SIZE = 256 * 8
+
+
+def cdb_hash(key):
+    h = 5381
+    for c in key:
+        h = ((h << 5) + h) & 0xffffffff ^ ord(c)
+    return h
+
+
+def _bytes(data):
+    if isinstance(data, unicode):
+        return data.encode('utf-8')
+    return data
+
+
+class CDBWriter(object):
+    """
+    Writes records to the seekable binary file `fp`.  Records are
+    written as they are added, so only a (hash, position) pair per
+    record is held in memory.  `finish` must be called to write the
+    hash tables.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.fp.seek(HEADER_SIZE)
+        self.pos = HEADER_SIZE
+        self.tables = [[] for i in range(256)]
+
+    def add(self, key, value):
+        key, value = _bytes(key), _bytes(value)
+        self.fp.write(struct.pack('<LL', len(key), len(value)))
+        self.fp.write(key)
+        self.fp.write(value)
+        h = cdb_hash(key)
+        self.tables[h & 0xff].append((h, self.pos))
+        self.pos += 8 + len(key) + len(value)
+
+    def finish(self):
+        header = []
+        for table in self.tables:
+            length = len(table) * 2
+            slots = [(0, 0)] * length
+            for h, pos in table:
+                i = (h >> 8) % length
+                while slots[i][1]:
+                    i = (i + 1) % length
+                slots[i] = (h, pos)
+            header.append((self.pos, length))
+            for h, pos in slots:
+                self.fp.write(struct.pack('<LL', h, pos))
+            self.pos += 8 * length
+        self.fp.seek(0)
+        for pos, length in header:
+            self.fp.write(struct.pack('<LL', pos, length))
+
+
+def cdb_get(data, key):
+    """
+    Return the first value of `key` in the cdb file contents `data`,
+    or None if the key is not found.
+    """
+    key = _bytes(key)
+    h = cdb_hash(key)
+    pos, length = struct.unpack_from('<LL', data, (h & 0xff) * 8)
+    if not length:
+        return None
+    i = (h >> 8) % length
+    for _ in range(length):
+        slot_hash, record = struct.unpack_from('<LL', data, pos + i * 8)
+        if not record:
+            return None
+        if slot_hash == h:
+            klen, vlen = struct.unpack_from('<LL', data, record)
+            if data[record + 8:record + 8 + klen] == key:
+                return data[record + 8 + klen:record + 8 + klen + vlen]
+        i = (i + 1) % length
+    return None
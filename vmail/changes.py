@@ -0,0 +1,199 @@
+"""
+A log of the changes to the domains, mail users and aliases.
+
+Every create, update and delete of a `Domain`, `MailUser` or `Alias`
+is appended to the `vmail_change` table as a `Change`, whose primary
+key is an increasing sequence number, with the object's fields.  A
+consumer mirroring the mail database reads the changes after the last
+sequence number it has seen, its cursor, with `since`, so it syncs in
+time proportional to the changes rather than to the tables.
+
+Code which bypasses the model signals, such as bulk_create or queryset
+updates, must call `record_rows` itself.  `compact` drops changes
+superseded by a later change of the same object, and deletes, once they
+are older than the retention period.  A consumer whose cursor is older
+than the last dropped delete must re-read the tables; `since` raises
+`CursorExpired` for it.  Each database holding mail users and aliases,
+such as each shard, has its own log, which the functions below read
+and write on `using`.
+"""
+
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.utils import timezone
+
+from .db import commit_on_success_unless_managed
+from .models import Domain, MailUser, Alias, Change
+
+# Rows read or written per query, below SQLite's limit of query parameters.
+BATCH_SIZE = 500
+
+MODELS = dict((model._meta.module_name, model) for model in (Domain, MailUser, Alias))
+
+
+class CursorExpired(Exception):
+    """
+    The changes after a cursor have been compacted away.  `horizon` is
+    the cursor the consumer can continue from after re-reading the
+    tables, once it has taken a cursor with `latest` first.
+    """
+
+    def __init__(self, cursor, horizon):
+        super(CursorExpired, self).__init__(
+            'Changes after {0} have been compacted, up to {1}.'.format(cursor, horizon))
+        self.cursor = cursor
+        self.horizon = horizon
+
+
+def _fields(model):
+    return [field.attname for field in model._meta.local_fields]
+
+
+def _dumps(values):
+    return json.dumps(values, cls=DjangoJSONEncoder, sort_keys=True, separators=(',', ':'))
+
+
+def record(instance, action, using=None):
+    """Append a change of the action to a domain, mail user or alias."""
+    model = type(instance)
+    values = dict((name, getattr(instance, name)) for name in _fields(model))
+    return Change.objects.using(using).create(model=model._meta.module_name,
+                                              object_id=instance.pk,
+                                              action=action, data=_dumps(values))
+
+
+def record_rows(model, field, values, action=Change.UPDATE, using=None):
+    """
+    Append a change of the action to each row of `model` whose `field`
+    is one of `values`, such as after a queryset update or bulk_create.
+    Returns the number of changes appended.
+    """
+    values = sorted(set(values))
+    names = _fields(model)
+    count = 0
+    with commit_on_success_unless_managed(using):
+        for i in range(0, len(values), BATCH_SIZE):
+            rows = model.objects.using(using).filter(**{field + '__in': values[i:i + BATCH_SIZE]})
+            changes = [Change(model=model._meta.module_name, object_id=row['id'],
+                              action=action, data=_dumps(row))
+                       for row in rows.order_by('pk').values(*names)]
+            Change.objects.using(using).bulk_create(changes)
+            count += len(changes)
+    return count
+
+
+def latest(using=None):
+    """Return the sequence number of the latest change, a cursor to read on from."""
+    return Change.objects.using(using).aggregate(latest=Max('pk'))['latest'] or 0
+
+
+def horizon(using=None):
+    """
+    Return the sequence number of the last delete compacted away.  Only
+    consumers with a cursor of at least this have seen every delete.
+    """
+    marker = (Change.objects.using(using).filter(action=Change.EXPIRED)
+              .values_list('object_id', flat=True))
+    return marker[0] if marker else 0
+
+
+def since(cursor=0, limit=None, using=None):
+    """
+    Yield the changes after the cursor in order, `BATCH_SIZE` at a
+    time, and at most `limit` of them.  Raises `CursorExpired` if
+    changes after the cursor have been compacted away.
+    """
+    expired_at = horizon(using)
+    if cursor < expired_at:
+        raise CursorExpired(cursor, expired_at)
+    count = 0
+    while limit is None or count < limit:
+        size = BATCH_SIZE if limit is None else min(BATCH_SIZE, limit - count)
+        batch = list(Change.objects.using(using).filter(pk__gt=cursor)
+                     .exclude(action=Change.EXPIRED).order_by('pk')[:size])
+        for change in batch:
+            yield change
+        if len(batch) < size:
+            return
+        count += len(batch)
+        cursor = batch[-1].pk
+
+
+def compact(days=None, using=None):
+    """
+    Drop the changes older than `days`, by default the
+    VMAIL_CHANGE_RETENTION_DAYS setting (30), which are followed by a
+    later change of the same object, and the deletes older than that.
+    The latest change of every existing object is kept, so a consumer
+    reading from any unexpired cursor still sees each object's fields.
+    Returns the number of changes dropped.
+    """
+    if days is None:
+        days = getattr(settings, 'VMAIL_CHANGE_RETENTION_DAYS', 30)
+    cutoff = timezone.now() - timedelta(days=days)
+    # the latest change is kept, as some databases reuse the highest key
+    # once it is deleted, and a sequence number must never be reused
+    changes = Change.objects.using(using)
+    old = (changes.filter(created__lt=cutoff, pk__lt=latest(using))
+           .exclude(action=Change.EXPIRED)
+           .order_by('pk').values_list('pk', 'model', 'object_id', 'action'))
+    dropped, expired_at, cursor = 0, None, 0
+    with commit_on_success_unless_managed(using):
+        while True:
+            batch = list(old.filter(pk__gt=cursor)[:BATCH_SIZE])
+            if not batch:
+                break
+            cursor = batch[-1][0]
+            latest_pks = {}
+            for name in set(model for _, model, _, _ in batch):
+                ids = [object_id for _, model, object_id, _ in batch if model == name]
+                for row in (changes.filter(model=name, object_id__in=ids)
+                            .values('object_id').annotate(latest=Max('pk'))):
+                    latest_pks[name, row['object_id']] = row['latest']
+            stale = []
+            for pk, model, object_id, action in batch:
+                if pk < latest_pks[model, object_id]:
+                    stale.append(pk)
+                elif action == Change.DELETE:
+                    stale.append(pk)
+                    expired_at = pk
+            changes.filter(pk__in=stale).delete()
+            dropped += len(stale)
+        if expired_at is not None and expired_at > horizon(using):
+            if not changes.filter(action=Change.EXPIRED).update(object_id=expired_at):
+                changes.create(model='', object_id=expired_at, action=Change.EXPIRED)
+    return dropped
+
+
+def _remember_domain(sender, instance, raw=False, using=None, **kwargs):
+    # the mail users and aliases change with the domain name or active flag
+    instance._change_old = None
+    if instance.pk is not None and not raw:
+        old = (Domain.objects.using(using).filter(pk=instance.pk)
+               .values_list('fqdn', 'active')[:1])
+        instance._change_old = old[0] if old else None
+
+
+def _saved(sender, instance, created=False, raw=False, using=None, **kwargs):
+    if raw:
+        return
+    record(instance, Change.CREATE if created else Change.UPDATE, using)
+    old = getattr(instance, '_change_old', None)
+    if sender is Domain and old is not None and old != (instance.fqdn, instance.active):
+        record_rows(MailUser, 'domain', [instance.pk], using=instance.shard or using)
+        record_rows(Alias, 'domain', [instance.pk], using=instance.shard or using)
+
+
+def _deleted(sender, instance, using=None, **kwargs):
+    record(instance, Change.DELETE, using)
+
+
+pre_save.connect(_remember_domain, sender=Domain)
+for model in MODELS.values():
+    post_save.connect(_saved, sender=model)
+    post_delete.connect(_deleted, sender=model)
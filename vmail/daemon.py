@@ -0,0 +1,92 @@
+"""
+Helpers shared by the long-running lookup service commands.
+"""
+
+import os
+import socket
+import stat
+import threading
+import SocketServer
+
+from .db import close_connections
+
+
+class ThreadingUnixStreamServer(SocketServer.ThreadingMixIn,
+                                SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class ThreadingTCPServer(SocketServer.ThreadingMixIn,
+                         SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def parse_address(address):
+    """
+    Parse a Postfix style listen address, either 'unix:/path/to/socket'
+    or 'inet:host:port', and return a (family, address) tuple.  Raises
+    `ValueError` if the address cannot be parsed.
+    """
+    kind, _, rest = address.partition(':')
+    if kind == 'unix' and rest:
+        return socket.AF_UNIX, rest
+    if kind == 'inet':
+        host, _, port = rest.rpartition(':')
+        if port.isdigit():
+            return socket.AF_INET, (host or '127.0.0.1', int(port))
+    raise ValueError("Improperly formatted listen address: '{0}'.".format(address))
+
+
+def make_server(address, handler_class, mode=0o660):
+    """
+    Return a threaded socket server bound to the Postfix style
+    `address`, dispatching connections to `handler_class`.  A stale
+    UNIX socket left behind by a previous run is removed first, and
+    the new socket is given permissions `mode`.
+    """
+    family, addr = parse_address(address)
+    if family != socket.AF_UNIX:
+        return ThreadingTCPServer(addr, handler_class)
+
+    try:
+        if stat.S_ISSOCK(os.stat(addr).st_mode):
+            os.unlink(addr)
+    except OSError:
+        pass
+    server = ThreadingUnixStreamServer(addr, handler_class)
+    os.chmod(addr, mode)
+    return server
+
+
+class Reloader(threading.Thread):
+    """
+    Background thread which calls `reload` every `interval` seconds, or
+    immediately when `trigger` is called (from a signal handler, for
+    example).  An interval of 0 disables periodic reloads.  The database
+    connections are closed after every reload so an idle daemon does not
+    hold one open.
+    """
+
+    def __init__(self, reload, interval=0, errors=None):
+        super(Reloader, self).__init__()
+        self.daemon = True
+        self.reload = reload
+        self.interval = interval or None
+        self.errors = errors
+        self._event = threading.Event()
+
+    def trigger(self):
+        self._event.set()
+
+    def run(self):
+        while True:
+            self._event.wait(self.interval)
+            self._event.clear()
+            try:
+                self.reload()
+            except Exception as e:
+                if self.errors is not None:
+                    self.errors.write('Reload failed: {0}\n'.format(e))
+            finally:
+                close_connections()
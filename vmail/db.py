@@ -0,0 +1,64 @@
+"""
+Database helpers shared by the bulk operations and services.
+"""
+
+from contextlib import contextmanager
+
+from django.db import connections, transaction
+
+
+@contextmanager
+def commit_on_success_unless_managed(using=None):
+    """
+    Run a block in a transaction which is committed if the block
+    succeeds, like `transaction.commit_on_success`, unless a transaction
+    is already being managed, in which case the block joins it.  Unlike
+    `commit_on_success`, these blocks may be nested.
+    """
+    forced_managed = not transaction.is_managed(using=using)
+    if forced_managed:
+        transaction.enter_transaction_management(using=using)
+        # entering management alone keeps the outer, autocommit, state
+        transaction.managed(True, using=using)
+    try:
+        yield
+        if forced_managed:
+            transaction.commit(using=using)
+    except:
+        if forced_managed:
+            transaction.rollback(using=using)
+        raise
+    finally:
+        if forced_managed:
+            transaction.leave_transaction_management(using=using)
+
+
+def close_connections():
+    """
+    Close the current thread's connections to every database, the
+    replicas as well as the primary.
+    """
+    for connection in connections.all():
+        connection.close()
+
+
+def iterate_by_pk(queryset, batch_size=500):
+    """
+    Yield the rows of `queryset`, a `values_list` queryset whose first
+    field is the primary key, in primary key order, reading
+    `batch_size` rows per query.  Each query starts after the last key
+    read, rather than at an OFFSET, so the memory used, and the cost of
+    each query, stay the same however many rows there are.  Django has
+    no server-side cursors, and `iterator()` alone still has the
+    database driver read the whole result set at once.
+    """
+    queryset = queryset.order_by('pk')
+    rows = queryset
+    while True:
+        count = 0
+        for row in rows[:batch_size].iterator():
+            count += 1
+            yield row
+        if count < batch_size:
+            return
+        rows = queryset.filter(pk__gt=row[0])
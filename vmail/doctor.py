@@ -0,0 +1,224 @@
+"""
+Set-based consistency checks of the virtual mail tables.
+
+Each check finds one kind of problem in a database with a few queries
+over whole tables, rather than object by object, and returns a list of
+(id, detail) pairs of the rows with the problem.  Checks which can be
+repaired have a fix, applied to the rows found `batch_size` at a time,
+each batch in its own short transaction.  With sharding, each database
+is checked on its own, so problems spanning shards, such as an alias
+loop through the domains of two shards, are not found.
+"""
+
+from collections import OrderedDict, namedtuple
+from multiprocessing.pool import ThreadPool
+
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from . import bulk, changes, lookup
+from .db import close_connections, commit_on_success_unless_managed
+from .models import Domain, MailUser, Alias
+from .routers import PRIMARY
+
+# A check's description, a function returning the (id, detail) pairs of
+# the rows with the problem in a database, and a function fixing a list
+# of those rows' ids in a database, returning the number fixed, or None
+# if the problem needs a person to fix it.
+Check = namedtuple('Check', 'description find fix')
+
+
+def find_alias_domains(using):
+    """Aliases owned by a domain other than the domain of their source."""
+    connection = connections[using]
+    if connection.vendor == 'mysql':
+        length, domain, wildcard = 'CHAR_LENGTH', "CONCAT('@', d.fqdn)", "CONCAT('@.', d.fqdn)"
+    else:
+        length, domain, wildcard = 'LENGTH', "'@' || d.fqdn", "'@.' || d.fqdn"
+    cursor = connection.cursor()
+    cursor.execute('SELECT a.id, a.source, d.fqdn FROM vmail_alias a'
+                   ' INNER JOIN vmail_domain d ON d.id = a.domain_id'
+                   ' WHERE SUBSTR(a.source, {0}(a.source) - {0}(d.fqdn)) <> {1}'
+                   ' AND a.source <> {2} ORDER BY a.id'.format(length, domain, wildcard))
+    return [(pk, '{0} is owned by {1}'.format(source, fqdn))
+            for pk, source, fqdn in cursor.fetchall()]
+
+
+def fix_alias_domains(pks, using):
+    """
+    Move the aliases to the domain of their source, where that domain
+    is kept on the same database.
+    """
+    rows = Alias.objects.using(using).filter(pk__in=pks).values_list('pk', 'source')
+    # a wildcard's (@.example.org) domain is the domain of its subdomains
+    fqdns = dict((pk, source.rpartition('@')[2].lstrip('.')) for pk, source in rows)
+    domains = dict((domain.fqdn, domain) for domain in Domain.objects.using(using)
+                   .filter(fqdn__in=set(fqdns.values())))
+    moving = {}
+    for pk, fqdn in fqdns.items():
+        domain = domains.get(fqdn)
+        if domain is not None and (domain.shard or PRIMARY) == using:
+            moving.setdefault(domain, []).append(pk)
+    now = timezone.now()
+    count = 0
+    for domain, domain_pks in moving.items():
+        count += Alias.objects.using(using).filter(pk__in=domain_pks).update(
+            domain=domain, domain_active=domain.active, modified=now)
+        changes.record_rows(Alias, 'pk', domain_pks, using=using)
+    lookup.sync_addresses(Alias.objects.using(using).filter(pk__in=pks)
+                          .values_list('source', flat=True), using)
+    return count
+
+
+def find_empty_passwords(using):
+    """Active mailboxes with no password digest."""
+    return [(pk, email) for pk, email in
+            MailUser.objects.using(using).filter(shadigest='', active=True)
+            .order_by('pk').values_list('pk', 'email')]
+
+
+def fix_empty_passwords(pks, using):
+    """Deactivate the mailboxes, until they are given a password."""
+    return bulk.set_active(MailUser.objects.using(using).filter(pk__in=pks), False)
+
+
+def find_inactive_destinations(using):
+    """Active aliases to local mailboxes which are inactive, or in an inactive domain."""
+    inactive = (MailUser.objects.using(using).filter(Q(active=False) | Q(domain_active=False))
+                .values('email'))
+    return [(pk, '{0} > {1}'.format(source, destination)) for pk, source, destination in
+            Alias.objects.using(using).filter(active=True, domain_active=True,
+                                              destination__in=inactive)
+            .order_by('pk').values_list('pk', 'source', 'destination')]
+
+
+def fix_inactive_destinations(pks, using):
+    """Deactivate the aliases."""
+    return bulk.set_active(Alias.objects.using(using).filter(pk__in=pks), False)
+
+
+def find_alias_loops(using):
+    """
+    Active aliases which lead back to their source, through one or more
+    other aliases, found as the strongly connected components of the
+    alias graph.  An alias of an address to itself, which keeps a copy
+    of the mail, is not a loop.  Each loop is reported once, by the
+    lowest id of its aliases.
+    """
+    graph, ids = {}, {}
+    for pk, source, destination in (
+            Alias.objects.using(using).filter(active=True, domain_active=True)
+            .values_list('pk', 'source', 'destination').iterator()):
+        if source == destination:
+            continue
+        graph.setdefault(source, []).append(destination)
+        ids[source, destination] = min(pk, ids.get((source, destination), pk))
+    components = list(_components(graph))
+    number = dict((member, i) for i, component in enumerate(components) for member in component)
+    # the lowest id of the aliases within each component, in one pass over the aliases
+    lowest = {}
+    for (source, destination), pk in ids.items():
+        i = number.get(source)
+        if i is not None and i == number.get(destination):
+            lowest[i] = min(pk, lowest.get(i, pk))
+    return sorted((lowest[i], 'loop through {0}'.format(', '.join(sorted(component))))
+                  for i, component in enumerate(components))
+
+
+def _components(graph):
+    """
+    Yield the strongly connected components of more than one node of
+    the directed `graph`, a dictionary of the lists of each node's
+    successors, with Tarjan's algorithm, iteratively so deep alias
+    chains cannot exhaust the stack.
+    """
+    index, low, stack, on_stack = {}, {}, [], set()
+    for root in graph:
+        if root in index:
+            continue
+        work = [(root, iter(graph.get(root, ())))]
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, successors = work[-1]
+            for successor in successors:
+                if successor not in index:
+                    index[successor] = low[successor] = len(index)
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(graph.get(successor, ()))))
+                    break
+                if successor in on_stack:
+                    low[node] = min(low[node], index[successor])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1:
+                        yield component
+
+
+CHECKS = OrderedDict([
+    ('alias-domain', Check('aliases owned by a domain other than their source\'s',
+                           find_alias_domains, fix_alias_domains)),
+    ('empty-password', Check('active mailboxes without a password',
+                             find_empty_passwords, fix_empty_passwords)),
+    ('inactive-destination', Check('active aliases to inactive local mailboxes',
+                                   find_inactive_destinations, fix_inactive_destinations)),
+    ('alias-loop', Check('alias loops', find_alias_loops, None)),
+])
+
+
+def _find(job):
+    name, using = job
+    return CHECKS[name].find(using)
+
+
+def _find_in_thread(job):
+    try:
+        return _find(job)
+    finally:
+        close_connections()
+
+
+def run(names, databases, workers=None):
+    """
+    Run the checks named `names` on each of the `databases`, across a
+    pool of `workers` threads, each with its own connections (one per
+    check and database by default, or in this thread if `workers` is
+    1).  Returns a list of ((name, database), problems) pairs, in the
+    order of the checks and databases.
+    """
+    jobs = [(name, using) for name in names for using in databases]
+    if workers == 1 or len(jobs) < 2:
+        return zip(jobs, map(_find, jobs))
+    pool = ThreadPool(workers or len(jobs))
+    try:
+        return zip(jobs, pool.map(_find_in_thread, jobs))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def fix(name, pks, using, batch_size=500):
+    """
+    Fix the problems of the check `name` in the rows with the ids `pks`
+    of the database `using`, `batch_size` rows at a time, each batch in
+    its own transaction.  Returns the number of rows fixed.
+    """
+    count = 0
+    for i in range(0, len(pks), batch_size):
+        with commit_on_success_unless_managed(using):
+            count += CHECKS[name].fix(pks[i:i + batch_size], using)
+    return count
@@ -0,0 +1,114 @@
+"""
+Dovecot dict proxy protocol server answering passdb lookups from a
+credential cache.
+
+Dovecot sends a hello line, followed by one lookup line per request:
+
+    H2<TAB>0<TAB>0<TAB><user><TAB><dict-name>
+    Lshared/passdb/john@example.org
+
+and expects 'O<value>' when the key is found, 'N' when it is not found,
+and 'F' on failure.  The value is a JSON object of passdb fields.
+"""
+
+import json
+from collections import namedtuple
+import SocketServer
+
+from django.db.models.signals import post_save, post_delete
+
+from .cache import LRUCache
+from .db import close_connections
+from .hashers import dovecot_password
+from .models import Domain, MailUser
+
+PASSDB_PREFIX = 'shared/passdb/'
+
+
+Credentials = namedtuple('Credentials', 'user digest active user_id domain_id')
+
+
+class CredentialCache(object):
+    """
+    A bounded, expiring cache of mail user credentials keyed by email
+    address.  Addresses which do not exist are cached too, so repeated
+    logins for unknown users do not reach the database.  Entries are
+    invalidated when a `MailUser` or `Domain` is saved or deleted in
+    this process; changes made elsewhere are picked up once the entry
+    expires after `ttl` seconds.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60):
+        self.cache = LRUCache(maxsize, ttl)
+        for signal in (post_save, post_delete):
+            signal.connect(self._user_changed, sender=MailUser)
+            signal.connect(self._domain_changed, sender=Domain)
+
+    def lookup(self, email):
+        """
+        Return the `Credentials` for an email address.  The digest is
+        None if the mail user does not exist.
+        """
+        email = email.strip().lower()
+        credentials = self.cache.get(email)
+        if credentials is None:
+            credentials = self._fetch(email)
+            self.cache.set(email, credentials)
+        return credentials
+
+    def _fetch(self, email):
+        users = (MailUser.objects.using(Domain.objects.shard_for(email.rpartition('@')[2]))
+                 .filter(email=email)
+                 .values_list('shadigest', 'active', 'domain_active', 'pk', 'domain_id'))
+        for digest, active, domain_active, user_id, domain_id in users[:1]:
+            return Credentials(email, digest, active and domain_active, user_id, domain_id)
+        return Credentials(email, None, False, None, None)
+
+    def _user_changed(self, sender, instance, **kwargs):
+        # the domain may already be deleted, so match on the username alone
+        prefix = instance.username + '@'
+        self.cache.delete_matching(
+            lambda key, entry: key.startswith(prefix) or entry.user_id == instance.pk)
+
+    def _domain_changed(self, sender, instance, **kwargs):
+        suffix = '@' + instance.fqdn
+        self.cache.delete_matching(
+            lambda key, entry: key.endswith(suffix) or entry.domain_id == instance.pk)
+
+
+def passdb_reply(credentials, key):
+    """Return the dict protocol reply for a single lookup key."""
+    if not key.startswith(PASSDB_PREFIX):
+        return 'N'
+    try:
+        entry = credentials.lookup(key[len(PASSDB_PREFIX):])
+    except Exception:
+        return 'F'
+    if not entry.active or not entry.digest:
+        return 'N'
+    fields = {'user': entry.user, 'password': dovecot_password(entry.digest)}
+    return 'O' + json.dumps(fields)
+
+
+class DictHandler(SocketServer.StreamRequestHandler):
+    """
+    Request handler answering dict protocol lookups against the
+    `CredentialCache` stored on the server as `server.credentials`.
+    """
+
+    def handle(self):
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                line = line.rstrip('\r\n')
+                if not line.startswith('L'):
+                    # hello, and unsupported commands which need no reply
+                    continue
+                key = line[1:].split('\t')[0]
+                reply = passdb_reply(self.server.credentials, key)
+                self.wfile.write(reply + '\n')
+                self.wfile.flush()
+        finally:
+            close_connections()
@@ -0,0 +1,56 @@
+"""
+Helpers for exporting the virtual mail tables to files.
+"""
+
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+from django.db.models import Count, Max
+
+
+@contextmanager
+def atomic_write(path, mode=0o644):
+    """
+    Open a temporary file next to `path` for writing, and rename it
+    over `path` once the block completes, so readers only ever see a
+    complete file.  The temporary file is removed if the block raises.
+    """
+    dirname, basename = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + basename + '.', dir=dirname or '.')
+    try:
+        with os.fdopen(fd, 'w+b') as fp:
+            yield fp
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.chmod(tmp_path, mode)
+        os.rename(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+
+def table_signature(queryset):
+    """
+    Return a cheap signature of the rows in `queryset` which changes
+    whenever a row is created, saved, or deleted: the row count, and
+    the latest modified time.
+    """
+    result = queryset.aggregate(count=Count('pk'), modified=Max('modified'))
+    modified = result['modified'].isoformat() if result['modified'] else None
+    return [result['count'], modified]
+
+
+def load_state(path):
+    """Return the export state saved at `path`, or {} if there is none."""
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_state(path, state):
+    with atomic_write(path, mode=0o600) as fp:
+        json.dump(state, fp, indent=2, sort_keys=True)
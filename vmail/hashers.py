@@ -0,0 +1,387 @@
+"""
+Password schemes for mail user passwords.
+
+A digest is stored prefixed with the name of its scheme, in the format
+Dovecot understands: '{SCHEME}digest'.  A digest without a prefix is an
+SSHA digest, which is how SSHA digests are stored so that existing
+Dovecot configurations using 'default_pass_scheme = SSHA' keep working.
+
+The scheme used for new passwords is set with VMAIL_PASSWORD_SCHEME
+(default 'SSHA'), and the cost of schemes which have one is set with
+VMAIL_PASSWORD_COSTS, for example {'PBKDF2': 10000}.  The salted digest
+schemes, SSHA, SSHA512 and BLAKE2B, have no cost, and a cost configured
+for them is ignored.
+
+Hashing holds the interpreter lock, so a costly scheme stalls every
+other thread of a threaded web server while a password is hashed.
+With VMAIL_HASH_WORKERS set to a number of processes, passwords are
+hashed in a `HashPool` of worker processes instead, and the calling
+thread waits without holding the lock, for up to VMAIL_HASH_TIMEOUT
+seconds (default 30), after which it hashes the password itself.
+"""
+
+import base64
+import binascii
+import hashlib
+import os
+import multiprocessing
+import string
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare, pbkdf2
+
+try:
+    blake2b = hashlib.blake2b
+except AttributeError:
+    try:
+        from pyblake2 import blake2b
+    except ImportError:
+        blake2b = None
+
+
+# avoid whitespace in salts
+SALT_CHARS = string.letters + string.digits + string.punctuation
+
+_salt_tables = {}
+
+
+def make_salt(length, chars=SALT_CHARS):
+    """Return a random salt of `length` characters from `chars`."""
+    try:
+        table, discard = _salt_tables[chars]
+    except KeyError:
+        # map the random bytes below a multiple of len(chars) onto chars, and
+        # discard the remaining bytes so every character is equally likely
+        table = ''.join(chars[i % len(chars)] for i in xrange(256))
+        discard = ''.join(chr(i) for i in xrange(256 - 256 % len(chars), 256))
+        _salt_tables[chars] = table, discard
+    salt = ''
+    while len(salt) < length:
+        salt += os.urandom(length).translate(table, discard)
+    return salt[:length]
+
+
+class PasswordScheme(object):
+    """
+    Base class of a password scheme.  `cost` is the work factor of the
+    scheme, for schemes which have one, and None otherwise.
+    """
+    name = None
+    default_cost = None
+    salt_length = 96
+    salt_chars = SALT_CHARS
+
+    def make_salt(self):
+        return make_salt(self.salt_length, self.salt_chars)
+
+    def encode(self, raw_password, salt, cost=None):
+        """Return the prefixed digest of `raw_password`."""
+        raise NotImplementedError
+
+    def verify(self, raw_password, digest):
+        """Return True if `raw_password` matches the digest."""
+        raise NotImplementedError
+
+    def cost(self, digest):
+        """Return the cost the digest was encoded with."""
+        return None
+
+    def _strip(self, digest):
+        prefix = '{' + self.name + '}'
+        return digest[len(prefix):] if digest.startswith(prefix) else digest
+
+
+class SaltedDigestScheme(PasswordScheme):
+    """
+    A salted hash with the salt appended to the digest before base64
+    encoding: Base64(hash(password + salt) + salt).
+    """
+    digest = None
+    prefixed = True
+
+    def encode(self, raw_password, salt, cost=None):
+        # base64 does not work on unicode, so convert all django unicode strings
+        # into normalized strings first. Use str, since it will throw an error
+        # if there are non-ascii characters
+        m = self.digest()
+        m.update(str(raw_password))
+        m.update(str(salt))
+        encoded = base64.b64encode(m.digest() + str(salt))
+        return '{' + self.name + '}' + encoded if self.prefixed else encoded
+
+    def verify(self, raw_password, digest):
+        try:
+            decoded = base64.b64decode(self._strip(digest))
+        except (TypeError, binascii.Error):
+            return False
+        size = self.digest().digest_size
+        if len(decoded) < size:
+            return False
+        encoded = self.encode(raw_password, decoded[size:])
+        return constant_time_compare(self._strip(encoded), self._strip(digest))
+
+
+class SSHAScheme(SaltedDigestScheme):
+    name = 'SSHA'
+    digest = hashlib.sha1
+    prefixed = False
+
+
+class SSHA512Scheme(SaltedDigestScheme):
+    name = 'SSHA512'
+    digest = hashlib.sha512
+
+
+class BLAKE2BScheme(SaltedDigestScheme):
+    name = 'BLAKE2B'
+    digest = blake2b
+
+
+class PBKDF2Scheme(PasswordScheme):
+    """
+    PBKDF2-HMAC-SHA1 in the Dovecot format:
+    {PBKDF2}$1$salt$rounds$hex-digest
+    """
+    name = 'PBKDF2'
+    default_cost = 5000
+    salt_length = 16
+    salt_chars = string.letters + string.digits
+
+    def encode(self, raw_password, salt, cost=None):
+        rounds = int(cost or self.default_cost)
+        key = pbkdf2(str(raw_password), str(salt), rounds, digest=hashlib.sha1)
+        return '{{PBKDF2}}$1${0}${1}${2}'.format(salt, rounds, binascii.hexlify(key))
+
+    def _parse(self, digest):
+        fields = self._strip(digest).split('$')
+        if len(fields) != 5 or fields[1] != '1' or not fields[3].isdigit():
+            return None
+        return fields[2], int(fields[3])
+
+    def verify(self, raw_password, digest):
+        parsed = self._parse(digest)
+        if parsed is None:
+            return False
+        salt, rounds = parsed
+        return constant_time_compare(self.encode(raw_password, salt, rounds), digest)
+
+    def cost(self, digest):
+        parsed = self._parse(digest)
+        return parsed[1] if parsed else None
+
+
+SCHEMES = OrderedDict()
+
+
+def register_scheme(scheme):
+    """Register a `PasswordScheme` instance, replacing any of the same name."""
+    SCHEMES[scheme.name] = scheme
+    return scheme
+
+
+SSHA = register_scheme(SSHAScheme())
+register_scheme(SSHA512Scheme())
+register_scheme(PBKDF2Scheme())
+if blake2b is not None:
+    register_scheme(BLAKE2BScheme())
+
+
+def get_scheme(name=None):
+    """
+    Return the registered scheme `name`, or the scheme configured for
+    new passwords.  Raises `KeyError` for an unknown scheme.
+    """
+    if name is None:
+        name = getattr(settings, 'VMAIL_PASSWORD_SCHEME', 'SSHA')
+    return SCHEMES[name.upper()]
+
+
+def get_cost(scheme):
+    """Return the configured cost of `scheme`, or None if it has no cost."""
+    if scheme.default_cost is None:
+        return None
+    costs = getattr(settings, 'VMAIL_PASSWORD_COSTS', {})
+    return costs.get(scheme.name, scheme.default_cost)
+
+
+def identify(digest):
+    """
+    Return the scheme of a stored digest, or None if its scheme is not
+    registered.  A digest without a '{SCHEME}' prefix is SSHA.
+    """
+    if not digest.startswith('{'):
+        return SSHA
+    name = digest[1:digest.find('}')]
+    return SCHEMES.get(name.upper())
+
+
+def _encode(name, raw_password, cost):
+    scheme = SCHEMES[name]
+    salt = scheme.make_salt()
+    return salt, scheme.encode(raw_password, salt, cost)
+
+
+def _verify(name, raw_password, digest):
+    return SCHEMES[name].verify(raw_password, digest)
+
+
+def _must_update(scheme, digest):
+    preferred = get_scheme()
+    if scheme is not preferred:
+        return True
+    return preferred.default_cost is not None and scheme.cost(digest) != get_cost(preferred)
+
+
+class _Done(object):
+    # a result known without a worker
+    def __init__(self, value):
+        self.value = value
+
+    def ready(self):
+        return True
+
+    def get(self, timeout=None):
+        return self.value
+
+
+class HashResult(object):
+    """The pending result of a `HashPool` call, returned by `get`."""
+
+    def __init__(self, result, finish=None):
+        self._result = result
+        self._finish = finish
+
+    def ready(self):
+        return self._result.ready()
+
+    def get(self, timeout=None):
+        value = self._result.get(timeout)
+        return self._finish(value) if self._finish is not None else value
+
+
+class HashPool(object):
+    """
+    A pool of `workers` processes, one per CPU by default, which hash
+    and verify passwords.  `make_password` and `check_password` take the
+    same arguments as the functions of this module, and return a
+    `HashResult` at once, whose `get` waits for the result.  The
+    processes are started on first use.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _apply(self, func, args):
+        with self._lock:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self.workers)
+        return self._pool.apply_async(func, args)
+
+    def make_password(self, raw_password, scheme=None, cost=None):
+        scheme = get_scheme(scheme)
+        if cost is None:
+            cost = get_cost(scheme)
+        return HashResult(self._apply(_encode, (scheme.name, raw_password, cost)))
+
+    def check_password(self, raw_password, digest):
+        scheme = identify(digest)
+        if not digest or scheme is None:
+            return HashResult(_Done(False), lambda valid: (False, False))
+        return HashResult(self._apply(_verify, (scheme.name, raw_password, digest)),
+                          lambda valid: (valid, valid and _must_update(scheme, digest)))
+
+    def close(self):
+        """Stop the worker processes once they finish their work."""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+
+_pools = {}
+
+
+def get_pool():
+    """
+    Return the `HashPool` of the VMAIL_HASH_WORKERS setting's number of
+    processes, shared by the whole process, or None if the setting is 0,
+    the default, and passwords are hashed in the calling thread.
+    """
+    workers = getattr(settings, 'VMAIL_HASH_WORKERS', 0)
+    if not workers:
+        return None
+    pool = _pools.get(workers)
+    if pool is None:
+        pool = _pools.setdefault(workers, HashPool(workers))
+    return pool
+
+
+def _pool_result(result):
+    """
+    Return the value of a `HashResult`, or None if it is not ready within
+    VMAIL_HASH_TIMEOUT seconds, such as when the pool's workers are all
+    busy or one was killed, whose task the pool never finishes.
+    """
+    try:
+        return result.get(getattr(settings, 'VMAIL_HASH_TIMEOUT', 30))
+    except multiprocessing.TimeoutError:
+        return None
+
+
+def make_password(raw_password, scheme=None, cost=None):
+    """
+    Return a (salt, digest) tuple for `raw_password` using the scheme
+    named `scheme`, by default the scheme configured for new passwords,
+    at the configured cost unless `cost` is given.
+    """
+    pool = get_pool()
+    if pool is not None:
+        value = _pool_result(pool.make_password(raw_password, scheme, cost))
+        if value is not None:
+            return value
+    scheme = get_scheme(scheme)
+    if cost is None:
+        cost = get_cost(scheme)
+    return _encode(scheme.name, raw_password, cost)
+
+
+def check_password(raw_password, digest):
+    """
+    Returns a (valid, must_update) tuple.  `valid` is True if the raw
+    password matches the digest, and `must_update` is True if the digest
+    does not use the scheme and cost configured for new passwords.
+    """
+    pool = get_pool()
+    if pool is not None:
+        value = _pool_result(pool.check_password(raw_password, digest))
+        if value is not None:
+            return value
+    scheme = identify(digest)
+    if not digest or scheme is None or not scheme.verify(raw_password, digest):
+        return False, False
+    return True, _must_update(scheme, digest)
+
+
+def dovecot_password(digest):
+    """Return a digest with the scheme prefix Dovecot requires."""
+    if digest.startswith('{'):
+        return digest
+    return '{' + SSHA.name + '}' + digest
+
+
+def benchmark(name, cost=None, rounds=100):
+    """Return the mean seconds taken to hash one password with a scheme."""
+    scheme = get_scheme(name)
+    if cost is None:
+        cost = get_cost(scheme)
+    salt = scheme.make_salt()
+    start = time.time()
+    for i in xrange(rounds):
+        scheme.encode('benchmark password', salt, cost)
+    return (time.time() - start) / rounds
@@ -0,0 +1,138 @@
+"""
+Incremental maintenance of the single-table lookup surface.
+
+The `vmail_lookup` table holds one `LookupEntry` per active address,
+so Postfix and Dovecot can read one narrow table by its unique address
+index instead of joining the mail user, alias and domain tables.  The
+entries of an address are recomputed whenever a mail user, alias or
+domain is saved or deleted, and only the entries which differ are
+written.  Code which bypasses the model signals, such as bulk_create
+or queryset updates, must call `sync_addresses` itself.  Each database
+holding mail users and aliases, such as each shard, has its own
+entries, which the functions below read and write on `using`.
+"""
+
+from django.db.models.signals import pre_save, post_save, post_delete
+
+from .db import commit_on_success_unless_managed
+from .models import Domain, MailUser, Alias, LookupEntry
+
+# Addresses synced per query, below SQLite's limit of query parameters.
+BATCH_SIZE = 500
+
+
+def build_entries(addresses, using=None):
+    """
+    Return a dictionary of the unsaved `LookupEntry` of each of the
+    addresses which is an active mailbox or alias source, keyed by
+    address.
+    """
+    entries = {}
+    for email, digest, domain_id in (
+            MailUser.objects.using(using)
+            .filter(email__in=addresses, active=True, domain_active=True)
+            .values_list('email', 'shadigest', 'domain_id')):
+        entries[email] = LookupEntry(address=email, kind=LookupEntry.MAILBOX,
+                                     digest=digest, domain_id=domain_id)
+
+    destinations = {}
+    for source, destination, domain_id in (
+            Alias.objects.using(using)
+            .filter(source__in=addresses, active=True, domain_active=True)
+            .order_by('source', 'id').values_list('source', 'destination', 'domain_id')):
+        destinations.setdefault(source, []).append(destination)
+        if source not in entries:
+            kind = LookupEntry.CATCHALL if source.startswith('@') else LookupEntry.ALIAS
+            entries[source] = LookupEntry(address=source, kind=kind, domain_id=domain_id)
+    for source, destination_list in destinations.items():
+        entries[source].destinations = ','.join(destination_list)
+    return entries
+
+
+def _key(entry):
+    return (entry.kind, entry.destinations, entry.digest, entry.domain_id)
+
+
+def sync_addresses(addresses, using=None):
+    """
+    Bring the lookup entries of the addresses up to date: entries of
+    addresses which are no longer active are deleted, and new or
+    changed entries are written.  Returns the number of entries
+    deleted or written.
+    """
+    addresses = sorted(set(address for address in addresses if address))
+    changed = 0
+    for i in range(0, len(addresses), BATCH_SIZE):
+        batch = addresses[i:i + BATCH_SIZE]
+        entries = build_entries(batch, using)
+        stale = []
+        for pk, address, kind, destinations, digest, domain_id in (
+                LookupEntry.objects.using(using).filter(address__in=batch)
+                .values_list('pk', 'address', 'kind', 'destinations', 'digest', 'domain_id')):
+            entry = entries.get(address)
+            if entry is not None and _key(entry) == (kind, destinations, digest, domain_id):
+                del entries[address]
+            else:
+                stale.append(pk)
+        if not stale and not entries:
+            continue
+        with commit_on_success_unless_managed(using):
+            if stale:
+                LookupEntry.objects.using(using).filter(pk__in=stale).delete()
+            LookupEntry.objects.using(using).bulk_create(list(entries.values()))
+        changed += len(stale) + len(entries)
+    return changed
+
+
+def sync_domain(domain, using=None):
+    """Bring the lookup entries of all the addresses of a domain up to date."""
+    addresses = set(MailUser.objects.using(using).filter(domain=domain)
+                    .values_list('email', flat=True))
+    addresses.update(Alias.objects.using(using).filter(domain=domain)
+                     .values_list('source', flat=True))
+    addresses.update(LookupEntry.objects.using(using).filter(domain=domain)
+                     .values_list('address', flat=True))
+    return sync_addresses(addresses, using)
+
+
+def rebuild(using=None):
+    """
+    Bring every lookup entry up to date, such as after the table is
+    first created.  Returns the number of entries deleted or written.
+    """
+    addresses = set(MailUser.objects.using(using).values_list('email', flat=True))
+    addresses.update(Alias.objects.using(using).values_list('source', flat=True))
+    addresses.update(LookupEntry.objects.using(using).values_list('address', flat=True))
+    return sync_addresses(addresses, using)
+
+
+def _address(instance):
+    return instance.email if isinstance(instance, MailUser) else instance.source
+
+
+def _remember_address(sender, instance, raw=False, using=None, **kwargs):
+    # the address may change, and the entry of the old address must go
+    instance._lookup_address = None
+    if instance.pk is not None and not raw:
+        field = 'email' if sender is MailUser else 'source'
+        old = (sender.objects.using(using).filter(pk=instance.pk)
+               .values_list(field, flat=True)[:1])
+        instance._lookup_address = old[0] if old else None
+
+
+def _address_changed(sender, instance, raw=False, using=None, **kwargs):
+    if not raw:
+        sync_addresses([_address(instance), getattr(instance, '_lookup_address', None)],
+                       using)
+
+
+def _domain_changed(sender, instance, created=False, raw=False, using=None, **kwargs):
+    if not created and not raw:
+        sync_domain(instance, instance.shard or using)
+
+
+for model in (MailUser, Alias):
+    pre_save.connect(_remember_address, sender=model)
+    post_save.connect(_address_changed, sender=model)
+    post_delete.connect(_address_changed, sender=model)
+post_save.connect(_domain_changed, sender=Domain)
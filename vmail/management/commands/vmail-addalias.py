@@ -9,7 +9,9 @@ from django.db import IntegrityError
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
 
+from vmail.metrics import instrumented_command
 from vmail.models import Domain, Alias
+from vmail.routers import pinned
 
 HELP_TEXT = """
 This will create an email aliases, forwarding address, or
@@ -47,6 +49,8 @@ class Command(BaseCommand):
                     help='Create the domain which will own the alias if it does not already exist.'),
     )
 
+    @instrumented_command('command.vmail-addalias')
+    @pinned
     def handle(self, *args, **options):
         usage = 'Required arguments: source-address destination-address [--create-domain]'
         if len(args) != 3:
@@ -75,8 +79,8 @@ class Command(BaseCommand):
                 raise CommandError("Domain '{0}', does not exist.".format(fqdn))
 
         try:
-            Alias.objects.create(domain=domain, source=source,
-                                 destination=destination)
+            Alias.objects.using(domain.shard or None).create(domain=domain, source=source,
+                                                             destination=destination)
         except IntegrityError:
             raise CommandError('Alias exists already.')
 
@@ -9,7 +9,9 @@ from django.core.management.base import BaseCommand, CommandError
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
 
+from vmail.metrics import instrumented_command
 from vmail.models import MailUser, Domain
+from vmail.routers import pinned
 
 
 class Command(BaseCommand):
@@ -30,6 +32,8 @@ class Command(BaseCommand):
                     help='Set the default password for the user.'),
     )
 
+    @instrumented_command('command.vmail-addmbox')
+    @pinned
     def handle(self, *args, **options):
         usage = 'Required arguments: email [--create-domain] [--password password]'
         if len(args) != 1:
@@ -45,7 +49,8 @@ class Command(BaseCommand):
         username = username.strip()
 
         try:
-            MailUser.objects.get(username=username, domain__fqdn=fqdn)
+            MailUser.objects.using(Domain.objects.shard_for(fqdn)).get(
+                username=username, domain__fqdn=fqdn)
         except MailUser.DoesNotExist:
             pass
         else:
@@ -60,7 +65,8 @@ class Command(BaseCommand):
             else:
                 raise CommandError('Domain does not exist.')
 
-        user = MailUser.objects.create(username=username, domain=domain)
+        user = MailUser.objects.using(domain.shard or None).create(username=username,
+                                                                   domain=domain)
         if options['password'] is not None:
             user.set_password(options['password'])
             user.save()
@@ -0,0 +1,65 @@
+"""
+Dovecot authentication lookup daemon command.
+"""
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vmail.daemon import make_server
+from vmail.dovecot import CredentialCache, DictHandler
+from vmail.metrics import instrumented_command
+
+HELP_TEXT = """
+Serve Dovecot passdb lookups over the Dovecot dict proxy
+protocol.  Mail user credentials are kept in a bounded cache
+for --cache-ttl seconds, so repeated logins do not query the
+database.  Inactive mail users, and mail users of inactive
+domains, are not found.
+
+In the dict passdb configuration file:
+
+    uri = proxy:/var/run/vmail/auth:vmail
+    password_key = passdb/%u
+"""
+
+
+class Command(BaseCommand):
+    args = '[--listen address] [--cache-size entries] [--cache-ttl seconds]'
+    help = (HELP_TEXT)
+    option_list = BaseCommand.option_list + (
+        make_option('--listen',
+                    dest='listen',
+                    default='unix:/var/run/vmail/auth',
+                    help="Listen address, 'unix:/path' or 'inet:host:port'."),
+        make_option('--cache-size',
+                    dest='cache_size',
+                    type='int',
+                    default=10000,
+                    help='Maximum number of cached mail users.'),
+        make_option('--cache-ttl',
+                    dest='cache_ttl',
+                    type='int',
+                    default=60,
+                    help='Seconds a cached mail user is kept.'),
+    )
+
+    @instrumented_command('command.vmail-authd')
+    def handle(self, *args, **options):
+        if args:
+            raise CommandError('Usage: {0}'.format(self.args))
+
+        try:
+            server = make_server(options['listen'], DictHandler)
+        except ValueError as e:
+            raise CommandError(str(e))
+        server.credentials = CredentialCache(options['cache_size'],
+                                             options['cache_ttl'])
+
+        self.stdout.write('Listening on {0}.\n'.format(options['listen']))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
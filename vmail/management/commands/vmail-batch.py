@@ -0,0 +1,177 @@
+"""
+Run many vmail commands in one process command.
+"""
+
+import json
+import shlex
+import sys
+import time
+from StringIO import StringIO
+from optparse import make_option, OptionParser
+
+from django.core.management import load_command_class
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, transaction
+
+from vmail.metrics import instrumented_command
+from vmail.routers import PRIMARY, pinned, shards
+
+OPERATIONS = ('addmbox', 'addalias', 'setpasswd', 'chpasswd', 'disable')
+
+HELP_TEXT = """
+Run one vmail command per line, read from the file, or from standard
+input if the file is '-', in this one process and database connection.
+Each line is an operation, one of: {0}, followed by the
+arguments and options of its vmail command, quoted as in a shell.
+Blank lines and lines starting with '#' are skipped.
+
+    addmbox john@example.org --password 'secret words'
+    addalias example.org bob@example.org john@example.org
+    disable example.com
+
+A JSON result is printed for each line, with the line number, the
+operation, whether it succeeded, its output lines, and its error.  With
+--chunk-size, lines are run that many at a time in one transaction,
+and a failed line is rolled back to a savepoint, where the database
+supports savepoints; with sharding, on every shard too.  Otherwise
+every line is committed on its own.
+""".format(', '.join(OPERATIONS))
+
+
+class LineOptionParser(OptionParser):
+    """Parses the options of a line, raising `CommandError` on errors."""
+
+    def error(self, msg):
+        raise CommandError(msg)
+
+
+class Command(BaseCommand):
+    args = 'file [--chunk-size size]'
+    help = (HELP_TEXT)
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size',
+                    dest='chunk_size',
+                    type='int',
+                    default=0,
+                    help='Number of lines run per transaction.'),
+    )
+
+    @instrumented_command('command.vmail-batch')
+    @pinned
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Required arguments: file [--chunk-size size]')
+        if options['chunk_size'] < 0:
+            raise CommandError('Chunk size must be at least 0.')
+
+        path = args[0]
+        try:
+            fp = sys.stdin if path == '-' else open(path)
+        except IOError as e:
+            raise CommandError("Cannot open '{0}': {1}.".format(path, e.strerror))
+
+        self.commands = {}
+        self.counts = {'lines': 0, 'errors': 0}
+        start = time.time()
+        try:
+            if options['chunk_size']:
+                self._run_chunked(fp, options['chunk_size'])
+            else:
+                for lineno, line in enumerate(fp, 1):
+                    self._run_line(lineno, line)
+        finally:
+            if fp is not sys.stdin:
+                fp.close()
+        elapsed = time.time() - start
+
+        rate = self.counts['lines'] / elapsed if elapsed else self.counts['lines']
+        self.stderr.write('Ran {0} operations, {1} errors, in {2:.2f}s'
+                          ' ({3:.0f} operations/sec).\n'.format(
+                              self.counts['lines'], self.counts['errors'], elapsed, rate))
+        if self.counts['errors']:
+            raise CommandError('{0} of {1} operations failed.'.format(
+                self.counts['errors'], self.counts['lines']))
+
+    def _run_chunked(self, fp, chunk_size):
+        # a line may write to the shard of its domain, as well as to the primary
+        databases = [PRIMARY] + shards()
+        for using in databases:
+            transaction.enter_transaction_management(using=using)
+            transaction.managed(True, using=using)
+        try:
+            run = 0
+            for lineno, line in enumerate(fp, 1):
+                sids = [(using, transaction.savepoint(using=using)) for using in databases]
+                ok = self._run_line(lineno, line)
+                for using, sid in sids:
+                    if ok:
+                        transaction.savepoint_commit(sid, using=using)
+                    else:
+                        transaction.savepoint_rollback(sid, using=using)
+                run += 1
+                if run % chunk_size == 0:
+                    for using in databases:
+                        transaction.commit(using=using)
+            for using in databases:
+                transaction.commit(using=using)
+        except:
+            for using in databases:
+                transaction.rollback(using=using)
+            raise
+        finally:
+            for using in databases:
+                transaction.leave_transaction_management(using=using)
+
+    def _run_line(self, lineno, line):
+        """
+        Run the operation of a line and print its result.  Returns False
+        if the operation failed, and True otherwise.
+        """
+        try:
+            argv = shlex.split(line, comments=True)
+        except ValueError as e:
+            argv, error = ['?'], 'Malformed line: {0}.'.format(e)
+        else:
+            if not argv:
+                return True
+            error = None
+
+        output = StringIO()
+        if error is None:
+            try:
+                self._execute(argv, output)
+            except CommandError as e:
+                error = str(e)
+            except Exception as e:
+                # any other error of the line, such as a ValidationError of the models,
+                # is reported like the others, after rolling back what the line wrote
+                for using in [PRIMARY] + shards():
+                    transaction.rollback_unless_managed(using=using)
+                if isinstance(e, DatabaseError):
+                    error = 'Database error: {0}'.format(e)
+                else:
+                    error = '{0}: {1}'.format(type(e).__name__, e)
+
+        self.counts['lines'] += 1
+        if error is not None:
+            self.counts['errors'] += 1
+        result = {'line': lineno, 'operation': argv[0], 'ok': error is None,
+                  'output': output.getvalue().splitlines(), 'error': error}
+        self.stdout.write(json.dumps(result, sort_keys=True) + '\n')
+        return error is None
+
+    def _execute(self, argv, output):
+        operation = argv[0]
+        if operation not in OPERATIONS:
+            raise CommandError("Unknown operation: '{0}'.".format(operation))
+        if operation not in self.commands:
+            command = load_command_class('vmail', 'vmail-' + operation)
+            parser = LineOptionParser(prog=operation, option_list=command.option_list,
+                                      add_help_option=False)
+            self.commands[operation] = command, parser
+
+        command, parser = self.commands[operation]
+        options, args = parser.parse_args(argv[1:])
+        options = vars(options)
+        options.update(stdout=output, stderr=output, skip_validation=True)
+        command.execute(*args, **options)
@@ -0,0 +1,131 @@
+"""
+Benchmark the lookups and provisioning on a synthetic dataset command.
+"""
+
+import json
+import time
+from collections import OrderedDict
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from vmail.benchmarks import data, suite
+from vmail.metrics import instrumented_command
+
+HELP_TEXT = """
+Create a test database, the way the test runner does, fill it with a
+synthetic dataset of --domains domains, each with --users mail users
+and --aliases aliases, and time the lookups, password checks,
+management commands and admin changelists against it.  The test
+database is then destroyed; the configured database is not touched.
+
+The results are written as JSON, to standard output or --output, in a
+fixed order so results of different releases can be diffed.  Use
+--only to run only the benchmarks whose names start with any of the
+comma separated prefixes, such as --only query,get_from_email.
+"""
+
+
+class Command(BaseCommand):
+    args = '[--domains n] [--users n] [--aliases n] [--rounds n] [--only names]'
+    help = (HELP_TEXT)
+    option_list = BaseCommand.option_list + (
+        make_option('--domains',
+                    dest='domains',
+                    type='int',
+                    default=10,
+                    help='Number of domains generated.'),
+        make_option('--users',
+                    dest='users',
+                    type='int',
+                    default=100,
+                    help='Number of mail users generated per domain.'),
+        make_option('--aliases',
+                    dest='aliases',
+                    type='int',
+                    default=20,
+                    help='Number of aliases generated per domain.'),
+        make_option('--fanout',
+                    dest='fanout',
+                    type='int',
+                    default=3,
+                    help='Maximum number of destinations of each alias.'),
+        make_option('--rounds',
+                    dest='rounds',
+                    type='int',
+                    default=100,
+                    help='Number of times each benchmark is run.'),
+        make_option('--seed',
+                    dest='seed',
+                    type='int',
+                    default=0,
+                    help='Seed of the generated dataset and samples.'),
+        make_option('--only',
+                    dest='only',
+                    default=None,
+                    help='Comma separated prefixes of the benchmarks to run.'),
+        make_option('--output',
+                    dest='output',
+                    default=None,
+                    help='Write the JSON results to this file.'),
+        make_option('--noinput',
+                    action='store_false',
+                    dest='interactive',
+                    default=True,
+                    help='Destroy an existing test database without asking.'),
+    )
+
+    @instrumented_command('command.vmail-benchmark')
+    def handle(self, *args, **options):
+        if args:
+            raise CommandError('Usage: {0}'.format(self.args))
+        for name in ('domains', 'rounds', 'fanout'):
+            if options[name] < 1:
+                raise CommandError('{0} must be at least 1.'.format(name.capitalize()))
+        for name in ('users', 'aliases'):
+            if options[name] < 0:
+                raise CommandError('{0} must be at least 0.'.format(name.capitalize()))
+        names = options['only'].split(',') if options['only'] else None
+
+        verbosity = int(options.get('verbosity', 1))
+        old_name = connection.settings_dict['NAME']
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=verbosity,
+                                           autoclobber=not options['interactive'])
+        try:
+            report = self.benchmark(names, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2) + '\n'
+        if options['output']:
+            with open(options['output'], 'w') as fp:
+                fp.write(output)
+        else:
+            self.stdout.write(output)
+
+    def benchmark(self, names, options):
+        """Generate the dataset, run the benchmarks, and return the report."""
+        start = time.time()
+        counts = data.generate(options['domains'], options['users'], options['aliases'],
+                               options['fanout'], seed=options['seed'])
+        self.stderr.write('Generated {0} domains, {1} mailboxes and {2} aliases'
+                          ' in {3:.2f}s.\n'.format(counts['domains'], counts['mailboxes'],
+                                                   counts['aliases'], time.time() - start))
+
+        results = suite.run(names, options['rounds'], options['seed'])
+        for result in results:
+            self.stderr.write('{0}: {1:.3f} ms mean, {2:.3f} ms p95\n'.format(
+                result['name'], result['mean'] * 1000, result['p95'] * 1000))
+
+        return OrderedDict([
+            ('database', connection.vendor),
+            ('dataset', OrderedDict(sorted(counts.items()))),
+            ('options', OrderedDict((name, options[name]) for name in
+                                    ('domains', 'users', 'aliases', 'fanout',
+                                     'rounds', 'seed'))),
+            ('results', results),
+        ])
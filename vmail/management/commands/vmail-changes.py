@@ -0,0 +1,111 @@
+"""
+Read and compact the change log command.
+"""
+
+import json
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from vmail import changes
+from vmail.metrics import instrumented_command
+from vmail.models import Change
+
+HELP_TEXT = """
+Print the changes to the domains, mail users and aliases after the
+cursor --since, one JSON object per line, in order.  Each change has
+its sequence number, 'seq', the model, the object id, the action,
+'create', 'update' or 'delete', and the object's fields after the
+change, or before it for a delete.  Pass the last sequence number
+printed as --since on the next run.  A cursor older than the last
+compacted delete is refused; re-read the tables after taking a cursor
+with --latest, and continue from that.
+
+With --compact, changes older than --days days (the
+VMAIL_CHANGE_RETENTION_DAYS setting, 30 by default) which are followed
+by a later change of the same object, and deletes older than that,
+are dropped instead.
+
+Each shard has its own log of the changes to its mail users and
+aliases, read with --database.
+"""
+
+ACTIONS = {Change.CREATE: 'create', Change.UPDATE: 'update', Change.DELETE: 'delete'}
+
+
+class Command(BaseCommand):
+    args = ('[--since cursor] [--limit n] [--latest] [--compact [--days days]]'
+            ' [--database database]')
+    help = (HELP_TEXT)
+    option_list = BaseCommand.option_list + (
+        make_option('--since',
+                    dest='since',
+                    type='int',
+                    default=0,
+                    help='Print the changes after this sequence number.'),
+        make_option('--limit',
+                    dest='limit',
+                    type='int',
+                    default=None,
+                    help='Print at most this many changes.'),
+        make_option('--latest',
+                    action='store_true',
+                    dest='latest',
+                    default=False,
+                    help='Print the sequence number of the latest change.'),
+        make_option('--compact',
+                    action='store_true',
+                    dest='compact',
+                    default=False,
+                    help='Drop superseded changes and old deletes.'),
+        make_option('--days',
+                    dest='days',
+                    type='int',
+                    default=None,
+                    help='Days changes are kept before they are compacted.'),
+        make_option('--database',
+                    dest='database',
+                    default=DEFAULT_DB_ALIAS,
+                    help='Database, such as a shard, to read the changes of.'),
+    )
+
+    @instrumented_command('command.vmail-changes')
+    def handle(self, *args, **options):
+        if args:
+            raise CommandError('Usage: {0}'.format(self.args))
+        if options['latest'] and options['compact']:
+            raise CommandError('Use only one of --latest and --compact.')
+        for name in ('since', 'limit', 'days'):
+            if options[name] is not None and options[name] < 0:
+                raise CommandError('{0} must be at least 0.'.format(name.capitalize()))
+        using = options['database']
+        if using not in connections:
+            raise CommandError("Unknown database '{0}'.".format(using))
+
+        if options['latest']:
+            self.stdout.write('{0}\n'.format(changes.latest(using)))
+        elif options['compact']:
+            dropped = changes.compact(options['days'], using)
+            self.stdout.write('Dropped {0} changes, {1} kept.\n'.format(
+                dropped, Change.objects.using(using).exclude(action=Change.EXPIRED).count()))
+        else:
+            self.print_changes(options['since'], options['limit'], using)
+
+    def print_changes(self, cursor, limit, using):
+        count = 0
+        try:
+            for change in changes.since(cursor, limit, using):
+                self.stdout.write(json.dumps({
+                    'seq': change.pk,
+                    'model': change.model,
+                    'id': change.object_id,
+                    'action': ACTIONS[change.action],
+                    'data': json.loads(change.data),
+                    'created': change.created.isoformat(),
+                }, sort_keys=True) + '\n')
+                count += 1
+                cursor = change.pk
+        except changes.CursorExpired as e:
+            raise CommandError('{0} Re-read the tables.'.format(e))
+        self.stderr.write('Read {0} changes, cursor {1}.\n'.format(count, cursor))
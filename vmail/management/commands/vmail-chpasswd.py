@@ -5,7 +5,9 @@ Chpasswd command for existing mail users to change their password.
 from django.core.management.base import BaseCommand, CommandError
 from django.core.exceptions import ValidationError
 
+from vmail.metrics import instrumented_command
 from vmail.models import MailUser, Domain
+from vmail.routers import pinned
 
 
 class Command(BaseCommand):
@@ -15,6 +17,8 @@ class Command(BaseCommand):
             'supplied in clear-text, and are cryptographically hashed\n'
             'by chpasswd.')
 
+    @instrumented_command('command.vmail-chpasswd')
+    @pinned
     def handle(self, *args, **options):
         usage = 'Required arguments: email password new_password'
         if len(args) != 3:
@@ -0,0 +1,82 @@
+"""
+Disable, or enable, domains, mailboxes and aliases command.
+"""
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vmail import bulk
+from vmail.db import commit_on_success_unless_managed
+from vmail.metrics import instrumented_command
+from vmail.models import Domain, MailUser, Alias
+from vmail.routers import pinned
+from vmail.shards import group_addresses
+
+HELP_TEXT = """
+Disable each named domain, or mailbox and alias address, with a few
+set-based updates in one transaction.  A name with an '@' is an
+address: the mailbox of that address and the aliases with that
+source are disabled.  Any other name is a domain, which stops
+receiving and authenticating mail for all of its mailboxes and
+aliases, while their own active flags are kept.  Use --members to
+disable the mailboxes and aliases of the domains too, and --enable
+to enable instead.
+
+    vmail-disable example.org                # the whole domain
+    vmail-disable john@example.org           # one mailbox and its aliases
+    vmail-disable --enable --members example.org
+"""
+
+
+class Command(BaseCommand):
+    args = 'name [name ...] [--enable] [--members]'
+    help = (HELP_TEXT)
+    option_list = BaseCommand.option_list + (
+        make_option('--enable',
+                    action='store_true',
+                    dest='enable',
+                    default=False,
+                    help='Enable instead of disable.'),
+        make_option('--members',
+                    action='store_true',
+                    dest='members',
+                    default=False,
+                    help="Also set the active flag of the domains' mailboxes and aliases."),
+    )
+
+    @instrumented_command('command.vmail-disable')
+    @pinned
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError('Required arguments: name [name ...] [--enable] [--members]')
+
+        names = set(name.strip().lower() for name in args)
+        addresses = set(name for name in names if '@' in name)
+        fqdns = names - addresses
+
+        domains = Domain.objects.filter(fqdn__in=fqdns)
+        groups = group_addresses(addresses).items()
+        users = [MailUser.objects.using(using).filter(email__in=group)
+                 for using, group in groups]
+        aliases = [Alias.objects.using(using).filter(source__in=group)
+                   for using, group in groups]
+        found = set(domains.values_list('fqdn', flat=True))
+        for queryset in users:
+            found.update(queryset.values_list('email', flat=True))
+        for queryset in aliases:
+            found.update(queryset.values_list('source', flat=True))
+        missing = sorted(names - found)
+        if missing:
+            raise CommandError("Does not exist: {0}.".format(', '.join(missing)))
+
+        active = options['enable']
+        with commit_on_success_unless_managed():
+            counts = bulk.set_domains_active(domains, active, options['members'])
+            counts = (counts[0],
+                      counts[1] + sum(bulk.set_active(queryset, active) for queryset in users),
+                      counts[2] + sum(bulk.set_active(queryset, active)
+                                      for queryset in aliases))
+
+        self.stdout.write('{0} {1} domains, {2} mailboxes and {3} aliases.\n'.format(
+            'Enabled' if active else 'Disabled', *counts))
@@ -0,0 +1,92 @@
+"""
+Check the consistency of the virtual mail tables command.
+"""
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vmail import doctor
+from vmail.metrics import instrumented_command
+from vmail.routers import PRIMARY, pinned, shards
+
+HELP_TEXT = """
+Check the tables for each kind of problem, or only the named checks:
+
+    alias-domain          aliases owned by a domain other than their
+                          source's
+    empty-password        active mailboxes without a password
+    inactive-destination  active aliases to inactive local mailboxes
+    alias-loop            aliases leading back to their source
+
+Each check is a few set-based queries, and the checks, of each shard,
+are run concurrently across --workers threads.  Up to --limit rows of
+each problem are printed.  With --fix, the aliases are moved to the
+domain of their source, and the mailboxes without a password and
+aliases to inactive mailboxes are deactivated, --batch-size rows per
+transaction.  Alias loops are only reported.
+"""
+
+
+class Command(BaseCommand):
+    args = '[check ...] [--fix] [--workers n] [--batch-size size] [--limit n]'
+    help = (HELP_TEXT)
+    option_list = BaseCommand.option_list + (
+        make_option('--fix',
+                    action='store_true',
+                    dest='fix',
+                    default=False,
+                    help='Fix the problems which can be fixed.'),
+        make_option('--workers',
+                    dest='workers',
+                    type='int',
+                    default=None,
+                    help='Number of checks run at once, one per check by default.'),
+        make_option('--batch-size',
+                    dest='batch_size',
+                    type='int',
+                    default=500,
+                    help='Number of rows fixed per transaction.'),
+        make_option('--limit',
+                    dest='limit',
+                    type='int',
+                    default=20,
+                    help='Number of rows printed of each problem.'),
+    )
+
+    @instrumented_command('command.vmail-doctor')
+    @pinned
+    def handle(self, *args, **options):
+        unknown = [name for name in args if name not in doctor.CHECKS]
+        if unknown:
+            raise CommandError('Unknown checks: {0}.'.format(', '.join(unknown)))
+        for name in ('workers', 'batch_size'):
+            if options[name] is not None and options[name] < 1:
+                raise CommandError('{0} must be at least 1.'.format(
+                    name.replace('_', ' ').capitalize()))
+        if options['limit'] < 0:
+            raise CommandError('Limit must be at least 0.')
+
+        names = [name for name in doctor.CHECKS if name in args] or list(doctor.CHECKS)
+        databases = [PRIMARY] + shards()
+        found = fixed = 0
+        for (name, using), problems in doctor.run(names, databases, options['workers']):
+            check = doctor.CHECKS[name]
+            label = name if len(databases) == 1 else '{0} on {1}'.format(name, using)
+            self.stdout.write('{0}: {1} {2}.\n'.format(label, len(problems), check.description))
+            for pk, detail in problems[:options['limit']]:
+                self.stdout.write('  {0}: {1}\n'.format(pk, detail))
+            if len(problems) > options['limit']:
+                self.stdout.write('  ... and {0} more.\n'.format(
+                    len(problems) - options['limit']))
+            found += len(problems)
+            if options['fix'] and problems and check.fix is not None:
+                count = doctor.fix(name, [pk for pk, _ in problems], using,
+                                   options['batch_size'])
+                self.stdout.write('  Fixed {0}.\n'.format(count))
+                fixed += count
+
+        message = 'Found {0} problems'.format(found)
+        if options['fix']:
+            message += ', fixed {0}'.format(fixed)
+        self.stdout.write(message + '.\n')
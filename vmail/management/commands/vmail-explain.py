@@ -0,0 +1,122 @@
+"""
+Explain the Postfix and Dovecot lookup queries command.
+"""
+
+import re
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from vmail.maps import LOOKUP_QUERIES
+from vmail.metrics import instrumented_command
+from vmail.models import MailUser, Alias
+
+HELP_TEXT = """
+Run EXPLAIN on each of the Postfix and Dovecot lookup queries in
+docs/configuration.rst, and report how each table is read: with an
+index-only scan, an index scan, or a sequential scan.  Use
+--verbosity 2 to print the full query plans.
+
+The queries are explained for an existing mail user and alias
+source, unless --email and --source are given.  PostgreSQL and
+SQLite query plans are understood.
+"""
+
+INDEX_ONLY = 'index-only scan'
+INDEX = 'index scan'
+SEQUENTIAL = 'sequential scan'
+
+POSTGRES_SCAN = re.compile(r'(Index Only Scan|Index Scan|Bitmap Heap Scan|Seq Scan)'
+                           r'(?: Backward)?(?: using \S+)? on (\w+)')
+POSTGRES_KINDS = {'Index Only Scan': INDEX_ONLY, 'Index Scan': INDEX,
+                  'Bitmap Heap Scan': INDEX, 'Seq Scan': SEQUENTIAL}
+SQLITE_SCAN = re.compile(r'^(SCAN|SEARCH)(?: TABLE)? (\w+)(.*)$')
+
+
+def explain_postgresql(cursor, sql, params):
+    cursor.execute('EXPLAIN ' + sql, params)
+    plan = [row[0] for row in cursor.fetchall()]
+    scans = [(table, POSTGRES_KINDS[kind])
+             for kind, table in POSTGRES_SCAN.findall('\n'.join(plan))]
+    return plan, scans
+
+
+def explain_sqlite(cursor, sql, params):
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    plan = [row[-1] for row in cursor.fetchall()]
+    scans = []
+    for line in plan:
+        match = SQLITE_SCAN.match(line)
+        if match is None:
+            continue
+        op, table, rest = match.groups()
+        if 'COVERING INDEX' in rest:
+            kind = INDEX_ONLY
+        elif op == 'SEARCH' or 'USING' in rest:
+            kind = INDEX
+        else:
+            kind = SEQUENTIAL
+        scans.append((table, kind))
+    return plan, scans
+
+
+EXPLAINERS = {
+    'postgresql': explain_postgresql,
+    'sqlite': explain_sqlite,
+}
+
+
+class Command(BaseCommand):
+    args = '[--email email] [--source address]'
+    help = (HELP_TEXT)
+    option_list = BaseCommand.option_list + (
+        make_option('--email',
+                    dest='email',
+                    default=None,
+                    help='Mail user address to explain the mailbox queries with.'),
+        make_option('--source',
+                    dest='source',
+                    default=None,
+                    help='Alias source to explain the alias query with.'),
+    )
+
+    @instrumented_command('command.vmail-explain')
+    def handle(self, *args, **options):
+        if args:
+            raise CommandError('Usage: {0}'.format(self.args))
+
+        vendor = connection.vendor
+        if vendor not in EXPLAINERS:
+            raise CommandError("Query plans of '{0}' databases are not understood.".format(vendor))
+        explain = EXPLAINERS[vendor]
+
+        params = self._sample(options['email'], options['source'])
+        cursor = connection.cursor()
+        index_only = 0
+        for name, (sql, param_names) in LOOKUP_QUERIES.items():
+            plan, scans = explain(cursor, sql, [params[p] for p in param_names])
+            if int(options.get('verbosity', 1)) >= 2:
+                self.stdout.write('{0}:\n    {1}\n'.format(name, '\n    '.join(plan)))
+            summary = ', '.join('{0} {1}'.format(table, kind) for table, kind in scans)
+            self.stdout.write('{0}: {1}\n'.format(name, summary or 'no table scans'))
+            if all(kind == INDEX_ONLY for _, kind in scans):
+                index_only += 1
+
+        self.stdout.write('{0} of {1} queries use only index-only scans.\n'.format(
+            index_only, len(LOOKUP_QUERIES)))
+
+    def _sample(self, email, source):
+        """Return the query parameters to explain the queries with."""
+        if email is None:
+            user = MailUser.objects.filter(active=True).values_list('email', flat=True)[:1]
+            email = user[0] if user else 'john@example.org'
+        if '@' not in email:
+            raise CommandError('Improperly formatted email address.')
+        if source is None:
+            alias = Alias.objects.filter(active=True).values_list('source', flat=True)[:1]
+            source = alias[0] if alias else email
+
+        email = email.strip().lower()
+        return {'email': email, 'fqdn': email.split('@', 1)[1],
+                'source': source.strip().lower(), 'active': True}
@@ -0,0 +1,112 @@
+"""
+Export the Postfix lookup tables to files command.
+"""
+
+import os
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vmail.cdb import CDBWriter
+from vmail.export import atomic_write, table_signature, load_state, save_state
+from vmail.maps import (map_items, MAP_NAMES, VIRTUAL_MAILBOX_DOMAINS,
+                        VIRTUAL_MAILBOX_MAPS, VIRTUAL_ALIAS_MAPS, EMAIL2EMAIL)
+from vmail.metrics import instrumented_command
+from vmail.models import Domain, MailUser, Alias
+from vmail.routers import mail_databases
+
+HELP_TEXT = """
+Export the Postfix lookup tables into the output directory, one
+file per map, so Postfix can answer lookups without a database.
+Only active rows are exported, from the default database and every
+shard.  Each file is written to a
+temporary file, and renamed into place once complete.
+
+A map is only regenerated when its source tables have changed
+since the last export, so this may be run often from cron.  Use
+--force to regenerate every map.
+
+With --format=cdb (the default) each map is written as a
+constant database, readable by Postfix as 'cdb:' tables:
+
+    virtual_alias_maps = cdb:/etc/postfix/vmail/virtual_alias_maps
+
+With --format=text each map is written as a 'key value' text
+file, to be compiled with postmap(1).
+"""
+
+STATE_FILE = '.vmail-export-maps.json'
+
+MAP_SOURCES = {
+    VIRTUAL_MAILBOX_DOMAINS: (Domain,),
+    VIRTUAL_MAILBOX_MAPS: (Domain, MailUser),
+    VIRTUAL_ALIAS_MAPS: (Domain, Alias),
+    EMAIL2EMAIL: (Domain, MailUser),
+}
+
+EXTENSIONS = {'cdb': '.cdb', 'text': ''}
+
+
+class Command(BaseCommand):
+    args = 'output-directory [--format cdb|text] [--force]'
+    help = (HELP_TEXT)
+    option_list = BaseCommand.option_list + (
+        make_option('--format',
+                    dest='format',
+                    default='cdb',
+                    choices=sorted(EXTENSIONS),
+                    help='Output file format, cdb or text.'),
+        make_option('--force',
+                    action='store_true',
+                    dest='force',
+                    default=False,
+                    help='Regenerate all maps, even if unchanged.'),
+    )
+
+    @instrumented_command('command.vmail-export-maps')
+    def handle(self, *args, **options):
+        usage = 'Required arguments: output-directory [--format cdb|text] [--force]'
+        if len(args) != 1:
+            raise CommandError(usage)
+
+        directory = args[0]
+        if not os.path.isdir(directory):
+            raise CommandError("Directory '{0}', does not exist.".format(directory))
+
+        fmt = options['format']
+        state_path = os.path.join(directory, STATE_FILE)
+        state = load_state(state_path)
+        signatures = {Domain: table_signature(Domain.objects.all())}
+        for model in (MailUser, Alias):
+            signatures[model] = sum((table_signature(model.objects.using(using))
+                                     for using in mail_databases()), [])
+
+        for name in MAP_NAMES:
+            path = os.path.join(directory, name + EXTENSIONS[fmt])
+            signature = [fmt] + [signatures[model] for model in MAP_SOURCES[name]]
+            if (not options['force'] and state.get(name) == signature and
+                    os.path.exists(path)):
+                self.stdout.write('Unchanged: {0}.\n'.format(name))
+                continue
+
+            with atomic_write(path) as fp:
+                count = self._write_map(fp, name, fmt)
+            state[name] = signature
+            save_state(state_path, state)
+            self.stdout.write('Exported {0}: {1} keys.\n'.format(name, count))
+
+        self.stdout.write('Success.\n')
+
+    def _write_map(self, fp, name, fmt):
+        count = 0
+        if fmt == 'cdb':
+            writer = CDBWriter(fp)
+            for key, value in map_items(name):
+                writer.add(key, value)
+                count += 1
+            writer.finish()
+        else:
+            for key, value in map_items(name):
+                fp.write(u'{0} {1}\n'.format(key, value).encode('utf-8'))
+                count += 1
+        return count
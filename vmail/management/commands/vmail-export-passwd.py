@@ -0,0 +1,147 @@
+"""
+Export Dovecot passwd-files of the mail users command.
+"""
+
+import os
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Max
+
+from vmail.export import atomic_write, load_state, save_state
+from vmail.hashers import dovecot_password
+from vmail.metrics import instrumented_command
+from vmail.models import Domain, MailUser
+from vmail.routers import mail_databases
+
+HELP_TEXT = """
+Export the active mail users with a password into the output
+directory as Dovecot passwd-files, one file per active domain, named
+after the domain, so Dovecot can authenticate logins without a
+database:
+
+    passdb {
+      driver = passwd-file
+      args = username_format=%u /etc/dovecot/vmail/%d.passwd
+    }
+
+Each line is 'user@domain:{SCHEME}digest', followed by the --uid,
+--gid and --home userdb fields when given.  The home directory may use
+{domain} and {username}.  Each file is written to a temporary file,
+and renamed into place once complete.  Only the files of domains whose
+mail users changed since the last export are rewritten, and files of
+domains which are no longer active are removed.  Use --force to
+rewrite every file.
+"""
+
+STATE_FILE = '.vmail-export-passwd.json'
+
+EXTENSION = '.passwd'
+
+# the files hold password digests, so only the owner and group may read them
+FILE_MODE = 0o640
+
+
+class Command(BaseCommand):
+    args = 'output-directory [--uid uid] [--gid gid] [--home path] [--force]'
+    help = (HELP_TEXT)
+    option_list = BaseCommand.option_list + (
+        make_option('--uid',
+                    dest='uid',
+                    default='',
+                    help='System user id the mail is stored as.'),
+        make_option('--gid',
+                    dest='gid',
+                    default='',
+                    help='System group id the mail is stored as.'),
+        make_option('--home',
+                    dest='home',
+                    default='',
+                    help='Home directory, such as /var/vmail/{domain}/{username}.'),
+        make_option('--force',
+                    action='store_true',
+                    dest='force',
+                    default=False,
+                    help='Rewrite all files, even if unchanged.'),
+    )
+
+    @instrumented_command('command.vmail-export-passwd')
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Required arguments: {0}'.format(self.args))
+
+        directory = args[0]
+        if not os.path.isdir(directory):
+            raise CommandError("Directory '{0}', does not exist.".format(directory))
+        for name in ('uid', 'gid', 'home'):
+            if ':' in options[name] or '\n' in options[name]:
+                raise CommandError('The {0} may not contain a colon.'.format(name))
+        try:
+            options['home'].format(domain='', username='')
+        except (KeyError, IndexError, ValueError):
+            raise CommandError("Improperly formatted home: '{0}'.".format(options['home']))
+
+        state_path = os.path.join(directory, STATE_FILE)
+        state = load_state(state_path)
+        fields = [options['uid'], options['gid'], options['home']]
+        counts = {'written': 0, 'unchanged': 0, 'removed': 0}
+        try:
+            for pk, fqdn, using, signature in self._signatures(fields):
+                path = os.path.join(directory, fqdn + EXTENSION)
+                if (not options['force'] and state.get(fqdn) == signature and
+                        os.path.exists(path)):
+                    counts['unchanged'] += 1
+                    continue
+                with atomic_write(path, mode=FILE_MODE) as fp:
+                    count = self._write_domain(fp, pk, fqdn, fields, using)
+                state[fqdn] = signature
+                counts['written'] += 1
+                self.stdout.write('Exported {0}: {1} users.\n'.format(fqdn, count))
+
+            active = set(Domain.objects.filter(active=True).values_list('fqdn', flat=True))
+            for fqdn in sorted(set(state) - active):
+                try:
+                    os.unlink(os.path.join(directory, fqdn + EXTENSION))
+                except OSError:
+                    pass
+                del state[fqdn]
+                counts['removed'] += 1
+                self.stdout.write('Removed {0}.\n'.format(fqdn))
+        finally:
+            save_state(state_path, state)
+
+        self.stdout.write('Wrote {written} domains, {unchanged} unchanged,'
+                          ' {removed} removed.\n'.format(**counts))
+
+    def _signatures(self, fields):
+        """
+        Yield the id, name, shard and signature of each active domain.
+        The signature changes whenever one of the domain's mail users is
+        created, saved or deleted, or the userdb fields change.
+        """
+        users = {}
+        for using in mail_databases():
+            users.update(((using, row['domain']), row) for row in
+                         MailUser.objects.using(using).values('domain')
+                         .annotate(count=Count('pk'), modified=Max('modified')))
+        for pk, fqdn, shard, modified in (Domain.objects.filter(active=True).order_by('fqdn')
+                                          .values_list('pk', 'fqdn', 'shard', 'modified')):
+            using = shard or None
+            row = users.get((using, pk), {'count': 0, 'modified': None})
+            yield pk, fqdn, using, [row['count'],
+                             row['modified'].isoformat() if row['modified'] else None,
+                             modified.isoformat()] + fields
+
+    def _write_domain(self, fp, pk, fqdn, fields, using=None):
+        uid, gid, home = fields
+        users = (MailUser.objects.using(using).filter(domain=pk, active=True)
+                 .exclude(shadigest='')
+                 .order_by('username').values_list('username', 'email', 'shadigest'))
+        count = 0
+        for username, email, digest in users.iterator():
+            line = [email, dovecot_password(digest)]
+            if uid or gid or home:
+                line += [uid, gid, '', home.format(domain=fqdn, username=username), '', '']
+            fp.write(u'{0}\n'.format(':'.join(line)).encode('utf-8'))
+            count += 1
+        return count
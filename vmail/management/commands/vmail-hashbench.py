@@ -0,0 +1,56 @@
+"""
+Password scheme benchmark command.
+"""
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vmail import hashers
+from vmail.metrics import instrumented_command
+
+
+class Command(BaseCommand):
+    args = '[--scheme scheme] [--cost cost] [--rounds rounds]'
+    help = ('Time how long each password scheme takes to hash a password\n'
+            'at its configured cost, or at --cost.  Use this to choose a\n'
+            'cost which the expected login rate can sustain.')
+    option_list = BaseCommand.option_list + (
+        make_option('--scheme',
+                    dest='scheme',
+                    default=None,
+                    help='Only benchmark this scheme.'),
+        make_option('--cost',
+                    dest='cost',
+                    type='int',
+                    default=None,
+                    help='Cost to benchmark, instead of the configured cost.'),
+        make_option('--rounds',
+                    dest='rounds',
+                    type='int',
+                    default=100,
+                    help='Number of passwords hashed per scheme.'),
+    )
+
+    @instrumented_command('command.vmail-hashbench')
+    def handle(self, *args, **options):
+        if args:
+            raise CommandError('Usage: {0}'.format(self.args))
+        if options['rounds'] < 1:
+            raise CommandError('Rounds must be at least 1.')
+
+        names = list(hashers.SCHEMES)
+        if options['scheme'] is not None:
+            names = [options['scheme'].upper()]
+            if names[0] not in hashers.SCHEMES:
+                raise CommandError("Unknown password scheme: '{0}'.".format(names[0]))
+
+        for name in names:
+            scheme = hashers.get_scheme(name)
+            cost = options['cost'] if scheme.default_cost else None
+            if cost is None:
+                cost = hashers.get_cost(scheme)
+            seconds = hashers.benchmark(name, cost, options['rounds'])
+            self.stdout.write('{0}: cost {1}, {2:.3f} ms/hash, {3:.0f} hashes/sec.\n'.format(
+                name, cost if cost is not None else '-', seconds * 1000,
+                1 / seconds if seconds else 0))
@@ -0,0 +1,287 @@
+"""
+Bulk import mailboxes and aliases command.
+"""
+
+import csv
+import json
+import sys
+import time
+from itertools import islice
+from optparse import make_option
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+
+from vmail import changes, lookup
+from vmail.metrics import instrumented_command
+from vmail.models import Domain, MailUser, Alias, Change
+from vmail.routers import pinned
+
+HELP_TEXT = """
+Import mailboxes and aliases from a CSV or JSON Lines file, or
+from standard input if the file is '-'.  Each row has a type of
+either 'mailbox' or 'alias':
+
+    {"type": "mailbox", "email": "john@example.org", "password": "secret"}
+    {"type": "alias", "source": "@example.org", "destination": "john@example.org"}
+
+The password of a mailbox is optional.  The owning domain of an
+alias is the domain of the source address, unless a 'domain' is
+given.  CSV files must have a header row naming the columns:
+
+    type,email,password,source,destination,domain
+
+Rows are inserted in batches, each batch in a single transaction per
+shard of the rows' domains.
+A row which cannot be imported is reported, and does not stop the
+import of the remaining rows.  If --create-domain is used then
+domains which do not exist are created.
+"""
+
+
+class RowError(Exception):
+    pass
+
+
+def read_csv(fp):
+    reader = csv.DictReader(fp)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_jsonl(fp):
+    for lineno, line in enumerate(fp, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield lineno, row
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+def get_field(row, name):
+    """
+    Return the value of the field `name` of a row, or '' if it is
+    missing, or raise `RowError` if it is not a string, as the values
+    of a JSON row can be numbers, lists or objects.
+    """
+    value = row.get(name)
+    if value is None:
+        return ''
+    if not isinstance(value, basestring):
+        raise RowError("The {0} must be a string.".format(name))
+    return value
+
+
+class Command(BaseCommand):
+    args = 'file [--format csv|jsonl] [--create-domain] [--batch-size size]'
+    help = (HELP_TEXT)
+    option_list = BaseCommand.option_list + (
+        make_option('--format',
+                    dest='format',
+                    default=None,
+                    choices=sorted(READERS),
+                    help='Input file format, csv or jsonl.  By default it is'
+                         ' guessed from the file extension.'),
+        make_option('--create-domain',
+                    action='store_true',
+                    dest='create_domain',
+                    default=False,
+                    help='Create domains which do not already exist.'),
+        make_option('--batch-size',
+                    dest='batch_size',
+                    type='int',
+                    default=1000,
+                    help='Number of rows inserted per transaction.'),
+    )
+
+    @instrumented_command('command.vmail-import')
+    @pinned
+    def handle(self, *args, **options):
+        usage = 'Required arguments: file [--format csv|jsonl] [--create-domain] [--batch-size size]'
+        if len(args) != 1:
+            raise CommandError(usage)
+
+        path = args[0]
+        fmt = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        if options['batch_size'] < 1:
+            raise CommandError('Batch size must be at least 1.')
+
+        try:
+            fp = sys.stdin if path == '-' else open(path, 'rb')
+        except IOError as e:
+            raise CommandError("Cannot open '{0}': {1}.".format(path, e.strerror))
+
+        self.create_domain = options['create_domain']
+        self.domains = {}
+        self.counts = {'mailbox': 0, 'alias': 0, 'error': 0}
+
+        start = time.time()
+        try:
+            rows = READERS[fmt](fp)
+            while True:
+                batch = list(islice(rows, options['batch_size']))
+                if not batch:
+                    break
+                self._import_batch(batch)
+        except csv.Error as e:
+            raise CommandError('Malformed CSV: {0}.'.format(e))
+        finally:
+            if fp is not sys.stdin:
+                fp.close()
+        elapsed = time.time() - start
+
+        total = sum(self.counts.values())
+        rate = total / elapsed if elapsed else total
+        self.stdout.write('Imported {0} mailboxes and {1} aliases, {2} errors,'
+                          ' in {3:.2f}s ({4:.0f} rows/sec).\n'.format(
+                              self.counts['mailbox'], self.counts['alias'],
+                              self.counts['error'], elapsed, rate))
+
+    def _error(self, lineno, message):
+        self.counts['error'] += 1
+        self.errors.append((lineno, message))
+
+    def _import_batch(self, batch):
+        """
+        Build unsaved MailUser and Alias objects for a batch of rows,
+        skipping rows which are invalid or already exist, and insert
+        them in a single transaction per shard.
+        """
+        self.errors = []
+        parsed = []
+        for lineno, row in batch:
+            try:
+                parsed.append((lineno,) + self._parse(row))
+            except RowError as e:
+                self._error(lineno, e)
+        self._resolve_domains(set(fqdn for _, _, fqdn, _, _ in parsed))
+
+        mailboxes = [(fqdn, obj) for _, kind, fqdn, obj, _ in parsed if kind == 'mailbox']
+        aliases = [obj for _, kind, _, obj, _ in parsed if kind == 'alias']
+        mailbox_keys, alias_keys = set(), set()
+        for using in set(domain.shard or None for domain in self.domains.values() if domain):
+            mailbox_keys.update(
+                MailUser.objects.using(using)
+                .filter(email__in=['{0}@{1}'.format(obj.username, fqdn)
+                                   for fqdn, obj in mailboxes])
+                .values_list('username', 'domain__fqdn'))
+            alias_keys.update(
+                Alias.objects.using(using).filter(source__in=[obj.source for obj in aliases])
+                .values_list('source', 'destination'))
+
+        shards = {}
+        for lineno, kind, fqdn, obj, password in parsed:
+            domain = self.domains.get(fqdn)
+            if domain is None:
+                self._error(lineno, "Domain '{0}', does not exist.".format(fqdn))
+                continue
+            if kind == 'mailbox':
+                key, keys = (obj.username, fqdn), mailbox_keys
+            else:
+                key, keys = (obj.source, obj.destination), alias_keys
+            if key in keys:
+                self._error(lineno, '{0} exists already.'.format(kind.capitalize()))
+                continue
+            keys.add(key)
+            obj.domain = domain
+            obj.set_domain_fields()
+            if password:
+                obj.set_password(password)
+            objs = shards.setdefault(domain.shard or None, {'mailbox': [], 'alias': []})
+            objs[kind].append((lineno, obj))
+
+        for using, objs in shards.items():
+            self._insert(using, objs)
+
+        for lineno, message in sorted(self.errors):
+            self.stderr.write('Line {0}: {1}\n'.format(lineno, message))
+
+    def _insert(self, using, objs):
+        try:
+            with transaction.commit_on_success(using=using):
+                for kind, model in (('mailbox', MailUser), ('alias', Alias)):
+                    model.objects.using(using).bulk_create([obj for _, obj in objs[kind]])
+                lookup.sync_addresses([obj.email for _, obj in objs['mailbox']] +
+                                      [obj.source for _, obj in objs['alias']], using)
+                changes.record_rows(MailUser, 'email', [obj.email for _, obj in objs['mailbox']],
+                                    Change.CREATE, using)
+                changes.record_rows(Alias, 'source', [obj.source for _, obj in objs['alias']],
+                                    Change.CREATE, using)
+        except IntegrityError:
+            # rows were created concurrently, so find them one at a time
+            for kind in objs:
+                for lineno, obj in objs[kind]:
+                    self._create(lineno, kind, obj, using)
+        else:
+            for kind in objs:
+                self.counts[kind] += len(objs[kind])
+
+    def _create(self, lineno, kind, obj, using):
+        try:
+            with transaction.commit_on_success(using=using):
+                obj.save(using=using)
+        except IntegrityError:
+            self._error(lineno, '{0} exists already.'.format(kind.capitalize()))
+        else:
+            self.counts[kind] += 1
+
+    def _parse(self, row):
+        """
+        Return a (kind, fqdn, unsaved object, password) tuple for a row,
+        or raise `RowError` if the row is invalid.
+        """
+        if not isinstance(row, dict):
+            raise RowError('Malformed row.')
+        kind = get_field(row, 'type').strip().lower()
+        if kind == 'mailbox':
+            email = get_field(row, 'email').strip().lower()
+            try:
+                validate_email(email)
+            except ValidationError:
+                raise RowError('Improperly formatted email address: {0}.'.format(email))
+            username, fqdn = email.split('@')
+            user = MailUser(username=username.strip())
+            return kind, fqdn, user, get_field(row, 'password')
+
+        if kind == 'alias':
+            source = get_field(row, 'source').strip().lower()
+            destination = get_field(row, 'destination').strip().lower()
+            if '@' not in source:
+                raise RowError('Improperly formatted source address: {0}.'.format(source))
+            try:
+                validate_email(destination)
+            except ValidationError:
+                raise RowError('Improperly formatted email address: {0}.'.format(destination))
+            fqdn = (get_field(row, 'domain') or source.split('@', 1)[1]).strip().lower()
+            if fqdn.startswith('@'):
+                fqdn = fqdn[1:]
+            return kind, fqdn, Alias(source=source, destination=destination), None
+
+        raise RowError("Unknown row type: '{0}'.".format(kind))
+
+    def _resolve_domains(self, fqdns):
+        """
+        Look up every domain not already known with one query, creating
+        the missing ones if --create-domain is used.
+        """
+        missing = fqdns.difference(self.domains)
+        if not missing:
+            return
+        for domain in Domain.objects.filter(fqdn__in=missing):
+            self.domains[domain.fqdn] = domain
+            missing.discard(domain.fqdn)
+        for fqdn in sorted(missing):
+            domain = None
+            if self.create_domain:
+                with transaction.commit_on_success():
+                    domain, created = Domain.objects.get_or_create(fqdn=fqdn)
+                if created:
+                    self.stdout.write('Created domain: {0}.\n'.format(fqdn))
+            self.domains[fqdn] = domain
@@ -0,0 +1,182 @@
+"""
+List domains, mailboxes or aliases command.
+"""
+
+import csv
+import json
+from datetime import datetime, time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from vmail.db import iterate_by_pk
+from vmail.metrics import instrumented_command
+from vmail.models import Domain, MailUser, Alias
+from vmail.routers import mail_databases
+
+HELP_TEXT = """
+Print the domains, mailboxes or aliases, optionally only those of the
+--domain, the --active or --inactive ones, and those created on or
+after --created-after, or before --created-before (YYYY-MM-DD, or an
+ISO 8601 date and time).  Mailboxes and aliases are active if both
+they and their domain are.  Rows are written as JSON Lines (the
+default), CSV with a header row, or a YAML list, in primary key
+order on each database:
+
+    vmail-list aliases --domain example.org --format yaml
+    - source: "bob@example.org"
+      destination: "robert@example.org"
+      ...
+
+The rows are read --batch-size at a time, each batch from the key the
+last one stopped at, so the memory used stays the same however many
+rows are printed.
+"""
+
+# The model and printed (column, field) pairs of each kind of row.
+KINDS = {
+    'domains': (Domain, (('fqdn', 'fqdn'), ('active', 'active'), ('created', 'created'))),
+    'mailboxes': (MailUser, (('email', 'email'), ('active', 'active'),
+                             ('domain_active', 'domain_active'), ('created', 'created'))),
+    'aliases': (Alias, (('source', 'source'), ('destination', 'destination'),
+                        ('domain', 'domain__fqdn'), ('active', 'active'),
+                        ('domain_active', 'domain_active'), ('created', 'created'))),
+}
+
+
+def _value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def write_jsonl(stdout, columns, rows):
+    for row in rows:
+        stdout.write(json.dumps(dict(zip(columns, map(_value, row))), sort_keys=True) + '\n')
+
+
+def write_csv(stdout, columns, rows):
+    writer = csv.writer(stdout, lineterminator='\n')
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([(u'{0}'.format(_value(value))).encode('utf-8') for value in row])
+
+
+def write_yaml(stdout, columns, rows):
+    empty = True
+    for row in rows:
+        # JSON scalars are also YAML flow scalars, quoting strings safely
+        lines = ['{0}: {1}'.format(column, json.dumps(_value(value)))
+                 for column, value in zip(columns, row)]
+        stdout.write('- ' + '\n  '.join(lines) + '\n')
+        empty = False
+    if empty:
+        stdout.write('[]\n')
+
+
+WRITERS = {'jsonl': write_jsonl, 'csv': write_csv, 'yaml': write_yaml}
+
+
+class Command(BaseCommand):
+    args = ('domains|mailboxes|aliases [--domain domain] [--active|--inactive]'
+            ' [--created-after date] [--created-before date] [--format jsonl|csv|yaml]'
+            ' [--batch-size size]')
+    help = (HELP_TEXT)
+    option_list = BaseCommand.option_list + (
+        make_option('--domain',
+                    dest='domain',
+                    default=None,
+                    help='List only the rows of this domain.'),
+        make_option('--active',
+                    action='store_const',
+                    const=True,
+                    dest='active',
+                    default=None,
+                    help='List only the active rows.'),
+        make_option('--inactive',
+                    action='store_const',
+                    const=False,
+                    dest='active',
+                    default=None,
+                    help='List only the inactive rows.'),
+        make_option('--created-after',
+                    dest='created_after',
+                    default=None,
+                    help='List only the rows created on or after this date.'),
+        make_option('--created-before',
+                    dest='created_before',
+                    default=None,
+                    help='List only the rows created before this date.'),
+        make_option('--format',
+                    dest='format',
+                    default='jsonl',
+                    help='Output format, jsonl, csv or yaml.'),
+        make_option('--batch-size',
+                    dest='batch_size',
+                    type='int',
+                    default=500,
+                    help='Number of rows read per query.'),
+    )
+
+    @instrumented_command('command.vmail-list')
+    def handle(self, *args, **options):
+        if len(args) != 1 or args[0] not in KINDS:
+            raise CommandError('Required arguments: {0}'.format(self.args))
+        if options['format'] not in WRITERS:
+            raise CommandError("Unknown format '{0}'.".format(options['format']))
+        if options['batch_size'] < 1:
+            raise CommandError('Batch size must be at least 1.')
+
+        model, fields = KINDS[args[0]]
+        rows = model.objects.all()
+        databases = [None] if model is Domain else mail_databases()
+        if options['domain'] is not None:
+            fqdn = options['domain'].strip().lower()
+            try:
+                domain = Domain.objects.get(fqdn=fqdn)
+            except Domain.DoesNotExist:
+                raise CommandError("Domain '{0}', does not exist.".format(fqdn))
+            if model is Domain:
+                rows = rows.filter(pk=domain.pk)
+            else:
+                rows = rows.filter(domain=domain)
+                databases = [domain.shard or None]
+        if options['active'] is not None:
+            active = Q(active=True)
+            if model is not Domain:
+                active &= Q(domain_active=True)
+            rows = rows.filter(active if options['active'] else ~active)
+        for name, lookup in (('created_after', 'created__gte'), ('created_before', 'created__lt')):
+            if options[name] is not None:
+                rows = rows.filter(**{lookup: self._parse_date(name, options[name])})
+
+        rows = rows.values_list('pk', *[field for _, field in fields])
+        self.count = 0
+        WRITERS[options['format']](self.stdout, [column for column, _ in fields],
+                                   self._rows(rows, databases, options['batch_size']))
+        self.stderr.write('Listed {0} {1}.\n'.format(self.count, args[0]))
+
+    def _rows(self, rows, databases, batch_size):
+        for using in databases:
+            for row in iterate_by_pk(rows.using(using), batch_size):
+                self.count += 1
+                yield row[1:]
+
+    def _parse_date(self, name, value):
+        try:
+            parsed = parse_datetime(value)
+            if parsed is None:
+                parsed = parse_date(value)
+                if parsed is not None:
+                    parsed = datetime.combine(parsed, time())
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise CommandError("Bad date for --{0}: '{1}'.".format(name.replace('_', '-'), value))
+        if settings.USE_TZ and timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, timezone.get_default_timezone())
+        return parsed
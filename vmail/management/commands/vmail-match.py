@@ -0,0 +1,39 @@
+"""
+Match addresses against the alias sources command.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vmail.matcher import AliasMatcher
+from vmail.metrics import instrumented_command
+
+HELP_TEXT = """
+Print the most specific alias source matching each address, and its
+destinations, one alias hop only: an alias of the address itself,
+then the catch-all alias of its domain (@example.org), then the
+wildcard alias of its nearest parent domain (@.example.org, matching
+any subdomain of example.org).  The active aliases are read into
+memory once, and each address is matched in memory.
+
+    john@mail.example.org > @.example.org (wildcard): john@example.org
+"""
+
+
+class Command(BaseCommand):
+    args = 'address [address ...]'
+    help = (HELP_TEXT)
+
+    @instrumented_command('command.vmail-match')
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError('Required arguments: {0}'.format(self.args))
+
+        matcher = AliasMatcher.load()
+        for address in args:
+            address = address.strip().lower()
+            match = matcher.match(address)
+            if match is None:
+                self.stdout.write('{0}: no match\n'.format(address))
+            else:
+                self.stdout.write('{0} > {1} ({2}): {3}\n'.format(
+                    address, match.source, match.kind, ','.join(match.destinations)))
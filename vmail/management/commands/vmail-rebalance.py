@@ -0,0 +1,68 @@
+"""
+Move a domain's mail users and aliases to another shard command.
+"""
+
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vmail import shards
+from vmail.metrics import instrumented_command
+from vmail.models import Domain
+from vmail.routers import pinned
+
+HELP_TEXT = """
+Move the mail users, aliases and lookup entries of the domain to the
+shard, one of the VMAIL_SHARDS databases, or 'default', while they are
+in use.  The rows are copied in batches of --batch-size, then the
+domain is switched to the shard, and after --grace seconds (the
+VMAIL_DOMAIN_CACHE_TTL setting, 300 by default), once every process
+reads the domain's rows from the shard, the rows changed meanwhile are
+copied again and the rows are deleted from the old database.  The
+grace period must be at least as long as the domain cache keeps a
+domain in every process.  A failed move can be run again.
+"""
+
+
+class Command(BaseCommand):
+    args = 'domain shard [--batch-size size] [--grace seconds]'
+    help = (HELP_TEXT)
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size',
+                    dest='batch_size',
+                    type='int',
+                    default=shards.BATCH_SIZE,
+                    help='Number of rows copied per transaction.'),
+        make_option('--grace',
+                    dest='grace',
+                    type='int',
+                    default=None,
+                    help='Seconds waited for the processes to see the switch.'),
+    )
+
+    @instrumented_command('command.vmail-rebalance')
+    @pinned
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError('Required arguments: {0}'.format(self.args))
+        if options['batch_size'] < 1:
+            raise CommandError('Batch size must be at least 1.')
+        if options['grace'] is not None and options['grace'] < 0:
+            raise CommandError('Grace must be at least 0.')
+
+        fqdn, target = args[0].strip().lower(), args[1]
+        try:
+            domain = Domain.objects.get(fqdn=fqdn)
+        except Domain.DoesNotExist:
+            raise CommandError("Domain '{0}', does not exist.".format(fqdn))
+
+        source = domain.shard or shards.PRIMARY
+        start = time.time()
+        try:
+            count = shards.move_domain(domain, target, options['batch_size'], options['grace'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write('Moved {0} from {1} to {2}: {3} mail users and aliases,'
+                          ' in {4:.2f}s.\n'.format(fqdn, source, target, count,
+                                                   time.time() - start))
@@ -0,0 +1,65 @@
+"""
+Resolve addresses through the aliases command.
+"""
+
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vmail.metrics import instrumented_command
+from vmail.resolver import AliasResolver, ResolveError
+
+HELP_TEXT = """
+Expand each address through the aliases, recursively, and print
+the final destination addresses.  Aliases of the exact address are
+used first, then a local mailbox of the address, and then catch-all
+aliases of the address's domain.  Alias cycles are reported.
+
+With --all every alias source is expanded, and the flattened alias
+map is printed in postmap(1) format, followed by a summary of the
+expansion cost.
+"""
+
+
+class Command(BaseCommand):
+    args = 'address [address ...] | --all'
+    help = (HELP_TEXT)
+    option_list = BaseCommand.option_list + (
+        make_option('--all',
+                    action='store_true',
+                    dest='all',
+                    default=False,
+                    help='Expand every alias source.'),
+    )
+
+    @instrumented_command('command.vmail-resolve')
+    def handle(self, *args, **options):
+        if bool(args) == options['all']:
+            raise CommandError('Required arguments: address [address ...] | --all')
+
+        resolver = AliasResolver(preload=options['all'])
+        addresses = args or resolver.sources()
+
+        start = time.time()
+        cycles, max_depth = set(), 0
+        for address in addresses:
+            try:
+                expansion = resolver.expand(address)
+            except ResolveError as e:
+                raise CommandError(str(e))
+            cycles.update(expansion.cycles)
+            max_depth = max(max_depth, expansion.depth)
+            destinations = ','.join(sorted(expansion.destinations))
+            if options['all']:
+                self.stdout.write('{0} {1}\n'.format(address, destinations))
+            else:
+                self.stdout.write('{0} > {1}\n'.format(address, destinations))
+        elapsed = time.time() - start
+
+        for cycle in sorted(cycles):
+            self.stderr.write('Cycle: {0}\n'.format(' > '.join(cycle)))
+        if options['all']:
+            self.stderr.write('Expanded {0} addresses, {1} cycles, maximum depth {2},'
+                              ' in {3:.2f}s.\n'.format(len(addresses), len(cycles),
+                                                       max_depth, elapsed))
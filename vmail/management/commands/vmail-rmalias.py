@@ -0,0 +1,66 @@
+"""
+Remove email alias entries command.
+"""
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vmail import bulk
+from vmail.metrics import instrumented_command
+from vmail.models import Domain, Alias
+from vmail.routers import pinned
+
+HELP_TEXT = """
+Remove the aliases of the source address, or catch-all (@example.org),
+to every destination, or only to the destination address if given.
+The aliases are deleted --batch-size at a time, each batch in its own
+short transaction.  Use --dry-run to print what would be removed
+instead.
+
+    vmail-rmalias john@example.org             # every destination
+    vmail-rmalias john@example.org jeff@example.com
+"""
+
+
+class Command(BaseCommand):
+    args = 'source-address [destination-address] [--dry-run] [--batch-size size]'
+    help = (HELP_TEXT)
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run',
+                    action='store_true',
+                    dest='dry_run',
+                    default=False,
+                    help='Print what would be removed, without removing it.'),
+        make_option('--batch-size',
+                    dest='batch_size',
+                    type='int',
+                    default=500,
+                    help='Number of aliases deleted per transaction.'),
+    )
+
+    @instrumented_command('command.vmail-rmalias')
+    @pinned
+    def handle(self, *args, **options):
+        if len(args) not in (1, 2):
+            raise CommandError('Required arguments: {0}'.format(self.args))
+        if options['batch_size'] < 1:
+            raise CommandError('Batch size must be at least 1.')
+
+        source = args[0].strip().lower()
+        fqdn = source.rpartition('@')[2]
+        aliases = Alias.objects.using(Domain.objects.shard_for(fqdn)).filter(source=source)
+        if len(args) == 2:
+            aliases = aliases.filter(destination=args[1].strip().lower())
+        count = aliases.count()
+        if not count:
+            raise CommandError('Alias does not exist.')
+
+        if options['dry_run']:
+            self.stdout.write('Would remove {0} aliases.\n'.format(count))
+            return
+        count = bulk.delete_rows(aliases, options['batch_size'], self._progress)
+        self.stdout.write('Removed {0} aliases.\n'.format(count))
+
+    def _progress(self, count):
+        self.stdout.write('Deleted {0} aliases.\n'.format(count))
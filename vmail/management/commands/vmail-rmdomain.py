@@ -0,0 +1,69 @@
+"""
+Remove domains, with their mailboxes and aliases, command.
+"""
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vmail import bulk
+from vmail.metrics import instrumented_command
+from vmail.models import Domain, MailUser, Alias
+from vmail.routers import pinned
+
+HELP_TEXT = """
+Remove each named domain, with all of its mailboxes and aliases.  The
+aliases and mailboxes are deleted --batch-size rows at a time, each
+batch in its own short transaction, so the deletes never hold up the
+Postfix and Dovecot lookups for long, and the domain itself is deleted
+last.  Use --dry-run to print what would be removed instead.
+
+    vmail-rmdomain --dry-run example.org
+"""
+
+NAMES = {MailUser: 'mailboxes', Alias: 'aliases'}
+
+
+class Command(BaseCommand):
+    args = 'domain [domain ...] [--dry-run] [--batch-size size]'
+    help = (HELP_TEXT)
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run',
+                    action='store_true',
+                    dest='dry_run',
+                    default=False,
+                    help='Print what would be removed, without removing it.'),
+        make_option('--batch-size',
+                    dest='batch_size',
+                    type='int',
+                    default=500,
+                    help='Number of rows deleted per transaction.'),
+    )
+
+    @instrumented_command('command.vmail-rmdomain')
+    @pinned
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError('Required arguments: {0}'.format(self.args))
+        if options['batch_size'] < 1:
+            raise CommandError('Batch size must be at least 1.')
+
+        fqdns = set(name.strip().lower() for name in args)
+        domains = list(Domain.objects.filter(fqdn__in=fqdns).order_by('fqdn'))
+        missing = sorted(fqdns - set(domain.fqdn for domain in domains))
+        if missing:
+            raise CommandError('Does not exist: {0}.'.format(', '.join(missing)))
+
+        for domain in domains:
+            if options['dry_run']:
+                using = domain.shard or None
+                self.stdout.write('Would remove {0}: {1} mailboxes and {2} aliases.\n'.format(
+                    domain.fqdn, MailUser.objects.using(using).filter(domain=domain).count(),
+                    Alias.objects.using(using).filter(domain=domain).count()))
+                continue
+            counts = bulk.delete_domain(domain, options['batch_size'], self._progress)
+            self.stdout.write('Removed {0}: {1} mailboxes and {2} aliases.\n'.format(
+                domain.fqdn, *counts))
+
+    def _progress(self, model, count):
+        self.stdout.write('Deleted {0} {1}.\n'.format(count, NAMES[model]))
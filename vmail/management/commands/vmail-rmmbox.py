@@ -0,0 +1,66 @@
+"""
+Remove mailboxes command.
+"""
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vmail import bulk
+from vmail.metrics import instrumented_command
+from vmail.models import MailUser
+from vmail.routers import pinned
+from vmail.shards import group_addresses
+
+HELP_TEXT = """
+Remove the mailbox of each email address.  The mailboxes are deleted
+--batch-size at a time, each batch in its own short transaction.
+Aliases to or from the addresses are kept; remove them with
+vmail-rmalias.  Use --dry-run to print what would be removed instead.
+"""
+
+
+class Command(BaseCommand):
+    args = 'email [email ...] [--dry-run] [--batch-size size]'
+    help = (HELP_TEXT)
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run',
+                    action='store_true',
+                    dest='dry_run',
+                    default=False,
+                    help='Print what would be removed, without removing it.'),
+        make_option('--batch-size',
+                    dest='batch_size',
+                    type='int',
+                    default=500,
+                    help='Number of mailboxes deleted per transaction.'),
+    )
+
+    @instrumented_command('command.vmail-rmmbox')
+    @pinned
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError('Required arguments: {0}'.format(self.args))
+        if options['batch_size'] < 1:
+            raise CommandError('Batch size must be at least 1.')
+
+        emails = set(email.strip().lower() for email in args)
+        users = [MailUser.objects.using(using).filter(email__in=group)
+                 for using, group in group_addresses(emails).items()]
+        found = set()
+        for queryset in users:
+            found.update(queryset.values_list('email', flat=True))
+        missing = sorted(emails - found)
+        if missing:
+            raise CommandError('Does not exist: {0}.'.format(', '.join(missing)))
+
+        if options['dry_run']:
+            self.stdout.write('Would remove {0} mailboxes.\n'.format(len(found)))
+            return
+        count = 0
+        for queryset in users:
+            count += bulk.delete_rows(queryset, options['batch_size'], self._progress)
+        self.stdout.write('Removed {0} mailboxes.\n'.format(count))
+
+    def _progress(self, count):
+        self.stdout.write('Deleted {0} mailboxes.\n'.format(count))
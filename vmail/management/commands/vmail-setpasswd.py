@@ -3,19 +3,51 @@ Set password command for administrators to set the password of existing
 mail users.
 """
 
+import sys
+import time
+from optparse import make_option
+
 from django.core.management.base import BaseCommand, CommandError
 from django.core.exceptions import ValidationError
 
+from vmail.bulk import set_passwords
+from vmail.metrics import instrumented_command
 from vmail.models import MailUser, Domain
+from vmail.routers import pinned
 
 
 class Command(BaseCommand):
-    args = 'email password'
+    args = 'email password | --from-file file [--workers workers]'
     help = ('Sets a mail users password. The current password is not\n'
             'required, and by default, the password must be supplied in\n'
-            'clear-text.')
+            'clear-text.  With --from-file the passwords of many mail\n'
+            'users are set, read as one whitespace separated email and\n'
+            "password per line, from the file, or standard input if '-'.")
+    option_list = BaseCommand.option_list + (
+        make_option('--from-file',
+                    dest='from_file',
+                    default=None,
+                    help='Read email and password pairs from a file.'),
+        make_option('--workers',
+                    dest='workers',
+                    type='int',
+                    default=None,
+                    help='Number of hashing processes, by default one per CPU.'),
+        make_option('--batch-size',
+                    dest='batch_size',
+                    type='int',
+                    default=1000,
+                    help='Number of passwords written per transaction.'),
+    )
 
+    @instrumented_command('command.vmail-setpasswd')
+    @pinned
     def handle(self, *args, **options):
+        if options['from_file'] is not None:
+            if args:
+                raise CommandError('Required arguments: --from-file file [--workers workers]')
+            return self._set_from_file(options)
+
         usage = 'Required arguments: email new_password'
         if len(args) != 2:
             raise CommandError(usage)
@@ -34,3 +66,43 @@ class Command(BaseCommand):
         user.set_password(password)
         user.save()
         self.stdout.write('Success.\n')
+
+    def _set_from_file(self, options):
+        if options['workers'] is not None and options['workers'] < 1:
+            raise CommandError('Workers must be at least 1.')
+        if options['batch_size'] < 1:
+            raise CommandError('Batch size must be at least 1.')
+
+        path = options['from_file']
+        try:
+            fp = sys.stdin if path == '-' else open(path)
+        except IOError as e:
+            raise CommandError("Cannot open '{0}': {1}.".format(path, e.strerror))
+
+        start = time.time()
+        try:
+            count, missing = set_passwords(self._read_pairs(fp), options['workers'],
+                                           options['batch_size'])
+        finally:
+            if fp is not sys.stdin:
+                fp.close()
+        elapsed = time.time() - start
+
+        for email in missing:
+            self.stderr.write('Username does not exist: {0}\n'.format(email))
+        rate = count / elapsed if elapsed else count
+        self.stdout.write('Set {0} passwords, {1} errors, in {2:.2f}s'
+                          ' ({3:.0f} passwords/sec).\n'.format(
+                              count, len(missing) + self.malformed, elapsed, rate))
+
+    def _read_pairs(self, fp):
+        self.malformed = 0
+        for lineno, line in enumerate(fp, 1):
+            fields = line.rstrip('\r\n').split(None, 1)
+            if not fields:
+                continue
+            if len(fields) != 2:
+                self.malformed += 1
+                self.stderr.write('Line {0}: Missing password.\n'.format(lineno))
+                continue
+            yield fields
@@ -0,0 +1,78 @@
+"""
+Postfix socketmap lookup daemon command.
+"""
+
+import signal
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vmail.daemon import make_server, Reloader
+from vmail.maps import MapIndex, MAP_NAMES
+from vmail.metrics import instrumented_command
+from vmail.socketmap import SocketmapHandler
+
+HELP_TEXT = """
+Serve the Postfix virtual mail lookup tables over the Postfix
+socketmap protocol.  The domain, mailbox, and alias tables are
+loaded into memory at start-up, and lookups are answered without
+querying the database.  The tables are reloaded every
+--reload-interval seconds, and whenever SIGHUP is received.
+
+The following maps are served, each answering the same as the
+SQL query of the same name in docs/configuration.rst:
+
+    virtual_mailbox_domains, virtual_mailbox_maps,
+    virtual_alias_maps, email2email
+
+Ex: virtual_alias_maps = socketmap:unix:/var/run/vmail/socketmap:virtual_alias_maps
+"""
+
+
+class Command(BaseCommand):
+    args = '[--listen address] [--reload-interval seconds]'
+    help = (HELP_TEXT)
+    option_list = BaseCommand.option_list + (
+        make_option('--listen',
+                    dest='listen',
+                    default='unix:/var/run/vmail/socketmap',
+                    help="Listen address, 'unix:/path' or 'inet:host:port'."),
+        make_option('--reload-interval',
+                    dest='reload_interval',
+                    type='int',
+                    default=300,
+                    help='Seconds between table reloads, 0 to only reload on SIGHUP.'),
+    )
+
+    @instrumented_command('command.vmail-socketmap')
+    def handle(self, *args, **options):
+        if args:
+            raise CommandError('Usage: {0}'.format(self.args))
+
+        index = MapIndex()
+        index.load()
+        self._write_sizes(index)
+
+        try:
+            server = make_server(options['listen'], SocketmapHandler)
+        except ValueError as e:
+            raise CommandError(str(e))
+        server.index = index
+
+        reloader = Reloader(index.load, options['reload_interval'],
+                            errors=self.stderr)
+        reloader.start()
+        signal.signal(signal.SIGHUP, lambda signum, frame: reloader.trigger())
+
+        self.stdout.write('Listening on {0}.\n'.format(options['listen']))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+    def _write_sizes(self, index):
+        sizes = index.sizes()
+        for name in MAP_NAMES:
+            self.stdout.write('Loaded {0}: {1} keys.\n'.format(name, sizes[name]))
@@ -0,0 +1,46 @@
+"""
+Bring the single-table lookup entries up to date command.
+"""
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from vmail import lookup
+from vmail.metrics import instrumented_command
+from vmail.models import LookupEntry
+from vmail.routers import pinned
+
+HELP_TEXT = """
+Bring every entry of the vmail_lookup table up to date with the mail
+users, aliases and domains, and print the number of entries written
+or deleted.  Entries are kept up to date as the models are saved, so
+this is only needed once the table is first created, or after the
+tables are changed without the models, such as with raw SQL.  Each
+shard has its own entries, synced with --database.
+"""
+
+
+class Command(BaseCommand):
+    args = '[--database database]'
+    help = (HELP_TEXT)
+    option_list = BaseCommand.option_list + (
+        make_option('--database',
+                    dest='database',
+                    default=DEFAULT_DB_ALIAS,
+                    help='Database, such as a shard, to sync the entries of.'),
+    )
+
+    @instrumented_command('command.vmail-sync-lookup')
+    @pinned
+    def handle(self, *args, **options):
+        if args:
+            raise CommandError('Usage: vmail-sync-lookup [--database database]')
+        using = options['database']
+        if using not in connections:
+            raise CommandError("Unknown database '{0}'.".format(using))
+
+        changed = lookup.rebuild(using)
+        self.stdout.write('Synced {0} lookup entries, {1} changed.\n'.format(
+            LookupEntry.objects.using(using).count(), changed))
@@ -0,0 +1,164 @@
+"""
+In-memory Postfix lookup tables built from the virtual mail models.
+
+The tables are keyed the same way as the SQL queries in
+docs/configuration.rst, so a lookup against a `MapIndex` returns the
+same result as the equivalent Postfix SQL map.  A `MapIndex` also
+accepts the subdomains covered by wildcard aliases as mailbox domains,
+and answers their catch-all lookups from the wildcards, so Postfix
+accepts and rewrites mail to them.
+"""
+
+import threading
+from collections import OrderedDict
+from itertools import chain, groupby
+from operator import itemgetter
+
+from django.utils import timezone
+
+from .matcher import AliasMatcher
+from .models import Domain, MailUser, Alias
+from .routers import mail_databases
+
+
+VIRTUAL_MAILBOX_DOMAINS = 'virtual_mailbox_domains'
+VIRTUAL_MAILBOX_MAPS = 'virtual_mailbox_maps'
+VIRTUAL_ALIAS_MAPS = 'virtual_alias_maps'
+EMAIL2EMAIL = 'email2email'
+
+MAP_NAMES = (VIRTUAL_MAILBOX_DOMAINS, VIRTUAL_MAILBOX_MAPS,
+             VIRTUAL_ALIAS_MAPS, EMAIL2EMAIL)
+
+
+# The SQL queries of docs/configuration.rst, keyed by map name, with the
+# Postfix and Dovecot placeholders replaced by named query parameters.
+LOOKUP_QUERIES = OrderedDict([
+    (VIRTUAL_MAILBOX_DOMAINS, (
+        "SELECT 1 FROM vmail_domain"
+        " WHERE vmail_domain.fqdn = %s AND vmail_domain.active = %s",
+        ('fqdn', 'active'))),
+    (VIRTUAL_MAILBOX_MAPS, (
+        "SELECT 1 FROM vmail_mailuser"
+        " WHERE email = %s AND active = %s AND domain_active = %s",
+        ('email', 'active', 'active'))),
+    (VIRTUAL_ALIAS_MAPS, (
+        "SELECT destination FROM vmail_alias"
+        " WHERE source = %s AND active = %s AND domain_active = %s",
+        ('source', 'active', 'active'))),
+    (EMAIL2EMAIL, (
+        "SELECT email FROM vmail_mailuser"
+        " WHERE email = %s AND active = %s AND domain_active = %s",
+        ('email', 'active', 'active'))),
+    ('password_query', (
+        "SELECT email AS user, shadigest AS password FROM vmail_mailuser"
+        " WHERE email = %s AND active = %s AND domain_active = %s",
+        ('email', 'active', 'active'))),
+])
+
+
+def active_domains():
+    """Fully qualified names of all active domains."""
+    return Domain.objects.filter(active=True).values_list('fqdn', flat=True)
+
+
+def active_mailboxes(using=None):
+    """Email addresses of active mail users in active domains, on the database `using`."""
+    return (MailUser.objects.using(using).filter(active=True, domain_active=True)
+            .values_list('email', flat=True))
+
+
+def active_aliases(using=None):
+    """
+    (source, destination) pairs of active aliases in active domains, on
+    the database `using`, ordered so that all destinations of a source
+    are adjacent.
+    """
+    return (Alias.objects.using(using).filter(active=True, domain_active=True)
+            .order_by('source', 'id')
+            .values_list('source', 'destination'))
+
+
+def map_items(name):
+    """
+    Generate the (key, value) pairs of the lookup table `name`, where
+    each value is what Postfix would receive from the SQL query.  Rows
+    are streamed from the database, and from each shard.  Raises
+    `KeyError` for an unknown table name.
+    """
+    databases = mail_databases()
+    if name == VIRTUAL_MAILBOX_DOMAINS:
+        for fqdn in active_domains().iterator():
+            yield fqdn, '1'
+    elif name in (VIRTUAL_MAILBOX_MAPS, EMAIL2EMAIL):
+        for email in chain.from_iterable(active_mailboxes(using).iterator()
+                                         for using in databases):
+            yield email, '1' if name == VIRTUAL_MAILBOX_MAPS else email
+    elif name == VIRTUAL_ALIAS_MAPS and len(databases) == 1:
+        rows = active_aliases().iterator()
+        for source, group in groupby(rows, itemgetter(0)):
+            yield source, ','.join(destination for _, destination in group)
+    elif name == VIRTUAL_ALIAS_MAPS:
+        # a source may have aliases owned by domains on different shards
+        groups = OrderedDict()
+        for using in databases:
+            for source, destination in active_aliases(using).iterator():
+                groups.setdefault(source, []).append(destination)
+        for source, destinations in groups.items():
+            yield source, ','.join(destinations)
+    else:
+        raise KeyError(name)
+
+
+def build_maps():
+    """
+    Read the domain, mailbox, and alias tables, of every shard, and
+    return a dictionary of lookup tables keyed by map name.
+    """
+    return dict((name, dict(map_items(name))) for name in MAP_NAMES)
+
+
+class MapIndex(object):
+    """
+    A reloadable set of in-memory lookup tables.  Lookups never touch
+    the database; `load` rebuilds every table and swaps them in at
+    once, so concurrent lookups see either the old or the new tables.
+    """
+
+    def __init__(self):
+        self._maps = dict((name, {}) for name in MAP_NAMES)
+        self._wildcards = AliasMatcher()
+        self._lock = threading.Lock()
+        self.loaded = None
+
+    def load(self):
+        """Rebuild all lookup tables from the database."""
+        with self._lock:
+            maps = build_maps()
+            self._wildcards = AliasMatcher(
+                (source, destination) for source, value in maps[VIRTUAL_ALIAS_MAPS].items()
+                if source.startswith('@.') for destination in value.split(','))
+            self._maps = maps
+            self.loaded = timezone.now()
+
+    def lookup(self, name, key):
+        """
+        Return the value for `key` in the table `name`, or None if the
+        key is not found.  Raises `KeyError` for an unknown table name.
+        """
+        key = key.strip().lower()
+        value = self._maps[name].get(key)
+        if value is None and name == VIRTUAL_MAILBOX_DOMAINS:
+            # a subdomain is only accepted if a parent domain's wildcard takes its mail
+            if self._wildcards.match('@' + key) is not None:
+                value = '1'
+        elif value is None and name == VIRTUAL_ALIAS_MAPS and key.startswith('@'):
+            # Postfix looks up '@domain' last, which a parent domain's wildcard answers
+            match = self._wildcards.match(key)
+            if match is not None:
+                value = ','.join(match.destinations)
+        return value
+
+    def sizes(self):
+        """Return the number of keys in each lookup table."""
+        maps = self._maps
+        return dict((name, len(maps[name])) for name in MAP_NAMES)
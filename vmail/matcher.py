@@ -0,0 +1,123 @@
+"""
+In-memory matching of addresses against the alias sources.
+
+An alias source is an address, such as 'john@example.org', a catch-all
+of a domain, '@example.org', or a wildcard of the subdomains of a
+domain, '@.example.org', which matches 'john@mail.example.org' and
+'john@a.b.example.org', but not 'john@example.org'.  An `AliasMatcher`
+keeps the addresses in a dictionary, and the catch-alls and wildcards
+in a trie of the domain labels, in reverse, so one walk down the trie
+from the top-level domain finds both the catch-all of the address's
+domain and the wildcard of its nearest parent domain.
+"""
+
+from collections import namedtuple
+from itertools import chain
+
+EXACT = 'exact'
+CATCHALL = 'catch-all'
+WILDCARD = 'wildcard'
+
+# The alias source an address matched, the kind of match, and a tuple of
+# the destinations of the source.
+Match = namedtuple('Match', 'source kind destinations')
+
+
+def candidate_sources(address):
+    """
+    Return the alias sources which may match an address, from the most
+    to the least specific: the address, the catch-all of its domain,
+    and the wildcards of each parent domain.
+    """
+    address = address.strip().lower()
+    _, _, fqdn = address.rpartition('@')
+    sources = [address, '@' + fqdn]
+    labels = fqdn.split('.')
+    sources.extend('@.' + '.'.join(labels[i:]) for i in range(1, len(labels)))
+    return sources
+
+
+class _Node(object):
+    __slots__ = ('children', 'catchall', 'wildcard')
+
+    def __init__(self):
+        self.children = {}
+        self.catchall = None
+        self.wildcard = None
+
+
+class AliasMatcher(object):
+    """
+    Matches addresses against alias sources, read from the iterable of
+    (source, destination) pairs `aliases`.  A source's destinations
+    keep the order of the pairs.  The matcher is not updated as the
+    aliases change; build a new one, such as with `load`.
+    """
+
+    def __init__(self, aliases=()):
+        self.exact = {}
+        self.root = _Node()
+        for source, destination in aliases:
+            self.add(source, destination)
+
+    @classmethod
+    def load(cls):
+        """Return a matcher of the active aliases in active domains, of every shard."""
+        from .maps import active_aliases
+        from .routers import mail_databases
+        return cls(chain.from_iterable(active_aliases(using).iterator()
+                                       for using in mail_databases()))
+
+    def add(self, source, destination):
+        """Add a destination of an alias source."""
+        source = source.strip().lower()
+        user, _, fqdn = source.rpartition('@')
+        if user or not source.startswith('@'):
+            self.exact.setdefault(source, []).append(destination)
+            return
+        node = self.root
+        for label in reversed(fqdn.lstrip('.').split('.')):
+            child = node.children.get(label)
+            if child is None:
+                child = node.children[label] = _Node()
+            node = child
+        attr = 'wildcard' if fqdn.startswith('.') else 'catchall'
+        if getattr(node, attr) is None:
+            setattr(node, attr, [])
+        getattr(node, attr).append(destination)
+
+    def match(self, address):
+        """
+        Return the `Match` of the most specific alias source matching an
+        address: the address itself, then the catch-all of its domain,
+        then the wildcard of its nearest parent domain.  Returns None if
+        no source matches.  Local mailboxes are not considered; an
+        address which is a mailbox is delivered to before its catch-all
+        by the email2email map in docs/configuration.rst.
+        """
+        address = address.strip().lower()
+        destinations = self.exact.get(address)
+        if destinations is not None:
+            return Match(address, EXACT, tuple(destinations))
+
+        _, _, fqdn = address.rpartition('@')
+        labels = fqdn.split('.')
+        node, wildcard = self.root, None
+        for depth, label in enumerate(reversed(labels), 1):
+            node = node.children.get(label)
+            if node is None:
+                break
+            # a wildcard matches only the subdomains of its domain
+            if node.wildcard is not None and depth < len(labels):
+                wildcard = depth, node.wildcard
+        else:
+            if node.catchall is not None:
+                return Match('@' + fqdn, CATCHALL, tuple(node.catchall))
+        if wildcard is not None:
+            depth, destinations = wildcard
+            return Match('@.' + '.'.join(labels[-depth:]), WILDCARD, tuple(destinations))
+        return None
+
+    def sources(self):
+        """Return the sorted alias sources, excluding catch-alls and wildcards."""
+        return sorted(self.exact)
@@ -0,0 +1,336 @@
+"""
+Opt-in timings of password hashing, lookups and management commands.
+
+With the VMAIL_METRICS setting True, each call of a function decorated
+with `instrumented` is timed, along with the number and duration of
+the database queries it made, and recorded in `registry` under the
+function's name.  Each call also sends the `call_measured` signal.
+
+The registry can be written in the Prometheus text format with
+`write_textfile`, for the node exporter's textfile collector, which
+management commands do as they finish, each to its own file, when
+VMAIL_METRICS_TEXTFILE is set to a path.  When VMAIL_METRICS_STATSD is
+set to a (host, port) address, each call is also sent over UDP in the
+statsd format.
+"""
+
+import os
+import re
+import socket
+import threading
+from collections import OrderedDict
+from functools import wraps
+from timeit import default_timer
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends import util
+from django.dispatch import Signal
+
+from .export import atomic_write
+
+call_measured = Signal(providing_args=['name', 'seconds', 'queries', 'query_seconds',
+                                       'error'])
+
+
+def enabled():
+    return getattr(settings, 'VMAIL_METRICS', False)
+
+
+class Metric(object):
+    """Totals of the calls of one instrumented function."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.queries = 0
+        self.query_seconds = 0.0
+
+    def add(self, seconds, queries, query_seconds, error):
+        self.calls += 1
+        self.errors += int(error)
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.queries += queries
+        self.query_seconds += query_seconds
+
+
+class Registry(object):
+    """A thread-safe collection of `Metric` totals by name."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, queries=0, query_seconds=0.0, error=False):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Metric()
+            metric.add(seconds, queries, query_seconds, error)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def items(self):
+        """Return a list of the (name, metric) pairs, sorted by name."""
+        with self._lock:
+            return sorted(self._metrics.items())
+
+    def clear(self):
+        with self._lock:
+            self._metrics.clear()
+
+registry = Registry()
+
+
+class _CountingCursor(object):
+    """A cursor wrapper adding each query's time to a `_QueryCounter`."""
+
+    def __init__(self, cursor, counter):
+        self.cursor = cursor
+        self.counter = counter
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def execute(self, *args, **kwargs):
+        start = default_timer()
+        try:
+            return self.cursor.execute(*args, **kwargs)
+        finally:
+            self.counter.add(default_timer() - start)
+
+    def executemany(self, *args, **kwargs):
+        start = default_timer()
+        try:
+            return self.cursor.executemany(*args, **kwargs)
+        finally:
+            self.counter.add(default_timer() - start)
+
+
+class _QueryCounter(object):
+    """
+    Counts the queries made on a database connection, and their time,
+    while at least one `_QueryLog` is open, without keeping the queries
+    themselves.  The counting cursors are handed out through the
+    connection's debug cursor hook, and wrap the cursor the connection
+    would otherwise have used, so `connection.queries` is still only
+    kept if DEBUG or the connection's own debug cursor is on.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.queries = 0
+        self.seconds = 0.0
+        self.depth = 0
+        self.use_debug_cursor = None
+
+    @classmethod
+    def get(cls, connection):
+        counter = getattr(connection, '_vmail_query_counter', None)
+        if counter is None:
+            counter = connection._vmail_query_counter = cls(connection)
+        return counter
+
+    def add(self, seconds):
+        self.queries += 1
+        self.seconds += seconds
+
+    def start(self):
+        if not self.depth:
+            self.use_debug_cursor = self.connection.use_debug_cursor
+            self.connection.use_debug_cursor = True
+            self.connection.make_debug_cursor = self.make_cursor
+        self.depth += 1
+        return self.queries, self.seconds
+
+    def stop(self):
+        self.depth -= 1
+        if not self.depth:
+            del self.connection.make_debug_cursor
+            self.connection.use_debug_cursor = self.use_debug_cursor
+
+    def make_cursor(self, cursor):
+        connection = self.connection
+        if self.use_debug_cursor or (self.use_debug_cursor is None and settings.DEBUG):
+            cursor = type(connection).make_debug_cursor(connection, cursor)
+        else:
+            cursor = util.CursorWrapper(cursor, connection)
+        return _CountingCursor(cursor, self)
+
+
+class _QueryLog(object):
+    """
+    Counts the queries made on every database connection while it is
+    open.  Logs may be nested, as when an instrumented command calls
+    instrumented functions.
+    """
+
+    def __init__(self):
+        self.marks = []
+        for connection in connections.all():
+            counter = _QueryCounter.get(connection)
+            self.marks.append((counter, counter.start()))
+
+    def close(self):
+        queries, seconds = 0, 0.0
+        for counter, (start_queries, start_seconds) in self.marks:
+            queries += counter.queries - start_queries
+            seconds += counter.seconds - start_seconds
+            counter.stop()
+        return queries, seconds
+
+
+def instrumented(name):
+    """
+    Decorate a function so that, if VMAIL_METRICS is True, each of its
+    calls is measured and recorded under `name`.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            log = _QueryLog()
+            error = True
+            start = default_timer()
+            try:
+                result = func(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                seconds = default_timer() - start
+                queries, query_seconds = log.close()
+                registry.record(name, seconds, queries, query_seconds, error)
+                call_measured.send(sender=wrapper, name=name, seconds=seconds,
+                                   queries=queries, query_seconds=query_seconds,
+                                   error=error)
+        return wrapper
+    return decorator
+
+
+def instrumented_command(name):
+    """
+    Decorate a management command's `handle` like `instrumented`, and
+    write the registry to the command's own file next to
+    VMAIL_METRICS_TEXTFILE, if it is set, once the command finishes.
+    """
+    def decorator(func):
+        measured = instrumented(name)(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return measured(*args, **kwargs)
+            finally:
+                path = getattr(settings, 'VMAIL_METRICS_TEXTFILE', None)
+                if enabled() and path:
+                    write_textfile(textfile_path(path, name))
+        return wrapper
+    return decorator
+
+
+def textfile_path(path, name):
+    """
+    Return the path of the textfile of the command `name`, `path` with
+    the name inserted before its extension, so that commands running
+    at the same time each write their own file.
+    """
+    root, ext = os.path.splitext(path)
+    return '{0}.{1}{2}'.format(root, re.sub(r'[^\w.-]', '_', name), ext)
+
+
+def _label(name):
+    return name.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# The registry only holds the calls of the process writing the file, so
+# the values are exported as gauges rather than counters.
+TEXTFILE_METRICS = [
+    ('vmail_calls', 'gauge', 'Instrumented calls.', 'calls'),
+    ('vmail_call_errors', 'gauge', 'Instrumented calls which raised.', 'errors'),
+    ('vmail_call_seconds', 'gauge', 'Time spent in instrumented calls.', 'seconds'),
+    ('vmail_call_seconds_max', 'gauge', 'Longest instrumented call.', 'max_seconds'),
+    ('vmail_call_queries', 'gauge', 'Database queries of instrumented calls.', 'queries'),
+    ('vmail_call_query_seconds', 'gauge',
+     'Time spent in database queries of instrumented calls.', 'query_seconds'),
+]
+
+
+def format_textfile(registry=registry):
+    """Return the metrics of `registry` in the Prometheus text format."""
+    items = registry.items()
+    lines = []
+    for metric_name, metric_type, help_text, attr in TEXTFILE_METRICS:
+        lines.append('# HELP {0} {1}'.format(metric_name, help_text))
+        lines.append('# TYPE {0} {1}'.format(metric_name, metric_type))
+        for name, metric in items:
+            lines.append('{0}{{name="{1}"}} {2!r}'.format(
+                metric_name, _label(name), getattr(metric, attr)))
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path, registry=registry):
+    """
+    Write the metrics of `registry` to `path` in the Prometheus text
+    format.  The file is replaced atomically, so the collector never
+    reads a partly written file.
+    """
+    with atomic_write(path) as fp:
+        fp.write(format_textfile(registry))
+
+
+class StatsdClient(object):
+    """
+    Sends the measurements of each call to a statsd server over UDP, as
+    `<prefix>.<name>.time` and `<prefix>.<name>.query_time` timings in
+    milliseconds, and `<prefix>.<name>.calls`, `.errors` and `.queries`
+    counts.  Send errors are ignored, as statsd is best effort.
+    """
+
+    def __init__(self, address, prefix='vmail'):
+        self.address = tuple(address)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def format(self, name, seconds, queries, query_seconds, error):
+        key = '{0}.{1}'.format(self.prefix, re.sub(r'[^\w.-]', '_', name))
+        stats = OrderedDict([
+            ('calls', '1|c'),
+            ('time', '{0:.3f}|ms'.format(seconds * 1000)),
+            ('queries', '{0}|c'.format(queries)),
+            ('query_time', '{0:.3f}|ms'.format(query_seconds * 1000)),
+        ])
+        if error:
+            stats['errors'] = '1|c'
+        return '\n'.join('{0}.{1}:{2}'.format(key, stat, value)
+                         for stat, value in stats.items())
+
+    def send(self, name, seconds, queries=0, query_seconds=0.0, error=False):
+        packet = self.format(name, seconds, queries, query_seconds, error)
+        try:
+            self.socket.sendto(packet, self.address)
+        except socket.error:
+            pass
+
+_statsd_clients = {}
+
+
+def _send_statsd(sender, name, seconds, queries, query_seconds, error, **kwargs):
+    address = getattr(settings, 'VMAIL_METRICS_STATSD', None)
+    if not address:
+        return
+    prefix = getattr(settings, 'VMAIL_METRICS_STATSD_PREFIX', 'vmail')
+    key = (tuple(address), prefix)
+    client = _statsd_clients.get(key)
+    if client is None:
+        client = _statsd_clients[key] = StatsdClient(address, prefix)
+    client.send(name, seconds, queries, query_seconds, error)
+
+call_measured.connect(_send_statsd)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+from django.utils import timezone
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding field 'Domain.modified'
+        db.add_column(u'vmail_domain', 'modified',
+                      self.gf('django.db.models.fields.DateTimeField')(default=timezone.now, auto_now=True, db_index=True, blank=True),
+                      keep_default=False)
+
+        # Adding field 'MailUser.modified'
+        db.add_column(u'vmail_mailuser', 'modified',
+                      self.gf('django.db.models.fields.DateTimeField')(default=timezone.now, auto_now=True, db_index=True, blank=True),
+                      keep_default=False)
+
+        # Adding field 'Alias.modified'
+        db.add_column(u'vmail_alias', 'modified',
+                      self.gf('django.db.models.fields.DateTimeField')(default=timezone.now, auto_now=True, db_index=True, blank=True),
+                      keep_default=False)
+
+
+    def backwards(self, orm):
+        # Deleting field 'Domain.modified'
+        db.delete_column(u'vmail_domain', 'modified')
+
+        # Deleting field 'MailUser.modified'
+        db.delete_column(u'vmail_mailuser', 'modified')
+
+        # Deleting field 'Alias.modified'
+        db.delete_column(u'vmail_alias', 'modified')
+
+
+    models = {
+        u'vmail.alias': {
+            'Meta': {'unique_together': "(('source', 'destination'),)", 'object_name': 'Alias'},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'destination': ('django.db.models.fields.EmailField', [], {'max_length': '256'}),
+            'domain': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['vmail.Domain']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'source': ('django.db.models.fields.CharField', [], {'max_length': '256'})
+        },
+        u'vmail.domain': {
+            'Meta': {'object_name': 'Domain'},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'fqdn': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '256'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'})
+        },
+        u'vmail.mailuser': {
+            'Meta': {'unique_together': "(('username', 'domain'),)", 'object_name': 'MailUser'},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'domain': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['vmail.Domain']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'salt': ('django.db.models.fields.CharField', [], {'max_length': '96', 'blank': 'True'}),
+            'shadigest': ('django.db.models.fields.CharField', [], {'max_length': '256', 'blank': 'True'}),
+            'username': ('django.db.models.fields.SlugField', [], {'max_length': '96'})
+        }
+    }
+
+    complete_apps = ['vmail']
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+# The index name, table, and columns of the partial indexes covering the
+# Postfix and Dovecot queries in docs/configuration.rst.
+PARTIAL_INDEXES = (
+    ('vmail_domain_active_fqdn', 'vmail_domain', ('fqdn',)),
+    ('vmail_mailuser_active_username_domain_id', 'vmail_mailuser', ('username', 'domain_id')),
+    ('vmail_alias_active_source', 'vmail_alias', ('source', 'domain_id', 'destination')),
+)
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding index on 'MailUser', fields ['username', 'domain', 'active']
+        db.create_index(u'vmail_mailuser', ['username', 'domain_id', 'active'])
+
+        # Adding index on 'Alias', fields ['source', 'active', 'domain', 'destination']
+        db.create_index(u'vmail_alias', ['source', 'active', 'domain_id', 'destination'])
+
+        # Adding index on 'Domain', fields ['fqdn', 'active']
+        db.create_index(u'vmail_domain', ['fqdn', 'active'])
+
+        # Adding partial indexes of the active rows only, PostgreSQL only
+        if db.backend_name == 'postgres':
+            for name, table, columns in PARTIAL_INDEXES:
+                db.execute('CREATE INDEX {0} ON {1} ({2}) WHERE active'.format(
+                    name, table, ', '.join(columns)))
+
+
+    def backwards(self, orm):
+        # Removing partial indexes of the active rows only, PostgreSQL only
+        if db.backend_name == 'postgres':
+            for name, table, columns in PARTIAL_INDEXES:
+                db.execute('DROP INDEX {0}'.format(name))
+
+        # Removing index on 'Domain', fields ['fqdn', 'active']
+        db.delete_index(u'vmail_domain', ['fqdn', 'active'])
+
+        # Removing index on 'Alias', fields ['source', 'active', 'domain', 'destination']
+        db.delete_index(u'vmail_alias', ['source', 'active', 'domain_id', 'destination'])
+
+        # Removing index on 'MailUser', fields ['username', 'domain', 'active']
+        db.delete_index(u'vmail_mailuser', ['username', 'domain_id', 'active'])
+
+
+    models = {
+        u'vmail.alias': {
+            'Meta': {'unique_together': "(('source', 'destination'),)", 'object_name': 'Alias', 'index_together': "(('source', 'active', 'domain', 'destination'),)"},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'destination': ('django.db.models.fields.EmailField', [], {'max_length': '256'}),
+            'domain': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['vmail.Domain']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'source': ('django.db.models.fields.CharField', [], {'max_length': '256'})
+        },
+        u'vmail.domain': {
+            'Meta': {'object_name': 'Domain', 'index_together': "(('fqdn', 'active'),)"},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'fqdn': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '256'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'})
+        },
+        u'vmail.mailuser': {
+            'Meta': {'unique_together': "(('username', 'domain'),)", 'object_name': 'MailUser', 'index_together': "(('username', 'domain', 'active'),)"},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'domain': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['vmail.Domain']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'salt': ('django.db.models.fields.CharField', [], {'max_length': '96', 'blank': 'True'}),
+            'shadigest': ('django.db.models.fields.CharField', [], {'max_length': '256', 'blank': 'True'}),
+            'username': ('django.db.models.fields.SlugField', [], {'max_length': '96'})
+        }
+    }
+
+    complete_apps = ['vmail']
\ No newline at end of file
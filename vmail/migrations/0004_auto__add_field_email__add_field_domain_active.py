@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+# The index name, table, and columns of the PostgreSQL partial indexes of
+# migration 0003, replaced by partial indexes of the denormalized columns.
+OLD_PARTIAL_INDEXES = (
+    ('vmail_mailuser_active_username_domain_id', 'vmail_mailuser', ('username', 'domain_id')),
+    ('vmail_alias_active_source', 'vmail_alias', ('source', 'domain_id', 'destination')),
+)
+PARTIAL_INDEXES = (
+    ('vmail_mailuser_active_email', 'vmail_mailuser', ('email',)),
+    ('vmail_alias_active_source', 'vmail_alias', ('source', 'destination')),
+)
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding field 'MailUser.email', made unique once populated
+        db.add_column(u'vmail_mailuser', 'email',
+                      self.gf('django.db.models.fields.CharField')(default='', max_length=353),
+                      keep_default=False)
+
+        # Adding field 'MailUser.domain_active'
+        db.add_column(u'vmail_mailuser', 'domain_active',
+                      self.gf('django.db.models.fields.BooleanField')(default=True),
+                      keep_default=False)
+
+        # Adding field 'Alias.domain_active'
+        db.add_column(u'vmail_alias', 'domain_active',
+                      self.gf('django.db.models.fields.BooleanField')(default=True),
+                      keep_default=False)
+
+        # Populating the denormalized fields from the domains
+        if not db.dry_run:
+            if db.backend_name == 'mysql':
+                email = "CONCAT(username, '@', vmail_domain.fqdn)"
+            else:
+                email = "username || '@' || vmail_domain.fqdn"
+            db.execute('UPDATE vmail_mailuser SET'
+                       ' email = (SELECT {0} FROM vmail_domain'
+                       '          WHERE vmail_domain.id = vmail_mailuser.domain_id),'
+                       ' domain_active = (SELECT active FROM vmail_domain'
+                       '                  WHERE vmail_domain.id = vmail_mailuser.domain_id)'
+                       .format(email))
+            db.execute('UPDATE vmail_alias SET'
+                       ' domain_active = (SELECT active FROM vmail_domain'
+                       '                  WHERE vmail_domain.id = vmail_alias.domain_id)')
+
+        # Adding unique constraint on 'MailUser', fields ['email']
+        db.create_unique(u'vmail_mailuser', ['email'])
+
+        # Removing index on 'MailUser', fields ['username', 'domain', 'active']
+        db.delete_index(u'vmail_mailuser', ['username', 'domain_id', 'active'])
+
+        # Adding index on 'MailUser', fields ['email', 'active', 'domain_active']
+        db.create_index(u'vmail_mailuser', ['email', 'active', 'domain_active'])
+
+        # Removing index on 'Alias', fields ['source', 'active', 'domain', 'destination']
+        db.delete_index(u'vmail_alias', ['source', 'active', 'domain_id', 'destination'])
+
+        # Adding index on 'Alias', fields ['source', 'active', 'domain_active', 'destination']
+        db.create_index(u'vmail_alias', ['source', 'active', 'domain_active', 'destination'])
+
+        # Replacing partial indexes of the active rows only, PostgreSQL only
+        if db.backend_name == 'postgres':
+            for name, table, columns in OLD_PARTIAL_INDEXES:
+                db.execute('DROP INDEX {0}'.format(name))
+            for name, table, columns in PARTIAL_INDEXES:
+                db.execute('CREATE INDEX {0} ON {1} ({2}) WHERE active AND domain_active'
+                           .format(name, table, ', '.join(columns)))
+
+
+    def backwards(self, orm):
+        # Replacing partial indexes of the active rows only, PostgreSQL only
+        if db.backend_name == 'postgres':
+            for name, table, columns in PARTIAL_INDEXES:
+                db.execute('DROP INDEX {0}'.format(name))
+            for name, table, columns in OLD_PARTIAL_INDEXES:
+                db.execute('CREATE INDEX {0} ON {1} ({2}) WHERE active'.format(
+                    name, table, ', '.join(columns)))
+
+        # Removing index on 'Alias', fields ['source', 'active', 'domain_active', 'destination']
+        db.delete_index(u'vmail_alias', ['source', 'active', 'domain_active', 'destination'])
+
+        # Adding index on 'Alias', fields ['source', 'active', 'domain', 'destination']
+        db.create_index(u'vmail_alias', ['source', 'active', 'domain_id', 'destination'])
+
+        # Removing index on 'MailUser', fields ['email', 'active', 'domain_active']
+        db.delete_index(u'vmail_mailuser', ['email', 'active', 'domain_active'])
+
+        # Adding index on 'MailUser', fields ['username', 'domain', 'active']
+        db.create_index(u'vmail_mailuser', ['username', 'domain_id', 'active'])
+
+        # Removing unique constraint on 'MailUser', fields ['email']
+        db.delete_unique(u'vmail_mailuser', ['email'])
+
+        # Deleting field 'MailUser.email'
+        db.delete_column(u'vmail_mailuser', 'email')
+
+        # Deleting field 'MailUser.domain_active'
+        db.delete_column(u'vmail_mailuser', 'domain_active')
+
+        # Deleting field 'Alias.domain_active'
+        db.delete_column(u'vmail_alias', 'domain_active')
+
+
+    models = {
+        u'vmail.alias': {
+            'Meta': {'unique_together': "(('source', 'destination'),)", 'object_name': 'Alias', 'index_together': "(('source', 'active', 'domain_active', 'destination'),)"},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'destination': ('django.db.models.fields.EmailField', [], {'max_length': '256'}),
+            'domain': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['vmail.Domain']"}),
+            'domain_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'source': ('django.db.models.fields.CharField', [], {'max_length': '256'})
+        },
+        u'vmail.domain': {
+            'Meta': {'object_name': 'Domain', 'index_together': "(('fqdn', 'active'),)"},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'fqdn': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '256'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'})
+        },
+        u'vmail.mailuser': {
+            'Meta': {'unique_together': "(('username', 'domain'),)", 'object_name': 'MailUser', 'index_together': "(('email', 'active', 'domain_active'),)"},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'domain': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['vmail.Domain']"}),
+            'domain_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'email': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '353'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'salt': ('django.db.models.fields.CharField', [], {'max_length': '96', 'blank': 'True'}),
+            'shadigest': ('django.db.models.fields.CharField', [], {'max_length': '256', 'blank': 'True'}),
+            'username': ('django.db.models.fields.SlugField', [], {'max_length': '96'})
+        }
+    }
+
+    complete_apps = ['vmail']
\ No newline at end of file
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'Change'
+        db.create_table('vmail_change', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('model', self.gf('django.db.models.fields.CharField')(max_length=8)),
+            ('object_id', self.gf('django.db.models.fields.PositiveIntegerField')()),
+            ('action', self.gf('django.db.models.fields.CharField')(max_length=1)),
+            ('data', self.gf('django.db.models.fields.TextField')(blank=True)),
+            ('created', self.gf('django.db.models.fields.DateTimeField')(auto_now_add=True, db_index=True, blank=True)),
+        ))
+        db.send_create_signal(u'vmail', ['Change'])
+
+        # Adding index on 'Change', fields ['model', 'object_id']
+        db.create_index('vmail_change', ['model', 'object_id'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'Change', fields ['model', 'object_id']
+        db.delete_index('vmail_change', ['model', 'object_id'])
+
+        # Deleting model 'Change'
+        db.delete_table('vmail_change')
+
+
+    models = {
+        u'vmail.alias': {
+            'Meta': {'unique_together': "(('source', 'destination'),)", 'object_name': 'Alias', 'index_together': "(('source', 'active', 'domain_active', 'destination'),)"},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'destination': ('django.db.models.fields.EmailField', [], {'max_length': '256'}),
+            'domain': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['vmail.Domain']"}),
+            'domain_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'source': ('django.db.models.fields.CharField', [], {'max_length': '256'})
+        },
+        u'vmail.change': {
+            'Meta': {'object_name': 'Change', 'index_together': "(('model', 'object_id'),)"},
+            'action': ('django.db.models.fields.CharField', [], {'max_length': '1'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'data': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '8'}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {})
+        },
+        u'vmail.domain': {
+            'Meta': {'object_name': 'Domain', 'index_together': "(('fqdn', 'active'),)"},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'fqdn': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '256'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'})
+        },
+        u'vmail.lookupentry': {
+            'Meta': {'object_name': 'LookupEntry', 'db_table': "'vmail_lookup'"},
+            'address': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '353'}),
+            'destinations': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'digest': ('django.db.models.fields.CharField', [], {'max_length': '256', 'blank': 'True'}),
+            'domain': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['vmail.Domain']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '8'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'})
+        },
+        u'vmail.mailuser': {
+            'Meta': {'unique_together': "(('username', 'domain'),)", 'object_name': 'MailUser', 'index_together': "(('email', 'active', 'domain_active'),)"},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'domain': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['vmail.Domain']"}),
+            'domain_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'email': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '353'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'salt': ('django.db.models.fields.CharField', [], {'max_length': '96', 'blank': 'True'}),
+            'shadigest': ('django.db.models.fields.CharField', [], {'max_length': '256', 'blank': 'True'}),
+            'username': ('django.db.models.fields.SlugField', [], {'max_length': '96'})
+        }
+    }
+
+    complete_apps = ['vmail']
\ No newline at end of file
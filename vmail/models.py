@@ -2,13 +2,68 @@
 Virtual mail administration models.
 """
 
-import base64
-import hashlib
-import random
-import string
-
+from django.conf import settings
 from django.core.validators import validate_email
-from django.db import models
+from django.db import models, connections, router
+from django.db.models.signals import post_save, post_delete
+from django.utils import timezone
+from django.utils.importlib import import_module
+
+from . import hashers, metrics
+from .cache import LRUCache
+from .db import commit_on_success_unless_managed
+
+# cached in place of a domain which does not exist
+_MISSING = object()
+
+
+class DomainManager(models.Manager):
+    """
+    Adds a process-local cache of domains by fully qualified name.  The
+    cache holds at most VMAIL_DOMAIN_CACHE_SIZE domains, for at most
+    VMAIL_DOMAIN_CACHE_TTL seconds, and entries are dropped whenever a
+    domain is saved or deleted in this process.
+    """
+
+    def __init__(self):
+        super(DomainManager, self).__init__()
+        self.cache = LRUCache(getattr(settings, 'VMAIL_DOMAIN_CACHE_SIZE', 1000),
+                              getattr(settings, 'VMAIL_DOMAIN_CACHE_TTL', 300))
+
+    def get_cached(self, fqdn):
+        """
+        Return the `Domain` named `fqdn`, from the cache if possible.
+        Raises `Domain.DoesNotExist` if there is no such domain, which
+        is cached too.
+        """
+        fqdn = fqdn.strip().lower()
+        domain = self.cache.get(fqdn)
+        if domain is None:
+            try:
+                domain = self.get(fqdn=fqdn)
+            except self.model.DoesNotExist:
+                domain = _MISSING
+            self.cache.set(fqdn, domain)
+        if domain is _MISSING:
+            raise self.model.DoesNotExist('Domain matching query does not exist.')
+        return domain
+
+    def clear_cache(self):
+        self.cache.clear()
+
+    def shard_for(self, fqdn):
+        """
+        Return the database alias of the shard holding the mail users
+        and aliases of the domain named `fqdn`, or None if VMAIL_SHARDS
+        is not set, or there is no such domain, in which case the
+        database routers decide.  See `vmail.shards`.
+        """
+        if not getattr(settings, 'VMAIL_SHARDS', None):
+            return None
+        try:
+            return self.get_cached(fqdn).shard or None
+        except self.model.DoesNotExist:
+            return None
 
 
 class Domain(models.Model):
@@ -18,10 +73,67 @@ class Domain(models.Model):
                                       " qualified.  Ex: 'example.org'.")
     active = models.BooleanField(default=True)
     created = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+    shard = models.CharField(max_length=64, blank=True, editable=False,
+                             help_text='Shard holding the mail users and aliases,'
+                                       ' if not the default database.')
+
+    objects = DomainManager()
+
+    class Meta:
+        # covers the virtual_mailbox_domains lookup
+        index_together = (('fqdn', 'active'),)
 
     def save(self, *args, **kwargs):
         self.fqdn = self.fqdn.lower()
-        super(Domain, self).save(*args, **kwargs)
+        using = kwargs.get('using') or router.db_for_write(Domain, instance=self)
+        old = None
+        if self.pk is not None:
+            # read from the database written to, not from a replica
+            old = Domain.objects.using(using).filter(pk=self.pk).values_list(
+                'fqdn', 'active')[:1]
+            old = old[0] if old else None
+        changed = old is not None and old != (self.fqdn, self.active)
+        mail_using = (self.shard or using) if changed else using
+        # in one transaction, so a failed save leaves the users and aliases as they were
+        with commit_on_success_unless_managed(using):
+            with commit_on_success_unless_managed(mail_using):
+                # before saving, so post_save receivers see the updated users and aliases
+                if changed:
+                    self._update_mail_fields(old[0] != self.fqdn, mail_using)
+                super(Domain, self).save(*args, **kwargs)
+
+    def _update_mail_fields(self, fqdn_changed, using):
+        """
+        Copy the domain active flag onto the domain's mail users and
+        aliases, and the domain name onto its mail users' addresses.
+        """
+        now = timezone.now()
+        MailUser.objects.using(using).filter(domain=self).update(
+            domain_active=self.active, modified=now)
+        Alias.objects.using(using).filter(domain=self).update(
+            domain_active=self.active, modified=now)
+
+        if fqdn_changed:
+            self.update_emails(using)
+
+    def update_emails(self, using=None):
+        """
+        Set the email address of each of the domain's mail users whose
+        address does not match its username and the domain name, such
+        as after the domain is renamed or mail users are moved into it
+        with a queryset update.  The update is made on the database
+        `using`, by default the one the domain is written to.
+        """
+        connection = connections[using or router.db_for_write(Domain, instance=self)]
+        if connection.vendor == 'mysql':
+            email = "CONCAT(username, '@', %s)"
+        else:
+            email = "username || '@' || %s"
+        cursor = connection.cursor()
+        cursor.execute('UPDATE vmail_mailuser SET email = {0}'
+                       ' WHERE domain_id = %s AND email <> {0}'.format(email),
+                       [self.fqdn, self.pk, self.fqdn])
 
     def __unicode__(self):
         return self.fqdn
@@ -39,71 +151,98 @@ class MailUser(models.Model):
     salt = models.CharField(max_length=SALT_LEN, blank=True,
                             help_text='Random password salt.')
     shadigest = models.CharField(max_length=256, blank=True,
-                                 help_text='Base64 encoding of SHA1 digest:'
-                                           'Base64(sha1(password + salt) + salt).')
+                                 help_text='Password digest, prefixed with its'
+                                           ' scheme: {SCHEME}digest.  Without a'
+                                           ' prefix it is an SSHA digest:'
+                                           ' Base64(sha1(password + salt) + salt).')
     domain = models.ForeignKey(Domain)
     active = models.BooleanField(default=True)
     created = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+    email = models.CharField(max_length=353, unique=True, editable=False,
+                             help_text='Full email address, kept in sync with'
+                                       ' the username and domain.')
+    domain_active = models.BooleanField(default=True, editable=False,
+                                        help_text='Copy of the domain active flag.')
 
     class Meta:
         unique_together = (('username', 'domain'),)
+        # covers the virtual_mailbox_maps, email2email and password_query lookups
+        index_together = (('email', 'active', 'domain_active'),)
 
     def save(self, *args, **kwargs):
         self.username = self.username.lower()
+        self.set_domain_fields(fresh=True)
         super(MailUser, self).save(*args, **kwargs)
 
-    def _get_digest(self, raw_password, salt):
+    def set_domain_fields(self, fresh=False):
         """
-        Returns a base64 encoded SHA1 digest using the provided
-        raw_password and salt.  The digest is encoded using the
-        following format:
-
-        Base64(sha1(raw_password + salt) + salt)
+        Set the email address and domain active flag from the username
+        and domain.  This is done by `save`, but must be called before
+        saving mail users any other way, such as with bulk_create.  If
+        `fresh` is True the domain name and active flag are read from
+        the database the domains are written to, rather than from
+        `domain`, which may be a stale copy, such as from the domain
+        cache.
         """
-        # base64 does not work on unicode, so convert all django unicode strings
-        # into normalized strings firt. Use str, since it will throw an error
-        # if there are non-ascii characters
-        m = hashlib.sha1()
-        m.update(str(raw_password))
-        m.update(str(salt))
-        digest = base64.b64encode(m.digest() + str(self.salt))
-        return digest
+        row = None
+        if fresh and self.domain_id is not None:
+            row = (Domain.objects.using(router.db_for_write(Domain)).filter(pk=self.domain_id)
+                   .values_list('fqdn', 'active')[:1])
+        if row:
+            fqdn, active = row[0]
+        else:
+            fqdn, active = self.domain.fqdn, self.domain.active
+        self.email = '{0}@{1}'.format(self.username, fqdn)
+        self.domain_active = active
 
-    def set_password(self, raw_password):
+    @metrics.instrumented('mailuser.set_password')
+    def set_password(self, raw_password, scheme=None):
         """
-        Sets the mail user password.  The Password is a base64 encoding
-        of the SHA1 digest with the salt appended.  The SHA1 digest is
-        the SHA1 of the raw password with the salt appended.  This is a
-        compatible method of authentication with mail services such as
-        dovecot.
+        Sets the mail user password using the password scheme `scheme`,
+        by default the VMAIL_PASSWORD_SCHEME setting.  The default
+        scheme, SSHA, is a base64 encoding of the SHA1 digest with the
+        salt appended.  The SHA1 digest is the SHA1 of the raw password
+        with the salt appended.  This is a compatible method of
+        authentication with mail services such as dovecot.
 
         Ex: shadigest = Base64(sha1(password + salt) + salt)
+
+        Other schemes are stored prefixed with their name, in the
+        format dovecot expects.  See `vmail.hashers`.
         """
-        # new salt, avoid whitespace
-        chars = string.letters + string.digits + string.punctuation
-        self.salt = ''.join(random.choice(chars) for x in xrange(self.SALT_LEN))
-        self.shadigest = self._get_digest(raw_password, self.salt)
+        self.salt, self.shadigest = hashers.make_password(raw_password, scheme)
 
+    @metrics.instrumented('mailuser.check_password')
     def check_password(self, raw_password):
         """
         Returns True if the given raw string is the correct password
         for the mail user. (This takes care of the password hashing in
-        making the comparison.)
+        making the comparison.)  If the password is correct, but is not
+        stored using the current password scheme and cost, then it is
+        rehashed and saved.
         """
-        digest = self._get_digest(raw_password, self.salt)
-        if self.shadigest == digest:
-            return True
-        else:
-            return False
+        valid, must_update = hashers.check_password(raw_password, self.shadigest)
+        if valid and must_update:
+            self.set_password(raw_password)
+            if self.pk is not None:
+                self.save(update_fields=['salt', 'shadigest', 'modified'])
+        return valid
 
     @classmethod
-    def get_from_email(cls, email):
+    @metrics.instrumented('mailuser.get_from_email')
+    def get_from_email(cls, email, select_related=False):
         """
         Return a valid `MailUser` instance from an email address.  If
         the domain does not exist, `Domain.DoesNotExist` is raised.  If
         the user does not exist, but the domain does exist, then
         `MailUser.DoesNotExist` is raised. If the email is not parseable
         then a `ValidationError` is raised.
+
+        The domain is read from the domain cache, so only the user is
+        queried.  If `select_related` is True, the user and a fresh
+        copy of the domain are instead read together in one query.
+        The user is read from the domain's shard, if it has one.
         """
         email = email.strip().lower()
         validate_email(email)
@@ -111,12 +250,23 @@ class MailUser(models.Model):
         username, fqdn = email.split('@')
         username = username.strip()
 
-        domain = Domain.objects.get(fqdn=fqdn)
-        user = MailUser.objects.get(username=username, domain=domain)
+        if select_related:
+            try:
+                return (MailUser.objects.using(Domain.objects.shard_for(fqdn))
+                        .select_related('domain').get(username=username, domain__fqdn=fqdn))
+            except MailUser.DoesNotExist:
+                # raise Domain.DoesNotExist if it is the domain missing
+                Domain.objects.get_cached(fqdn)
+                raise
+
+        domain = Domain.objects.get_cached(fqdn)
+        user = MailUser.objects.using(domain.shard or None).get(username=username,
+                                                                domain=domain)
+        user.domain = domain
         return user
 
     def __unicode__(self):
-        return '{0}@{1}'.format(self.username, self.domain.fqdn)
+        return self.email or '{0}@{1}'.format(self.username, self.domain.fqdn)
 
 
 class Alias(models.Model):
@@ -145,14 +295,119 @@ class Alias(models.Model):
                                               'non-local. Ex: jeff@example.com.')
     active = models.BooleanField(default=True)
     created = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+    domain_active = models.BooleanField(default=True, editable=False,
+                                        help_text='Copy of the domain active flag.')
 
     class Meta:
         unique_together = (('source', 'destination'),)
+        # covers the virtual_alias_maps lookup
+        index_together = (('source', 'active', 'domain_active', 'destination'),)
 
     def save(self, *args, **kwargs):
         self.source = self.source.lower()
         self.destination = self.destination.lower()
+        self.set_domain_fields()
         super(Alias, self).save(*args, **kwargs)
 
+    def set_domain_fields(self):
+        """
+        Set the domain active flag from the domain.  This is done by
+        `save`, but must be called before saving aliases any other way,
+        such as with bulk_create.
+        """
+        self.domain_active = self.domain.active
+
+    @classmethod
+    def resolve(cls, address):
+        """
+        Return the full expansion of an address through the aliases, as
+        a `vmail.resolver.Expansion` of the final destination addresses,
+        and any alias cycles found.  Catch-all aliases are applied to
+        addresses without an alias or local mailbox.  Expansions are
+        memoized until an Alias, MailUser or Domain is changed.
+        """
+        from .resolver import resolver
+        return resolver.expand(address)
+
     def __unicode__(self):
         return '{0}: {1} > {2}'.format(self.domain.fqdn, self.source, self.destination)
+
+
+class LookupEntry(models.Model):
+    """
+    Represents an active address as Postfix and Dovecot look it up: a
+    mailbox, an alias source, or a catch-all alias of a domain.  An
+    address which is both a mailbox and an alias source is a mailbox
+    with destinations.  Entries are kept up to date from the mail
+    users, aliases and domains by `vmail.lookup`, and are not edited.
+    """
+    MAILBOX = 'mailbox'
+    ALIAS = 'alias'
+    CATCHALL = 'catchall'
+    KIND_CHOICES = ((MAILBOX, 'Mailbox'), (ALIAS, 'Alias'), (CATCHALL, 'Catch-all'))
+
+    address = models.CharField(max_length=353, unique=True,
+                               help_text='Mailbox address, alias source, or'
+                                         ' catch-all alias source.')
+    kind = models.CharField(max_length=8, choices=KIND_CHOICES)
+    destinations = models.TextField(blank=True,
+                                    help_text='Comma separated alias'
+                                              ' destination addresses.')
+    digest = models.CharField(max_length=256, blank=True,
+                              help_text='Password digest of a mailbox.')
+    domain = models.ForeignKey(Domain)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        db_table = 'vmail_lookup'
+
+    def __unicode__(self):
+        return '{0}: {1}'.format(self.kind, self.address)
+
+
+class Change(models.Model):
+    """
+    Represents a domain, mail user or alias being created, updated or
+    deleted, in the change log kept by `vmail.changes`.  The primary key
+    is the change's sequence number, and `data` is the object's fields
+    after the change, or before it for a delete, in JSON.
+    """
+    CREATE = 'C'
+    UPDATE = 'U'
+    DELETE = 'D'
+    # a marker whose object_id is the last sequence number compacted away
+    EXPIRED = 'X'
+    ACTION_CHOICES = ((CREATE, 'Create'), (UPDATE, 'Update'), (DELETE, 'Delete'),
+                      (EXPIRED, 'Expired'))
+
+    model = models.CharField(max_length=8, help_text="'domain', 'mailuser' or 'alias'.")
+    object_id = models.PositiveIntegerField()
+    action = models.CharField(max_length=1, choices=ACTION_CHOICES)
+    data = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        db_table = 'vmail_change'
+        # finds the latest change of each object when compacting
+        index_together = (('model', 'object_id'),)
+
+    def __unicode__(self):
+        return '{0}: {1} {2} {3}'.format(self.pk, self.get_action_display(), self.model,
+                                         self.object_id)
+
+
+def _invalidate_domain_cache(sender, instance, **kwargs):
+    # the domain may have been renamed, so match on the primary key too
+    Domain.objects.cache.delete_matching(
+        lambda fqdn, domain: fqdn == instance.fqdn or getattr(domain, 'pk', None) == instance.pk)
+
+
+post_save.connect(_invalidate_domain_cache, sender=Domain)
+post_delete.connect(_invalidate_domain_cache, sender=Domain)
+
+# keep the lookup entries, change log and shards up to date with the models
+# above, importing by name as any of them may be the module importing this one
+import_module('vmail.lookup')
+import_module('vmail.changes')
+import_module('vmail.shards')
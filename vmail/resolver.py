@@ -0,0 +1,198 @@
+"""
+Recursive alias expansion.
+
+An address is expanded the way Postfix expands virtual aliases with the
+virtual_alias_maps and email2email maps of docs/configuration.rst: an
+alias of the exact address is used first, then a local mailbox of the
+address (which delivers to itself), and then a catch-all alias of the
+address's domain, or a wildcard alias of its nearest parent domain, as
+matched by `vmail.matcher`.  Each destination is expanded again, until only
+addresses without aliases remain.  An address which is a destination of
+itself is kept, and stops the expansion.
+"""
+
+import threading
+from collections import namedtuple
+from itertools import chain
+
+from django.db.models.signals import post_save, post_delete
+
+from .maps import active_aliases, active_mailboxes
+from .matcher import AliasMatcher, candidate_sources
+from .models import Domain, MailUser, Alias
+from .routers import mail_databases
+
+# Postfix's default virtual_alias_recursion_limit
+MAX_DEPTH = 1000
+
+
+class ResolveError(Exception):
+    pass
+
+
+# The result of expanding an address: the set of final destination addresses,
+# a tuple of the alias cycles found, each a tuple of the addresses in the
+# cycle, and the number of alias hops to the furthest destination.
+Expansion = namedtuple('Expansion', 'destinations cycles depth')
+
+
+def _cycle(addresses):
+    """
+    Return a cycle of addresses starting, and ending, at the lowest
+    address, so a cycle found from different addresses compares equal.
+    """
+    i = addresses.index(min(addresses))
+    addresses = addresses[i:] + addresses[:i]
+    return addresses + addresses[:1]
+
+
+class _Frame(object):
+    # an address being expanded: the addresses from the first to it, its
+    # destinations left to expand, and the expansion of those done so far
+    __slots__ = ('address', 'path', 'destinations', 'final', 'cycles', 'depth')
+
+    def __init__(self, address, path, destinations):
+        self.address = address
+        self.path = path
+        self.destinations = iter(destinations)
+        self.final = set()
+        self.cycles = []
+        self.depth = 0
+
+    def add(self, expansion):
+        self.final.update(expansion.destinations)
+        self.cycles.extend(expansion.cycles)
+        self.depth = max(self.depth, expansion.depth)
+
+
+class AliasResolver(object):
+    """
+    Expands addresses through the alias table, memoizing the single
+    hop lookups and the full expansion of every address.  The memoized
+    results are dropped whenever an `Alias`, `MailUser` or `Domain` is
+    saved or deleted in this process.
+
+    By default each address is looked up in the database the first
+    time it is seen, with one query of its candidate alias sources.  If
+    `preload` is True, the alias and mailbox tables are instead read
+    into memory, once, on first use.
+    """
+
+    def __init__(self, preload=False):
+        self.preload = preload
+        self._lock = threading.RLock()
+        self.invalidate()
+        for signal in (post_save, post_delete):
+            for model in (Alias, MailUser, Domain):
+                signal.connect(self._changed, sender=model)
+
+    def invalidate(self):
+        with self._lock:
+            self._hops = {}
+            self._closure = {}
+            self._matcher = None
+            self._mailboxes = None
+
+    def _changed(self, sender, **kwargs):
+        self.invalidate()
+
+    def expand(self, address):
+        """
+        Return the `Expansion` of an address.  Raises `ResolveError` if
+        the expansion is more than `MAX_DEPTH` aliases deep.
+        """
+        with self._lock:
+            if self.preload and self._matcher is None:
+                self._load()
+            return self._expand(address.strip().lower())
+
+    def _expand(self, address):
+        """
+        Expand an address depth first, with a stack of the addresses
+        being expanded rather than recursion, so an expansion up to
+        `MAX_DEPTH` deep does not reach Python's recursion limit.
+        """
+        stack, pending, expansion = [], address, None
+        while True:
+            if pending is not None:
+                path = stack[-1].path if stack else ()
+                expansion = self._closure.get(pending)
+                if expansion is None:
+                    if len(path) >= MAX_DEPTH:
+                        raise ResolveError('Alias expansion of {0} is too deep.'.format(path[0]))
+                    destinations = self._lookup(pending)
+                    if destinations is None:
+                        expansion = Expansion(frozenset([pending]), (), 0)
+                    else:
+                        stack.append(_Frame(pending, path + (pending,), destinations))
+                pending = None
+            if expansion is not None:
+                if not stack:
+                    return expansion
+                stack[-1].add(expansion)
+                expansion = None
+
+            frame = stack[-1]
+            for destination in frame.destinations:
+                if destination == frame.address:
+                    frame.final.add(destination)
+                elif destination in frame.path:
+                    frame.cycles.append(_cycle(frame.path[frame.path.index(destination):]))
+                else:
+                    pending = destination
+                    break
+            else:
+                stack.pop()
+                expansion = Expansion(frozenset(frame.final), tuple(frame.cycles),
+                                      frame.depth + 1)
+                # an expansion which met a cycle depends on the path taken to it
+                if not frame.cycles:
+                    self._closure[frame.address] = expansion
+
+    def _lookup(self, address):
+        """
+        Return the destinations of the single alias hop from an address,
+        or None if the address is final.
+        """
+        try:
+            return self._hops[address]
+        except KeyError:
+            pass
+
+        if self._matcher is not None:
+            match = self._matcher.match(address)
+            is_mailbox = address in self._mailboxes
+        else:
+            sources = candidate_sources(address)
+            # the sources may be owned by domains on any shard
+            match = AliasMatcher(chain.from_iterable(
+                active_aliases(using).filter(source__in=sources)
+                for using in mail_databases())).match(address)
+            using = Domain.objects.shard_for(address.rpartition('@')[2])
+            is_mailbox = (match is not None and match.source != address and
+                          active_mailboxes(using).filter(email=address).exists())
+
+        # the aliases of the address itself come first, and a catch-all or
+        # wildcard is not applied to a mailbox, or to another catch-all
+        if match is not None and (match.source == address or
+                                  not (is_mailbox or address.startswith('@'))):
+            destinations = match.destinations
+        else:
+            destinations = None
+        self._hops[address] = destinations
+        return destinations
+
+    def _load(self):
+        self._matcher = AliasMatcher.load()
+        self._mailboxes = set(chain.from_iterable(active_mailboxes(using).iterator()
+                                                  for using in mail_databases()))
+
+    def sources(self):
+        """Return the sorted alias sources, excluding catch-alls and wildcards."""
+        with self._lock:
+            if self._matcher is None:
+                self._load()
+            return self._matcher.sources()
+
+
+resolver = AliasResolver()
@@ -0,0 +1,181 @@
+"""
+Database routers sending vmail reads to replicas, and the mail users
+and aliases of each domain to its shard.
+
+Add it to the settings, with the aliases of the replica databases: ::
+
+    DATABASE_ROUTERS = ['vmail.routers.ReplicaRouter']
+    VMAIL_DATABASE_REPLICAS = ['replica1', 'replica2']
+
+Reads of the vmail models then go to a random replica, and writes to
+the 'default' database, the primary.  Once a thread writes, it is
+pinned to the primary, so its following reads see its own writes; the
+`StickyPrimaryMiddleware` unpins each request, and keeps a client which
+has just written on the primary for VMAIL_REPLICA_STICKY_SECONDS.
+Provisioning commands are pinned with `pinned` for their whole run.
+
+The `ShardRouter`, listed first, sends the rows of sharded domains to
+their shard; see `vmail.shards`.
+"""
+
+import random
+import threading
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+PRIMARY = DEFAULT_DB_ALIAS
+
+# the cookie of a client which has recently written
+STICKY_COOKIE = 'vmail_primary'
+
+# the models whose rows are kept on the shard of their domain
+SHARDED_MODELS = ('mailuser', 'alias', 'lookupentry')
+
+_state = threading.local()
+
+
+def pin():
+    """Send the current thread's reads to the primary."""
+    _state.pinned = True
+
+
+def unpin():
+    """Send the current thread's reads to the replicas again."""
+    _state.pinned = False
+    _state.wrote = False
+
+
+def is_pinned():
+    return getattr(_state, 'pinned', False)
+
+
+def pinned(func):
+    """Decorate a function, such as a command's `handle`, to pin it to the primary."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        was_pinned = is_pinned()
+        pin()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _state.pinned = was_pinned
+    return wrapper
+
+
+def replicas():
+    return getattr(settings, 'VMAIL_DATABASE_REPLICAS', [])
+
+
+def shards():
+    return getattr(settings, 'VMAIL_SHARDS', [])
+
+
+def mail_databases():
+    """
+    Return the databases to read all of the mail users and aliases
+    from: None, for the rows of unsharded domains, where the routers
+    pick the primary or a replica, and then each shard.
+    """
+    return [None] + list(shards())
+
+
+def _sharded(model):
+    return model._meta.app_label == 'vmail' and model._meta.module_name in SHARDED_MODELS
+
+
+class ReplicaRouter(object):
+    """
+    Routes reads of the vmail models to the VMAIL_DATABASE_REPLICAS
+    databases, unless the thread is pinned, and their writes to the
+    primary, pinning the thread.  Other apps' models are left to the
+    other routers, or the default database.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'vmail':
+            return None
+        aliases = replicas()
+        if not aliases or is_pinned():
+            return PRIMARY
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != 'vmail':
+            return None
+        pin()
+        _state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = set([PRIMARY] + list(replicas()))
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_syncdb(self, db, model):
+        if model._meta.app_label != 'vmail':
+            return None
+        return db == PRIMARY
+
+
+class ShardRouter(object):
+    """
+    Routes the reads and writes of the mail users, aliases and lookup
+    entries of a domain to its shard, where the domain, or one of its
+    rows, is given as the hints' instance, such as when a mail user is
+    saved, or a domain's related objects are read.  Other queries are
+    left to the other routers, so code reading the rows of a domain by
+    other fields must pick its shard with `Domain.objects.shard_for`.
+    """
+
+    def _shard(self, model, **hints):
+        aliases = shards()
+        instance = hints.get('instance')
+        if not aliases or not _sharded(model) or instance is None:
+            return None
+        if instance._meta.app_label == 'vmail' and instance._meta.module_name == 'domain':
+            return instance.shard or None
+        if not _sharded(type(instance)):
+            return None
+        if instance._state.db in aliases:
+            return instance._state.db
+        if instance.domain_id is None:
+            return None
+        return instance.domain.shard or None
+
+    db_for_read = _shard
+    db_for_write = _shard
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # every shard has a copy of the domains
+        if obj1._meta.app_label == 'vmail' and obj2._meta.app_label == 'vmail':
+            return True
+        return None
+
+    def allow_syncdb(self, db, model):
+        if db not in shards():
+            return None
+        return model._meta.app_label == 'vmail'
+
+
+class StickyPrimaryMiddleware(object):
+    """
+    Unpins each request from the primary before it is handled, unless
+    the client wrote in the last VMAIL_REPLICA_STICKY_SECONDS (default
+    5), so that a page read after a form is saved is not stale.  The
+    replicas are expected to catch up within that time.
+    """
+
+    def process_request(self, request):
+        unpin()
+        if request.COOKIES.get(STICKY_COOKIE):
+            pin()
+
+    def process_response(self, request, response):
+        seconds = getattr(settings, 'VMAIL_REPLICA_STICKY_SECONDS', 5)
+        if getattr(_state, 'wrote', False) and seconds:
+            response.set_cookie(STICKY_COOKIE, '1', max_age=seconds, httponly=True)
+        unpin()
+        return response
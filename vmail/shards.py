@@ -0,0 +1,223 @@
+"""
+Sharding of the mail users and aliases across databases by domain.
+
+Add the shard databases to the settings, with the router, ahead of any
+other router: ::
+
+    DATABASE_ROUTERS = ['vmail.routers.ShardRouter', 'vmail.routers.ReplicaRouter']
+    VMAIL_SHARDS = ['shard1', 'shard2']
+
+The domains stay in the 'default' database, and a copy of each domain
+is kept on every shard, for the foreign keys of the mail users and
+aliases.  Each new domain is assigned a shard, by a stable hash of its
+name, and stored in `Domain.shard`; its mail users, aliases, lookup
+entries and their change log are kept on that shard.  Domains created
+before sharding was set up keep theirs in the 'default' database,
+until they are moved with `move_domain`, or the vmail-rebalance
+command.
+"""
+
+import time
+import zlib
+
+from django.conf import settings
+from django.db import connections
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.utils import timezone
+
+from .db import commit_on_success_unless_managed
+from .models import Domain, MailUser, Alias, Change
+from .routers import PRIMARY, shards
+
+# Rows copied per query, below SQLite's limit of query parameters.
+BATCH_SIZE = 500
+
+# the fields identifying a row across databases, where its primary key differs
+KEYS = {MailUser: ('email',), Alias: ('source', 'destination')}
+
+
+def assign(fqdn):
+    """
+    Return the shard for a new domain named `fqdn`, the same in every
+    process, or '' if sharding is not set up.
+    """
+    aliases = shards()
+    if not aliases:
+        return ''
+    return aliases[(zlib.crc32(fqdn.lower().encode('utf-8')) & 0xffffffff) % len(aliases)]
+
+
+def group_addresses(addresses):
+    """
+    Return a dictionary of lists of the addresses, keyed by the shard
+    of each address's domain, or None where the routers decide.
+    """
+    groups = {}
+    for address in set(addresses):
+        using = Domain.objects.shard_for(address.rpartition('@')[2])
+        groups.setdefault(using, []).append(address)
+    return groups
+
+
+def copy_domains(pks):
+    """
+    Copy the domains with the primary keys `pks` from the 'default'
+    database to every shard, such as after a queryset update.  Saving
+    a domain copies it by itself.
+    """
+    aliases = shards()
+    if not aliases:
+        return
+    for domain in Domain.objects.using(PRIMARY).filter(pk__in=list(pks)):
+        for using in aliases:
+            domain.save_base(raw=True, using=using)
+
+
+def move_domain(domain, target, batch_size=BATCH_SIZE, grace=None):
+    """
+    Move the mail users and aliases of `domain` to the database
+    `target`, a shard or 'default', while they are in use:
+
+    1. the rows are copied to `target`, `batch_size` at a time,
+    2. the rows changed or deleted meanwhile are copied again,
+    3. the domain is switched to `target`, and the move waits `grace`
+       seconds, by default VMAIL_DOMAIN_CACHE_TTL, for every process's
+       domain cache to see the switch,
+    4. the rows changed in the old database during the grace period
+       are copied once more, keeping the later of each row's changes,
+       and the rows are deleted from the old database.
+
+    The lookup entries and change logs of both databases are kept up to
+    date.  A failed move can be run again.  Returns the number of mail
+    users and aliases moved.
+    """
+    # imported here, as they import vmail.models, which imports this module
+    from . import changes, lookup
+    source = domain.shard or PRIMARY
+    if target != PRIMARY and target not in shards():
+        raise ValueError("Unknown shard '{0}'.".format(target))
+    if target == source:
+        raise ValueError("Domain '{0}' is already on '{1}'.".format(domain.fqdn, target))
+    if grace is None:
+        grace = getattr(settings, 'VMAIL_DOMAIN_CACHE_TTL', 300)
+    # a shard added since the domain was saved has no copy of it yet
+    copy_domains([domain.pk])
+
+    started = timezone.now()
+    for model in KEYS:
+        _copy(model, domain, source, target, None, None, batch_size)
+    since, started = started, timezone.now()
+    for model in KEYS:
+        _copy(model, domain, source, target, since, None, batch_size)
+    lookup.sync_domain(domain, target)
+
+    cutover = timezone.now()
+    domain.shard = '' if target == PRIMARY else target
+    domain.save()
+    time.sleep(grace)
+
+    count = 0
+    for model in KEYS:
+        _copy(model, domain, source, target, started, cutover, batch_size)
+        count += model.objects.using(target).filter(domain=domain).count()
+    lookup.sync_domain(domain, target)
+
+    with commit_on_success_unless_managed(source):
+        for model in KEYS:
+            changes.record_rows(model, 'domain', [domain.pk], Change.DELETE, using=source)
+            model.objects.using(source).filter(domain=domain)._raw_delete(source)
+        lookup.sync_domain(domain, source)
+    return count
+
+
+def _existing(model, using, keys):
+    """Return the (id, modified) of the rows of `model` on `using`, by key."""
+    fields = KEYS[model]
+    rows = (model.objects.using(using).filter(**{fields[0] + '__in': [key[0] for key in keys]})
+            .values_list('pk', 'modified', *fields))
+    keys = set(keys)
+    return dict((tuple(row[2:]), row[:2]) for row in rows if tuple(row[2:]) in keys)
+
+
+def _copy(model, domain, source, target, since, cutover, batch_size):
+    """
+    Copy the rows of `model` of the domain from `source` to `target`,
+    only those modified since `since`, if given, and delete the rows
+    of `target` which are no longer in `source`, except those created
+    in `target` after `cutover`.  A row already in `target` is only
+    written if it was modified later in `source`.
+    """
+    from . import changes
+    fields = [field for field in model._meta.local_fields if not field.primary_key]
+    rows = model.objects.using(source).filter(domain=domain).order_by('pk')
+    if since is not None:
+        rows = rows.filter(modified__gte=since)
+    cursor = 0
+    while True:
+        batch = list(rows.filter(pk__gt=cursor)[:batch_size])
+        if not batch:
+            break
+        cursor = batch[-1].pk
+        keys = [tuple(getattr(row, name) for name in KEYS[model]) for row in batch]
+        existing = _existing(model, target, keys)
+        new, updated = [], []
+        with commit_on_success_unless_managed(target):
+            for key, row in zip(keys, batch):
+                pk, modified = existing.get(key, (None, None))
+                if pk is None:
+                    row.pk = None
+                    new.append(row)
+                elif row.modified > modified:
+                    model.objects.using(target).filter(pk=pk).update(
+                        **dict((field.name, getattr(row, field.attname)) for field in fields))
+                    updated.append(pk)
+            size = max(connections[target].ops.bulk_batch_size(fields, new), 1)
+            for i in range(0, len(new), size):
+                # inserted raw, as loaddata saves, to keep the created and modified times
+                model._base_manager._insert(new[i:i + size], fields=fields, using=target,
+                                            raw=True)
+            created = [created_pk for created_pk, _ in _existing(model, target, [
+                tuple(getattr(row, name) for name in KEYS[model]) for row in new]).values()]
+            changes.record_rows(model, 'pk', created, Change.CREATE, using=target)
+            changes.record_rows(model, 'pk', updated, using=target)
+
+    keys = set(model.objects.using(source).filter(domain=domain).values_list(*KEYS[model]))
+    stale = model.objects.using(target).filter(domain=domain)
+    if cutover is not None:
+        stale = stale.filter(created__lt=cutover)
+    stale = [row[0] for row in stale.values_list('pk', *KEYS[model]) if row[1:] not in keys]
+    for i in range(0, len(stale), batch_size):
+        # deleted with the signals, which update the lookup entries and change log
+        model.objects.using(target).filter(pk__in=stale[i:i + batch_size]).delete()
+
+
+def _assign_shard(sender, instance, raw=False, **kwargs):
+    # only new domains, as the rows of existing domains stay where they are
+    if not raw and instance.pk is None and not instance.shard:
+        instance.shard = assign(instance.fqdn)
+
+
+def _domain_saved(sender, instance, raw=False, using=None, **kwargs):
+    if raw or using != PRIMARY:
+        return
+    db = instance._state.db
+    for alias in shards():
+        instance.save_base(raw=True, using=alias)
+    instance._state.db = db
+
+
+def _domain_deleted(sender, instance, using=None, **kwargs):
+    # the domain's mail users and aliases on each shard are deleted in batches,
+    # rather than by the cascade of deleting the shard's copy
+    if using != PRIMARY:
+        return
+    from .bulk import delete_rows
+    for alias in shards():
+        for model in (Alias, MailUser):
+            delete_rows(model.objects.using(alias).filter(domain=instance.pk))
+        Domain.objects.using(alias).filter(pk=instance.pk).delete()
+
+
+pre_save.connect(_assign_shard, sender=Domain)
+post_save.connect(_domain_saved, sender=Domain)
+post_delete.connect(_domain_deleted, sender=Domain)
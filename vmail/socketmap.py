@@ -0,0 +1,85 @@
+"""
+Postfix socketmap protocol server answering lookups from a `MapIndex`.
+
+Each request is a netstring holding '<map-name> <key>', and each reply
+is a netstring holding one of 'OK <value>', 'NOTFOUND ', 'TEMP <reason>'
+or 'PERM <reason>'.  A client may send many requests on one connection.
+See http://www.postfix.org/socketmap_table.5.html.
+"""
+
+import SocketServer
+
+MAX_NETSTRING_LEN = 100000
+
+
+class NetstringError(Exception):
+    pass
+
+
+def encode_netstring(data):
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    return '{0}:{1},'.format(len(data), data)
+
+
+def read_netstring(rfile):
+    """
+    Read a single netstring from the file-like `rfile`, and return its
+    data.  Returns None at end of file, and raises `NetstringError` if
+    the netstring is malformed.
+    """
+    length = ''
+    while True:
+        c = rfile.read(1)
+        if not c:
+            if length:
+                raise NetstringError('Unexpected end of netstring.')
+            return None
+        if c == ':':
+            break
+        if not c.isdigit() or len(length) > len(str(MAX_NETSTRING_LEN)):
+            raise NetstringError('Bad netstring length.')
+        length += c
+
+    if not length or int(length) > MAX_NETSTRING_LEN:
+        raise NetstringError('Bad netstring length.')
+
+    data = rfile.read(int(length))
+    if len(data) != int(length) or rfile.read(1) != ',':
+        raise NetstringError('Unterminated netstring.')
+    return data
+
+
+def socketmap_reply(index, request):
+    """Return the socketmap reply for a single request."""
+    name, _, key = request.partition(' ')
+    if not key:
+        return 'PERM Bad request.'
+    try:
+        value = index.lookup(name, key)
+    except KeyError:
+        return 'PERM Unknown map: {0}.'.format(name)
+    except Exception:
+        return 'TEMP Lookup failed.'
+    if value is None:
+        return 'NOTFOUND '
+    return 'OK {0}'.format(value)
+
+
+class SocketmapHandler(SocketServer.StreamRequestHandler):
+    """
+    Request handler answering socketmap requests against the
+    `MapIndex` stored on the server as `server.index`.
+    """
+
+    def handle(self):
+        while True:
+            try:
+                request = read_netstring(self.rfile)
+            except NetstringError:
+                return
+            if request is None:
+                return
+            reply = socketmap_reply(self.server.index, request)
+            self.wfile.write(encode_netstring(reply))
+            self.wfile.flush()
@@ -1,2 +1,15 @@
 from .model_tests import *
 from .command_tests import *
+from .socketmap_tests import *
+from .dovecot_tests import *
+from .hashers_tests import *
+from .lookup_tests import *
+from .admin_tests import *
+from .bulk_tests import *
+from .benchmark_tests import *
+from .metrics_tests import *
+from .routers_tests import *
+from .changes_tests import *
+from .matcher_tests import *
+from .shards_tests import *
+from .doctor_tests import *
@@ -0,0 +1,129 @@
+"""
+Test the scalable administration changelists.
+"""
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from .. import bulk
+from ..admin import EstimatedCountQuerySet, PrimaryKeyOffsetPaginator
+from ..models import Domain, MailUser, Alias
+
+
+class PrimaryKeyOffsetPaginatorTest(TestCase):
+    fixtures = ['vmail_model_testdata.json']
+
+    def test_pages_match_offset_pages(self):
+        for ordering in ('pk', '-pk', 'email'):
+            users = MailUser.objects.order_by(ordering)
+            pages = PrimaryKeyOffsetPaginator(users, 3)
+            self.assertEqual(3, pages.num_pages)
+            for number in pages.page_range:
+                self.assertEqual(list(users[(number - 1) * 3:number * 3]),
+                                 list(pages.page(number).object_list))
+
+
+class EstimatedCountTest(TestCase):
+    fixtures = ['vmail_model_testdata.json']
+
+    def test_exact_count_without_estimate(self):
+        """Test SQLite, which has no table statistics, counts exactly."""
+        users = MailUser.objects.all()._clone(klass=EstimatedCountQuerySet)
+        self.assertIsNone(users.estimate_count())
+        self.assertEqual(8, users.count())
+        self.assertEqual(2, users.filter(username='john').count())
+
+
+class ChangeListTest(TestCase):
+    fixtures = ['vmail_model_testdata.json']
+
+    def changelist(self, model, **params):
+        request = RequestFactory().get('/', params)
+        request.user = User(is_superuser=True, is_staff=True)
+        model_admin = admin.site._registry[model]
+        ChangeList = model_admin.get_changelist(request)
+        return ChangeList(request, model, model_admin.list_display,
+                          model_admin.list_display_links, model_admin.list_filter,
+                          model_admin.date_hierarchy, model_admin.search_fields,
+                          model_admin.list_select_related, model_admin.list_per_page,
+                          model_admin.list_max_show_all, model_admin.list_editable,
+                          model_admin)
+
+    def test_prefix_search(self):
+        changelist = self.changelist(MailUser, q='John')
+        self.assertEqual(['john.smith@example.com', 'john@example.com', 'john@example.org'],
+                         sorted(user.email for user in changelist.result_list))
+        self.assertEqual(['email'], changelist.search_fields)
+
+        changelist = self.changelist(Alias, q='@example')
+        self.assertEqual(['@example.com'],
+                         [alias.source for alias in changelist.result_list])
+
+    def test_search_is_prefix_only(self):
+        changelist = self.changelist(MailUser, q='example.org')
+        self.assertEqual(0, changelist.result_count)
+
+
+class ActionTest(TestCase):
+    fixtures = ['vmail_model_testdata.json']
+    urls = 'vmail.tests.admin_urls'
+
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.org', 'password')
+        self.client.login(username='admin', password='password')
+
+    def test_move_to_domain(self):
+        url = '/admin/vmail/mailuser/'
+        self.assertContains(self.client.get(url), '(move to domain)')
+        self.client.post(url, {'action': 'move_to_domain', 'domain': 2,
+                               '_selected_action': [5, 1]})
+        self.assertEqual('charles@example.com', MailUser.objects.get(pk=5).email)
+        self.assertEqual('john@example.org', MailUser.objects.get(pk=1).email)
+
+    def test_deactivate_domains(self):
+        self.client.post('/admin/vmail/domain/', {'action': 'deactivate_domains',
+                                                  '_selected_action': [1]})
+        self.assertFalse(MailUser.objects.get(pk=1).domain_active)
+
+    def test_delete_domains(self):
+        """Test deleting domains goes through bulk.delete_domain, after confirming."""
+        url = '/admin/vmail/domain/'
+        data = {'action': 'delete_selected', '_selected_action': [1]}
+        response = self.client.post(url, data)
+        self.assertContains(response, 'example.org (')
+        self.assertTrue(Domain.objects.filter(pk=1).exists())
+
+        deleted = []
+        delete_domain = bulk.delete_domain
+        bulk.delete_domain = lambda domain: deleted.append(domain.fqdn) or delete_domain(domain)
+        try:
+            data['post'] = 'yes'
+            self.client.post(url, data)
+        finally:
+            bulk.delete_domain = delete_domain
+        self.assertEqual(['example.org'], deleted)
+        self.assertFalse(Domain.objects.filter(pk=1).exists())
+        self.assertFalse(MailUser.objects.filter(domain=1).exists())
+        self.assertTrue(Domain.objects.filter(pk=2).exists())
+
+
+class ShardedAdminTest(TestCase):
+
+    @override_settings(VMAIL_SHARDS=['shard1'])
+    def test_unavailable_with_shards(self):
+        request = RequestFactory().get('/')
+        request.user = User(is_superuser=True, is_staff=True)
+        for model in (MailUser, Alias):
+            model_admin = admin.site._registry[model]
+            self.assertFalse(model_admin.has_add_permission(request))
+            self.assertFalse(model_admin.has_change_permission(request))
+            self.assertFalse(model_admin.has_delete_permission(request))
+        self.assertTrue(admin.site._registry[Domain].has_change_permission(request))
+
+    def test_available_without_shards(self):
+        request = RequestFactory().get('/')
+        request.user = User(is_superuser=True, is_staff=True)
+        self.assertTrue(admin.site._registry[MailUser].has_change_permission(request))
@@ -0,0 +1,50 @@
+"""
+Test the synthetic dataset generator and benchmark suite.
+"""
+
+from django.test import TestCase
+
+from ..benchmarks import data
+from ..benchmarks import suite as benchmark_suite
+from ..models import Domain, MailUser, Alias, LookupEntry
+
+
+class BenchmarkTest(TestCase):
+
+    def test_generate(self):
+        counts = data.generate(domains=3, users=4, aliases=2, fanout=2, catchalls=1)
+        self.assertEqual({'domains': 3, 'mailboxes': 12, 'aliases': 6, 'catchalls': 3},
+                         counts)
+        self.assertEqual(3, Domain.objects.filter(fqdn__startswith='bench').count())
+        self.assertEqual(12, MailUser.objects.filter(domain_active=True).count())
+        self.assertEqual(3, Alias.objects.filter(source__startswith='@').count())
+        user = MailUser.objects.get(email='user3@' + data.domain_name(2))
+        self.assertTrue(user.check_password(data.PASSWORD))
+        self.assertTrue(LookupEntry.objects.filter(address=user.email).exists())
+
+    def test_generate_is_repeatable(self):
+        data.generate(domains=2, users=3, aliases=3, seed=7)
+        first = sorted(Alias.objects.values_list('source', 'destination'))
+        Domain.objects.all().delete()
+        data.generate(domains=2, users=3, aliases=3, seed=7)
+        self.assertEqual(first, sorted(Alias.objects.values_list('source', 'destination')))
+
+    def test_run(self):
+        data.generate(domains=2, users=5, aliases=2)
+        results = benchmark_suite.run(['query', 'get_from_email'], rounds=4)
+        names = [result['name'] for result in results]
+        self.assertIn('get_from_email', names)
+        self.assertIn('query.virtual_alias_maps', names)
+        self.assertFalse([name for name in names if name.startswith('command')])
+        for result in results:
+            self.assertEqual(4, result['rounds'])
+            self.assertTrue(result['min'] <= result['median'] <= result['max'])
+
+    def test_run_match(self):
+        data.generate(domains=2, users=5, aliases=2, catchalls=1)
+        results = benchmark_suite.run(['match'], rounds=4)
+        self.assertEqual(['match.sql', 'match.memory'], [result['name'] for result in results])
+        self.assertEqual([8, 8], [result['rounds'] for result in results])
+
+    def test_run_empty(self):
+        self.assertEqual([], benchmark_suite.run(['query', 'get_from_email'], rounds=4))
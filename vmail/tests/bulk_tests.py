@@ -0,0 +1,125 @@
+"""
+Test the set-based bulk operations.
+"""
+
+from django.db import connections
+from django.test import TestCase
+from django.utils import timezone
+
+from .. import bulk, lookup
+from ..models import Domain, MailUser, Alias, LookupEntry, Change
+
+
+class BulkPasswordTest(TestCase):
+    fixtures = ['vmail_model_testdata.json']
+
+    def test_set_passwords(self):
+        """Test a batch of passwords is written with a single UPDATE."""
+        emails = sorted(MailUser.objects.values_list('email', flat=True))
+        connection = connections['default']
+        connection.use_debug_cursor = True
+        start = len(connection.queries)
+        try:
+            count, missing = bulk.set_passwords(
+                [(email, 'secret ' + email) for email in emails] +
+                [('nobody@example.org', 'secret')], workers=1)
+        finally:
+            connection.use_debug_cursor = None
+        updates = [query['sql'] for query in connection.queries[start:]
+                   if query['sql'].startswith('UPDATE "vmail_mailuser"')]
+        self.assertEqual(1, len(updates))
+        self.assertEqual((len(emails), ['nobody@example.org']), (count, missing))
+        for user in MailUser.objects.all():
+            self.assertTrue(user.check_password('secret ' + user.email))
+        self.assertEqual(len(emails), Change.objects.filter(model='mailuser').count())
+
+    def test_update_batches(self):
+        """Test more rows than one UPDATE takes parameters for are written in batches."""
+        domain = Domain.objects.get(pk=1)
+        users = [MailUser(username='user{0}'.format(i), domain=domain) for i in range(450)]
+        for user in users:
+            user.set_domain_fields()
+        MailUser.objects.bulk_create(users)
+        pks = list(MailUser.objects.order_by('pk').values_list('pk', flat=True))
+        bulk._update_passwords([(pk, 'salt{0}'.format(pk), 'digest') for pk in pks],
+                               timezone.now())
+        self.assertEqual(['salt{0}'.format(pk) for pk in pks],
+                         list(MailUser.objects.order_by('pk').values_list('salt', flat=True)))
+
+
+class BulkActiveTest(TestCase):
+    fixtures = ['vmail_model_testdata.json']
+
+    def setUp(self):
+        lookup.rebuild()
+
+    def test_set_domains_active(self):
+        domains = Domain.objects.filter(pk=1)
+        self.assertEqual((1, 0, 0), bulk.set_domains_active(domains, False))
+        self.assertFalse(MailUser.objects.filter(domain=1, domain_active=True).exists())
+        self.assertFalse(Alias.objects.filter(domain=1, domain_active=True).exists())
+        self.assertTrue(MailUser.objects.filter(domain=1, active=True).exists())
+        self.assertFalse(LookupEntry.objects.filter(domain=1).exists())
+        self.assertEqual((0, 0, 0), bulk.set_domains_active(domains, False))
+
+        self.assertEqual((1, 0, 0), bulk.set_domains_active(domains, True))
+        self.assertTrue(LookupEntry.objects.filter(address='john@example.org').exists())
+
+    def test_set_domains_active_members(self):
+        self.assertEqual((1, 3, 2), bulk.set_domains_active(Domain.objects.filter(pk=1),
+                                                             False, members=True))
+        self.assertFalse(MailUser.objects.filter(domain=1, active=True).exists())
+
+    def test_set_active(self):
+        users = MailUser.objects.filter(username='john')
+        self.assertEqual(2, bulk.set_active(users, False))
+        self.assertEqual(0, bulk.set_active(users, False))
+        self.assertFalse(LookupEntry.objects.filter(address__startswith='john@').exists())
+        self.assertEqual(2, bulk.set_active(users, True))
+        self.assertEqual(2, LookupEntry.objects.filter(address__startswith='john@').count())
+
+
+class MoveMailboxesTest(TestCase):
+    fixtures = ['vmail_model_testdata.json']
+
+    def setUp(self):
+        lookup.rebuild()
+
+    def test_move(self):
+        domain = Domain.objects.get(pk=2)
+        users = MailUser.objects.filter(domain=1)
+        self.assertEqual((1, ['john@example.org', 'robert@example.org']),
+                         bulk.move_mailboxes(users, domain, batch_size=1))
+        user = MailUser.objects.get(username='charles')
+        self.assertEqual((domain, 'charles@example.com'), (user.domain, user.email))
+        self.assertTrue(LookupEntry.objects.filter(address='charles@example.com').exists())
+        self.assertFalse(LookupEntry.objects.filter(address='charles@example.org').exists())
+        self.assertEqual((0, []), bulk.move_mailboxes(MailUser.objects.filter(pk=2), domain))
+
+
+class DeleteTest(TestCase):
+    fixtures = ['vmail_model_testdata.json']
+
+    def setUp(self):
+        lookup.rebuild()
+
+    def test_delete_rows(self):
+        counts = []
+        self.assertEqual(3, bulk.delete_rows(MailUser.objects.filter(domain=1), batch_size=2,
+                                             progress=counts.append))
+        self.assertEqual([2, 3], counts)
+        self.assertFalse(MailUser.objects.filter(domain=1).exists())
+        self.assertFalse(LookupEntry.objects.filter(address='john@example.org').exists())
+        self.assertEqual(3, Change.objects.filter(model='mailuser', action=Change.DELETE)
+                         .count())
+        self.assertEqual(0, bulk.delete_rows(MailUser.objects.filter(domain=1)))
+
+    def test_delete_domain(self):
+        progress = []
+        domain = Domain.objects.get(pk=2)
+        self.assertEqual((5, 5), bulk.delete_domain(domain, batch_size=3,
+                                                    progress=lambda *args: progress.append(args)))
+        self.assertEqual([(Alias, 3), (Alias, 5), (MailUser, 3), (MailUser, 5)], progress)
+        self.assertFalse(Domain.objects.filter(pk=2).exists())
+        self.assertFalse(LookupEntry.objects.filter(domain=2).exists())
+        self.assertEqual(3, MailUser.objects.count())
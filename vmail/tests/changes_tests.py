@@ -0,0 +1,95 @@
+"""
+Test the change log.
+"""
+
+import json
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from .. import bulk, changes
+from ..models import Domain, MailUser, Alias, Change
+
+
+class ChangeLogTest(TestCase):
+    fixtures = ['vmail_model_testdata.json']
+
+    def actions(self, cursor=0):
+        return [(change.model, change.object_id, change.action)
+                for change in changes.since(cursor)]
+
+    def test_save_and_delete(self):
+        domain = Domain.objects.get(pk=1)
+        user = MailUser.objects.create(username='alice', domain=domain)
+        user.active = False
+        user.save()
+        cursor = changes.latest()
+        pk = user.pk
+        user.delete()
+        self.assertEqual([('mailuser', pk, Change.CREATE),
+                          ('mailuser', pk, Change.UPDATE),
+                          ('mailuser', pk, Change.DELETE)], self.actions())
+        self.assertEqual([('mailuser', pk, Change.DELETE)], self.actions(cursor))
+
+        data = json.loads(Change.objects.get(action=Change.DELETE).data)
+        self.assertEqual('alice@example.org', data['email'])
+        self.assertEqual(domain.pk, data['domain_id'])
+        self.assertFalse(data['active'])
+
+    def test_domain_rename(self):
+        domain = Domain.objects.get(pk=1)
+        domain.fqdn = 'example.net'
+        domain.save()
+        changed = self.actions()
+        self.assertEqual(('domain', 1, Change.UPDATE), changed[0])
+        self.assertEqual(set(MailUser.objects.filter(domain=1).values_list('pk', flat=True)),
+                         set(pk for model, pk, _ in changed if model == 'mailuser'))
+        emails = [json.loads(change.data)['email']
+                  for change in Change.objects.filter(model='mailuser')]
+        self.assertTrue(all(email.endswith('@example.net') for email in emails))
+
+        # saving without a change does not touch the members
+        cursor = changes.latest()
+        domain.save()
+        self.assertEqual([('domain', 1, Change.UPDATE)], self.actions(cursor))
+
+    def test_bulk(self):
+        bulk.set_active(Alias.objects.filter(domain=1), False)
+        pks = set(Alias.objects.filter(domain=1).values_list('pk', flat=True))
+        self.assertEqual(set(('alias', pk, Change.UPDATE) for pk in pks), set(self.actions()))
+
+        cursor = changes.latest()
+        bulk.set_domains_active(Domain.objects.filter(pk=1), False)
+        changed = self.actions(cursor)
+        self.assertIn(('domain', 1, Change.UPDATE), changed)
+        self.assertEqual(MailUser.objects.filter(domain=1).count() + len(pks) + 1,
+                         len(changed))
+
+    def test_since_limit(self):
+        for i in range(5):
+            Domain.objects.create(fqdn='example{0}.net'.format(i))
+        pks = [change.pk for change in changes.since()]
+        self.assertEqual(pks[:2], [change.pk for change in changes.since(limit=2)])
+        self.assertEqual(pks[3:], [change.pk for change in changes.since(pks[2])])
+        self.assertEqual(pks[-1], changes.latest())
+
+    def test_compact(self):
+        domain = Domain.objects.create(fqdn='example.net')
+        user = MailUser.objects.create(username='alice', domain=domain)
+        user.save()
+        gone = MailUser.objects.create(username='bob', domain=domain)
+        MailUser.objects.create(username='dave', domain=domain)
+        gone.delete()
+        deleted = changes.latest()
+        Change.objects.update(created=timezone.now() - timedelta(days=40))
+        recent = MailUser.objects.create(username='carol', domain=domain)
+        recent.save()
+
+        self.assertEqual(3, changes.compact())
+        self.assertEqual(5, Change.objects.exclude(action=Change.EXPIRED).count())
+        self.assertEqual([('mailuser', recent.pk, Change.CREATE),
+                          ('mailuser', recent.pk, Change.UPDATE)], self.actions(deleted))
+        self.assertEqual(deleted, changes.horizon())
+        self.assertRaises(changes.CursorExpired, list, changes.since(0))
+        self.assertEqual(0, changes.compact())
@@ -2,14 +2,22 @@
 Test the virtual mail management commands.
 """
 
+import json
+import os
+import shutil
+import subprocess
 import sys
+import tempfile
 import StringIO
 
+from django.conf import settings
 from django.core.management import call_command
 from django.core.management.base import CommandError
+from django.db import transaction
 from django.test import TestCase
 
-from ..models import MailUser, Domain, Alias
+from ..cdb import cdb_get
+from ..models import MailUser, Domain, Alias, LookupEntry
 
 
 class BaseCommandTestCase(object):
@@ -133,6 +141,34 @@ class TestSetPassword(BaseCommandTestCase, TestCase):
         self._test_change_password(7)
         self._test_change_password(8)
 
+    def _test_from_file(self, workers):
+        fp = tempfile.NamedTemporaryFile()
+        fp.write('john@example.org  new password\n'
+                 '\n'
+                 'JOHN.SMITH@example.com\tpass\n'
+                 'nobody@example.org password\n'
+                 'robert@example.org\n')
+        fp.flush()
+        call_command(self.cmd, from_file=fp.name, workers=workers, batch_size=2)
+        fp.close()
+
+        self.assertTrue(MailUser.objects.get(pk=1).check_password('new password'))
+        self.assertTrue(MailUser.objects.get(pk=7).check_password('pass'))
+        self.assertEqual('', MailUser.objects.get(pk=3).shadigest)
+        self.assertEqual(['Line 5: Missing password.',
+                          'Username does not exist: nobody@example.org'],
+                         sys.stderr.getvalue().splitlines())
+        self.assertIn('Set 2 passwords, 2 errors', sys.stdout.getvalue())
+
+    def test_from_file(self):
+        self._test_from_file(workers=1)
+
+    def test_from_file_process_pool(self):
+        self._test_from_file(workers=2)
+
+    def test_from_file_with_arguments(self):
+        self.assertSystemExit('john@example.org', 'password', from_file='-')
+
 
 class TestAddMBoxPassword(BaseCommandTestCase, TestCase):
 
@@ -221,3 +257,688 @@ class TestAddAlias(BaseCommandTestCase, TestCase):
     def test_aliase_exists(self):
         call_command(self.cmd, str(self.domain), self.source, self.destination)
         self.assertSystemExit(self.cmd, str(self.domain), self.source, self.destination)
+
+
+class TestExportMaps(BaseCommandTestCase, TestCase):
+
+    cmd = 'vmail-export-maps'
+    arglen = 1
+
+    def setUp(self):
+        super(TestExportMaps, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TestExportMaps, self).tearDown()
+
+    def _read(self, name):
+        with open(os.path.join(self.directory, name)) as fp:
+            return fp.read()
+
+    def test_bad_directory(self):
+        self.assertSystemExit(os.path.join(self.directory, 'missing'))
+
+    def test_export_cdb(self):
+        call_command(self.cmd, self.directory)
+        data = self._read('virtual_alias_maps.cdb')
+        self.assertEqual('forward_mailuser_to@external.tld,robert@example.com',
+                         cdb_get(data, 'robert@example.com'))
+        self.assertEqual('john@example.org', cdb_get(data, 'jonny@example.org'))
+        self.assertIsNone(cdb_get(data, 'john@example.org'))
+
+        data = self._read('virtual_mailbox_domains.cdb')
+        self.assertEqual('1', cdb_get(data, 'example.com'))
+
+        data = self._read('email2email.cdb')
+        self.assertEqual('john.smith@example.com', cdb_get(data, 'john.smith@example.com'))
+
+    def test_export_text(self):
+        call_command(self.cmd, self.directory, format='text')
+        lines = self._read('virtual_mailbox_maps').splitlines()
+        self.assertEqual(MailUser.objects.count(), len(lines))
+        self.assertIn('john@example.org 1', lines)
+
+    def test_only_changed_maps_exported(self):
+        call_command(self.cmd, self.directory)
+        sys.stdout.truncate(0)
+        call_command(self.cmd, self.directory)
+        self.assertEqual(4, sys.stdout.getvalue().count('Unchanged'))
+
+        alias = Alias.objects.get(pk=1)
+        alias.active = False
+        alias.save()
+        sys.stdout.truncate(0)
+        call_command(self.cmd, self.directory)
+        self.assertIn('Exported virtual_alias_maps', sys.stdout.getvalue())
+        self.assertEqual(3, sys.stdout.getvalue().count('Unchanged'))
+        self.assertIsNone(cdb_get(self._read('virtual_alias_maps.cdb'), 'bob@example.org'))
+
+        MailUser.objects.get(pk=1).delete()
+        sys.stdout.truncate(0)
+        call_command(self.cmd, self.directory)
+        self.assertIn('Exported virtual_mailbox_maps', sys.stdout.getvalue())
+        self.assertIn('Exported email2email', sys.stdout.getvalue())
+
+
+class TestExportPasswd(BaseCommandTestCase, TestCase):
+
+    cmd = 'vmail-export-passwd'
+    arglen = 1
+
+    def setUp(self):
+        super(TestExportPasswd, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        for user in MailUser.objects.filter(domain__fqdn='example.org'):
+            user.set_password('password')
+            user.save()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TestExportPasswd, self).tearDown()
+
+    def _read(self, name):
+        with open(os.path.join(self.directory, name)) as fp:
+            return fp.read().splitlines()
+
+    def test_bad_options(self):
+        self.assertSystemExit(os.path.join(self.directory, 'missing'))
+        self.assertSystemExit(self.directory, uid='1:2')
+        self.assertSystemExit(self.directory, home='/var/vmail/{user}')
+
+    def test_export(self):
+        call_command(self.cmd, self.directory, uid='5000', gid='5000',
+                     home='/var/vmail/{domain}/{username}')
+        lines = self._read('example.org.passwd')
+        users = MailUser.objects.filter(domain__fqdn='example.org', active=True)
+        self.assertEqual(users.count(), len(lines))
+        user = users.get(username='john')
+        self.assertIn('john@example.org:{0}:5000:5000::/var/vmail/example.org/john::'.format(
+            user.shadigest if user.shadigest.startswith('{') else '{SSHA}' + user.shadigest),
+            lines)
+        # no user of example.com has a password
+        self.assertEqual([], self._read('example.com.passwd'))
+        mode = os.stat(os.path.join(self.directory, 'example.org.passwd')).st_mode
+        self.assertEqual(0o640, mode & 0o777)
+
+    def test_only_changed_domains_exported(self):
+        call_command(self.cmd, self.directory)
+        self.assertIn('Wrote 2 domains, 0 unchanged, 0 removed.', sys.stdout.getvalue())
+        sys.stdout.truncate(0)
+        call_command(self.cmd, self.directory)
+        self.assertIn('Wrote 0 domains, 2 unchanged, 0 removed.', sys.stdout.getvalue())
+
+        user = MailUser.objects.get(username='john', domain__fqdn='example.org')
+        user.active = False
+        user.save()
+        sys.stdout.truncate(0)
+        call_command(self.cmd, self.directory)
+        self.assertIn('Exported example.org:', sys.stdout.getvalue())
+        self.assertIn('Wrote 1 domains, 1 unchanged, 0 removed.', sys.stdout.getvalue())
+        self.assertFalse([line for line in self._read('example.org.passwd')
+                          if line.startswith('john@')])
+
+        domain = Domain.objects.get(fqdn='example.com')
+        domain.active = False
+        domain.save()
+        sys.stdout.truncate(0)
+        call_command(self.cmd, self.directory)
+        self.assertIn('Wrote 0 domains, 1 unchanged, 1 removed.', sys.stdout.getvalue())
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'example.com.passwd')))
+
+
+class TestImport(BaseCommandTestCase, TestCase):
+
+    cmd = 'vmail-import'
+    arglen = 1
+
+    def setUp(self):
+        super(TestImport, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TestImport, self).tearDown()
+
+    def _write(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as fp:
+            fp.write(data)
+        return path
+
+    def test_import_jsonl(self):
+        path = self._write('rows.jsonl', '\n'.join([
+            '{"type": "mailbox", "email": "Alice@example.org", "password": "secret"}',
+            '{"type": "mailbox", "email": "bob@example.org"}',
+            '{"type": "alias", "source": "@example.org", "destination": "alice@example.org"}',
+            '{"type": "alias", "source": "al@example.com", "destination": "alice@example.org",'
+            ' "domain": "example.org"}',
+        ]))
+        call_command(self.cmd, path)
+
+        alice = MailUser.get_from_email('alice@example.org')
+        self.assertTrue(alice.check_password('secret'))
+        self.assertEqual('', MailUser.get_from_email('bob@example.org').shadigest)
+        self.assertTrue(Alias.objects.filter(source='@example.org', domain__fqdn='example.org').exists())
+        self.assertTrue(Alias.objects.filter(source='al@example.com', domain__fqdn='example.org').exists())
+        self.assertIn('Imported 2 mailboxes and 2 aliases, 0 errors', sys.stdout.getvalue())
+
+    def test_import_csv(self):
+        path = self._write('rows.csv', '\n'.join([
+            'type,email,password,source,destination',
+            'mailbox,alice@new.example.net,secret,,',
+            'alias,,,bob@new.example.net,alice@new.example.net',
+        ]))
+        call_command(self.cmd, path)
+        self.assertIn("Line 2: Domain 'new.example.net', does not exist.", sys.stderr.getvalue())
+        self.assertFalse(Domain.objects.filter(fqdn='new.example.net').exists())
+
+        call_command(self.cmd, path, create_domain=True)
+        domain = Domain.objects.get(fqdn='new.example.net')
+        self.assertEqual(1, domain.mailuser_set.count())
+        self.assertEqual(1, domain.alias_set.count())
+
+    def test_row_errors_reported(self):
+        """Test bad rows are reported without stopping the import."""
+        path = self._write('rows.jsonl', '\n'.join([
+            '{"type": "mailbox", "email": "john@example.org"}',
+            'not json',
+            '{"type": "mailbox", "email": "a@b.c"}',
+            '{"type": "user", "email": "alice@example.org"}',
+            '{"type": "alias", "source": "bob@example.org", "destination": "robert@example.org"}',
+            '{"type": "mailbox", "email": "alice@example.org"}',
+            '{"type": "mailbox", "email": "alice@example.org"}',
+        ]))
+        call_command(self.cmd, path, batch_size=3)
+        errors = sys.stderr.getvalue().splitlines()
+        self.assertEqual(['Line 1: Mailbox exists already.',
+                          'Line 2: Malformed row.',
+                          'Line 3: Improperly formatted email address: a@b.c.',
+                          "Line 4: Unknown row type: 'user'.",
+                          'Line 5: Alias exists already.',
+                          'Line 7: Mailbox exists already.'], errors)
+        self.assertTrue(MailUser.objects.filter(username='alice').exists())
+
+    def test_non_string_fields(self):
+        """Test rows with values which are not strings are reported and skipped."""
+        path = self._write('rows.jsonl', '\n'.join([
+            '{"type": "mailbox", "email": 42}',
+            '{"type": "mailbox", "email": "alice@example.org", "password": ["secret"]}',
+            '{"type": "alias", "source": "info@example.org", "destination": true}',
+            '{"type": {"kind": "mailbox"}, "email": "carol@example.org"}',
+            '{"type": "mailbox", "email": "dave@example.org", "password": "secret"}',
+        ]))
+        call_command(self.cmd, path)
+        errors = sys.stderr.getvalue().splitlines()
+        self.assertEqual(['Line 1: The email must be a string.',
+                          'Line 2: The password must be a string.',
+                          'Line 3: The destination must be a string.',
+                          'Line 4: The type must be a string.'], errors)
+        self.assertIn('Imported 1 mailboxes and 0 aliases, 4 errors', sys.stdout.getvalue())
+        self.assertFalse(MailUser.objects.filter(username='alice').exists())
+        self.assertTrue(MailUser.objects.get(email='dave@example.org').check_password('secret'))
+
+    def test_queries_per_batch(self):
+        """Test the number of queries does not grow with the number of rows."""
+        rows = ['{{"type": "mailbox", "email": "user{0}@example.org"}}'.format(i)
+                for i in range(50)]
+        path = self._write('rows.jsonl', '\n'.join(rows))
+        with self.assertNumQueries(9):
+            call_command(self.cmd, path)
+        self.assertEqual(50, MailUser.objects.filter(username__startswith='user').count())
+        self.assertEqual(50, LookupEntry.objects.filter(address__startswith='user').count())
+
+
+class TestResolve(BaseCommandTestCase, TestCase):
+
+    cmd = 'vmail-resolve'
+
+    def test_bad_arg_len(self):
+        self.assertSystemExit()
+        self.assertSystemExit('bob@example.org', all=True)
+
+    def test_resolve(self):
+        call_command(self.cmd, 'bob@example.com', 'john@example.org')
+        self.assertEqual(['bob@example.com > forward_mailuser_to@external.tld,robert@example.com',
+                          'john@example.org > john@example.org'],
+                         sys.stdout.getvalue().splitlines())
+
+    def test_resolve_all(self):
+        Alias.objects.create(domain_id=1, source='a@example.org', destination='b@example.org')
+        Alias.objects.create(domain_id=1, source='b@example.org', destination='a@example.org')
+        call_command(self.cmd, all=True)
+        lines = sys.stdout.getvalue().splitlines()
+        self.assertIn('jonny@example.com john@example.com', lines)
+        self.assertIn('a@example.org ', lines)
+        self.assertEqual(7, len(lines))
+        errors = sys.stderr.getvalue()
+        self.assertIn('Cycle: a@example.org > b@example.org > a@example.org', errors)
+        self.assertIn('Expanded 7 addresses, 1 cycles, maximum depth 2', errors)
+
+
+class TestMatch(BaseCommandTestCase, TestCase):
+
+    cmd = 'vmail-match'
+
+    def test_bad_arg_len(self):
+        self.assertSystemExit()
+
+    def test_match(self):
+        Alias.objects.create(domain_id=1, source='@.example.org', destination='john@example.org')
+        call_command(self.cmd, 'bob@example.org', 'jane@mail.example.org', 'jane@example.org',
+                     'jane@example.com')
+        self.assertEqual(['bob@example.org > bob@example.org (exact): robert@example.org',
+                          'jane@mail.example.org > @.example.org (wildcard): john@example.org',
+                          'jane@example.org: no match',
+                          'jane@example.com > @example.com (catch-all):'
+                          ' catch_all_email@example.com'],
+                         sys.stdout.getvalue().splitlines())
+
+
+class TestExplain(BaseCommandTestCase, TestCase):
+
+    cmd = 'vmail-explain'
+
+    def test_bad_arg_len(self):
+        self.assertSystemExit('john@example.org')
+
+    def test_explain(self):
+        """Test every lookup query is explained, and no table is scanned."""
+        call_command(self.cmd, email='john@example.org', source='bob@example.org')
+        lines = sys.stdout.getvalue().splitlines()
+        self.assertEqual(6, len(lines))
+        self.assertNotIn('sequential scan', sys.stdout.getvalue())
+
+
+class TestSyncLookup(BaseCommandTestCase, TestCase):
+
+    cmd = 'vmail-sync-lookup'
+
+    def test_bad_arg_len(self):
+        self.assertSystemExit('extra')
+
+    def test_sync(self):
+        """Test the fixture, loaded without signals, is synced once."""
+        call_command(self.cmd)
+        self.assertEqual('Synced 13 lookup entries, 13 changed.', sys.stdout.getvalue().strip())
+        call_command(self.cmd)
+        self.assertIn('Synced 13 lookup entries, 0 changed.', sys.stdout.getvalue())
+
+    def test_unknown_database(self):
+        self.assertSystemExit(database='missing')
+
+
+class TestDisable(BaseCommandTestCase, TestCase):
+
+    cmd = 'vmail-disable'
+
+    def test_bad_arg_len(self):
+        self.assertSystemExit()
+
+    def test_missing(self):
+        self.assertSystemExit('example.org', 'bad.org', 'nobody@example.org')
+        self.assertTrue(Domain.objects.get(pk=1).active)
+
+    def test_disable(self):
+        call_command(self.cmd, 'example.org', 'Robert@example.com')
+        self.assertEqual('Disabled 1 domains, 1 mailboxes and 2 aliases.',
+                         sys.stdout.getvalue().strip())
+        self.assertFalse(Domain.objects.get(pk=1).active)
+        self.assertFalse(MailUser.objects.get(pk=1).domain_active)
+        self.assertFalse(MailUser.objects.get(pk=4).active)
+
+    def test_enable_members(self):
+        call_command(self.cmd, 'example.org', members=True)
+        call_command(self.cmd, 'example.org', members=True, enable=True)
+        self.assertIn('Enabled 1 domains, 3 mailboxes and 2 aliases.', sys.stdout.getvalue())
+        self.assertTrue(MailUser.objects.get(pk=1).active)
+
+
+class TestRemoveDomain(BaseCommandTestCase, TestCase):
+
+    cmd = 'vmail-rmdomain'
+
+    def test_bad_arg_len(self):
+        self.assertSystemExit()
+
+    def test_missing(self):
+        self.assertSystemExit('example.org', 'bad.org')
+        self.assertTrue(Domain.objects.filter(pk=1).exists())
+
+    def test_dry_run(self):
+        call_command(self.cmd, 'example.com', dry_run=True)
+        self.assertEqual('Would remove example.com: 5 mailboxes and 5 aliases.',
+                         sys.stdout.getvalue().strip())
+        self.assertEqual(5, MailUser.objects.filter(domain=2).count())
+
+    def test_remove(self):
+        call_command(self.cmd, 'example.com', batch_size=3)
+        self.assertEqual(['Deleted 3 aliases.', 'Deleted 5 aliases.', 'Deleted 3 mailboxes.',
+                          'Deleted 5 mailboxes.',
+                          'Removed example.com: 5 mailboxes and 5 aliases.'],
+                         sys.stdout.getvalue().splitlines())
+        self.assertFalse(Domain.objects.filter(pk=2).exists())
+        self.assertFalse(Alias.objects.filter(domain=2).exists())
+        self.assertTrue(MailUser.objects.filter(domain=1).exists())
+
+    def test_bad_batch_size(self):
+        self.assertSystemExit('example.com', batch_size=0)
+
+
+class TestRemoveMailbox(BaseCommandTestCase, TestCase):
+
+    cmd = 'vmail-rmmbox'
+
+    def test_bad_arg_len(self):
+        self.assertSystemExit()
+
+    def test_missing(self):
+        self.assertSystemExit('john@example.org', 'nobody@example.org')
+        self.assertTrue(MailUser.objects.filter(pk=1).exists())
+
+    def test_dry_run(self):
+        call_command(self.cmd, 'john@example.org', 'John@example.com', dry_run=True)
+        self.assertEqual('Would remove 2 mailboxes.', sys.stdout.getvalue().strip())
+        self.assertEqual(8, MailUser.objects.count())
+
+    def test_remove(self):
+        call_command(self.cmd, 'john@example.org', 'John@example.com')
+        self.assertIn('Removed 2 mailboxes.', sys.stdout.getvalue())
+        self.assertFalse(MailUser.objects.filter(username='john').exists())
+        self.assertFalse(LookupEntry.objects.filter(address='john@example.org').exists())
+        self.assertTrue(Alias.objects.filter(destination='john@example.org').exists())
+
+
+class TestRemoveAlias(BaseCommandTestCase, TestCase):
+
+    cmd = 'vmail-rmalias'
+
+    def test_bad_arg_len(self):
+        self.assertSystemExit()
+        self.assertSystemExit('a@example.org', 'b@example.org', 'extra')
+
+    def test_missing(self):
+        self.assertSystemExit('nobody@example.org')
+        self.assertSystemExit('robert@example.com', 'nobody@example.org')
+
+    def test_dry_run(self):
+        call_command(self.cmd, 'robert@example.com', dry_run=True)
+        self.assertEqual('Would remove 2 aliases.', sys.stdout.getvalue().strip())
+        self.assertEqual(7, Alias.objects.count())
+
+    def test_remove(self):
+        call_command(self.cmd, 'robert@example.com', 'robert@example.com')
+        self.assertEqual(['Deleted 1 aliases.', 'Removed 1 aliases.'],
+                         sys.stdout.getvalue().splitlines())
+        self.assertEqual(['forward_mailuser_to@external.tld'], list(
+            Alias.objects.filter(source='robert@example.com')
+            .values_list('destination', flat=True)))
+
+    def test_remove_catchall(self):
+        call_command(self.cmd, '@example.com')
+        self.assertFalse(Alias.objects.filter(source='@example.com').exists())
+
+
+class TestList(BaseCommandTestCase, TestCase):
+
+    cmd = 'vmail-list'
+
+    def test_bad_arg_len(self):
+        self.assertSystemExit()
+        self.assertSystemExit('users')
+        self.assertSystemExit('domains', 'extra')
+        self.assertSystemExit('domains', format='xml')
+        self.assertSystemExit('domains', batch_size=0)
+        self.assertSystemExit('mailboxes', domain='bad.org')
+        self.assertSystemExit('mailboxes', created_after='May 2012')
+
+    def test_jsonl(self):
+        call_command(self.cmd, 'domains')
+        self.assertEqual([{'fqdn': 'example.org', 'active': True,
+                           'created': '2012-05-14T20:48:39.384000+00:00'},
+                          {'fqdn': 'example.com', 'active': True,
+                           'created': '2012-05-14T20:49:17.892000+00:00'}],
+                         [json.loads(line) for line in sys.stdout.getvalue().splitlines()])
+        self.assertEqual('Listed 2 domains.', sys.stderr.getvalue().strip())
+
+    def test_csv(self):
+        call_command(self.cmd, 'mailboxes', domain='Example.org', format='csv')
+        self.assertEqual(['email,active,domain_active,created',
+                          'john@example.org,True,True,2012-06-10T01:52:10.213000+00:00',
+                          'robert@example.org,True,True,2012-09-04T17:04:20.889000+00:00',
+                          'charles@example.org,True,True,2012-09-04T17:05:10.049000+00:00'],
+                         sys.stdout.getvalue().splitlines())
+
+    def test_yaml(self):
+        call_command(self.cmd, 'aliases', domain='example.org', format='yaml')
+        self.assertEqual([
+            '- source: "bob@example.org"',
+            '  destination: "robert@example.org"',
+            '  domain: "example.org"',
+            '  active: true',
+            '  domain_active: true',
+            '  created: "2012-09-04T17:08:30.933000+00:00"',
+        ], sys.stdout.getvalue().splitlines()[:6])
+        self.assertEqual(2, sys.stdout.getvalue().count('- source:'))
+
+        call_command(self.cmd, 'aliases', created_after='2030-01-01', format='yaml')
+        self.assertTrue(sys.stdout.getvalue().endswith('[]\n'))
+
+    def test_filters(self):
+        MailUser.objects.filter(pk=2).update(active=False)
+        call_command(self.cmd, 'mailboxes', active=False)
+        self.assertEqual(['john@example.com'], [json.loads(line)['email'] for line in
+                                                sys.stdout.getvalue().splitlines()])
+
+        call_command(self.cmd, 'mailboxes', active=True, created_after='2012-09-04T17:05+00:00',
+                     created_before='2012-09-05')
+        self.assertIn('Listed 4 mailboxes.', sys.stderr.getvalue())
+
+    def test_batches(self):
+        """Test the rows are read a batch at a time, from the last key read."""
+        with self.assertNumQueries(3):
+            call_command(self.cmd, 'mailboxes', batch_size=3)
+        self.assertEqual(range(1, 9), [
+            MailUser.objects.get(email=json.loads(line)['email']).pk
+            for line in sys.stdout.getvalue().splitlines()])
+
+
+class TestDoctor(BaseCommandTestCase, TestCase):
+
+    cmd = 'vmail-doctor'
+
+    def test_bad_arg_len(self):
+        self.assertSystemExit('bad-check')
+        self.assertSystemExit(workers=0)
+        self.assertSystemExit(batch_size=0)
+        self.assertSystemExit(limit=-1)
+
+    def test_report(self):
+        call_command(self.cmd, 'empty-password', 'alias-loop', workers=1, limit=2)
+        self.assertEqual(['empty-password: 8 active mailboxes without a password.',
+                          '  1: john@example.org',
+                          '  2: john@example.com',
+                          '  ... and 6 more.',
+                          'alias-loop: 0 alias loops.',
+                          'Found 8 problems.'],
+                         sys.stdout.getvalue().splitlines())
+
+    def test_fix(self):
+        MailUser.objects.update(shadigest='digest')
+        MailUser.objects.filter(pk=3).update(active=False)
+        Alias.objects.create(domain=Domain.objects.get(pk=2), source='info@example.org',
+                             destination='john@example.org')
+        call_command(self.cmd, workers=1, fix=True)
+        self.assertIn('Found 2 problems, fixed 2.', sys.stdout.getvalue())
+        self.assertFalse(Alias.objects.get(pk=1).active)
+        self.assertEqual(1, Alias.objects.get(source='info@example.org').domain_id)
+
+
+class TestBatch(BaseCommandTestCase, TestCase):
+
+    cmd = 'vmail-batch'
+    arglen = 1
+
+    def _batch(self, lines, **options):
+        stdin, sys.stdin = sys.stdin, StringIO.StringIO('\n'.join(lines))
+        try:
+            call_command(self.cmd, '-', **options)
+        finally:
+            sys.stdin = stdin
+        return [json.loads(line) for line in sys.stdout.getvalue().splitlines()]
+
+    def test_batch(self):
+        results = self._batch([
+            '# provisioning',
+            "addmbox alice@example.org --password 'two words'",
+            'addalias example.org al@example.org alice@example.org',
+            '',
+            "chpasswd alice@example.org 'two words' new",
+            'setpasswd john@example.org secret',
+            'disable example.com',
+        ])
+        self.assertEqual([2, 3, 5, 6, 7], [result['line'] for result in results])
+        self.assertTrue(all(result['ok'] for result in results))
+        self.assertEqual({'line': 2, 'operation': 'addmbox', 'ok': True, 'error': None,
+                          'output': ['Set the password.', 'Success.']}, results[0])
+        self.assertTrue(MailUser.get_from_email('alice@example.org').check_password('new'))
+        self.assertFalse(Domain.objects.get(fqdn='example.com').active)
+        self.assertIn('Ran 5 operations, 0 errors', sys.stderr.getvalue())
+
+    def test_errors(self):
+        self.assertRaises(CommandError, self._batch, [
+            'addmbox john@example.org',
+            'rmdomain example.org',
+            'addmbox bob@example.org --bad-option',
+            "addmbox 'unterminated",
+            'addmbox bob@example.org',
+        ], chunk_size=2)
+        results = [json.loads(line) for line in sys.stdout.getvalue().splitlines()]
+        self.assertEqual(['Username exist already.',
+                          "Unknown operation: 'rmdomain'.",
+                          'no such option: --bad-option',
+                          'Malformed line: No closing quotation.',
+                          None], [result['error'] for result in results])
+        self.assertTrue(MailUser.objects.filter(email='bob@example.org').exists())
+
+    def test_chunk_from_file(self):
+        """Test setpasswd --from-file joins the chunk's transaction, not commits it."""
+        commits = []
+        commit = transaction.commit
+        transaction.commit = lambda using=None: commits.append(using)
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                fp.write('john@example.org secret\n')
+            self.assertRaises(CommandError, self._batch, [
+                'setpasswd --from-file {0} --workers 1'.format(path),
+                'addmbox john@example.org',
+                'addmbox alice@example.org',
+            ], chunk_size=10)
+        finally:
+            transaction.commit = commit
+            os.unlink(path)
+        results = [json.loads(line) for line in sys.stdout.getvalue().splitlines()]
+        self.assertEqual([True, False, True], [result['ok'] for result in results])
+        self.assertEqual(['default'], commits)
+        self.assertTrue(MailUser.objects.get(pk=1).check_password('secret'))
+
+    def test_unexpected_errors(self):
+        """Test any error of a line is reported, and rolled back, without stopping the batch."""
+        rollbacks = []
+        rollback_unless_managed = transaction.rollback_unless_managed
+        transaction.rollback_unless_managed = lambda using=None: rollbacks.append(using)
+        set_password = MailUser.set_password
+        MailUser.set_password = lambda self, raw_password: int(raw_password)
+        try:
+            self.assertRaises(CommandError, self._batch, [
+                'setpasswd john@example.org secret',
+                'disable example.com',
+            ])
+        finally:
+            transaction.rollback_unless_managed = rollback_unless_managed
+            MailUser.set_password = set_password
+        results = [json.loads(line) for line in sys.stdout.getvalue().splitlines()]
+        self.assertEqual([False, True], [result['ok'] for result in results])
+        self.assertTrue(results[0]['error'].startswith('ValueError: invalid literal'))
+        self.assertEqual('default', rollbacks[0])
+        self.assertFalse(Domain.objects.get(fqdn='example.com').active)
+
+
+class TestBenchmark(BaseCommandTestCase, TestCase):
+
+    cmd = 'vmail-benchmark'
+
+    def test_bad_arg_len(self):
+        self.assertSystemExit('extra')
+
+    def test_bad_sizes(self):
+        self.assertSystemExit(domains=0)
+        self.assertSystemExit(users=-1)
+
+
+class TestChanges(BaseCommandTestCase, TestCase):
+
+    cmd = 'vmail-changes'
+
+    def test_bad_arg_len(self):
+        self.assertSystemExit('extra')
+
+    def test_bad_options(self):
+        self.assertSystemExit(since=-1)
+        self.assertSystemExit(latest=True, compact=True)
+        self.assertSystemExit(database='missing')
+
+    def test_changes(self):
+        call_command('vmail-addmbox', 'alice@example.org')
+        call_command(self.cmd, latest=True)
+        cursor = int(sys.stdout.getvalue().splitlines()[-1])
+        Alias.objects.filter(source='bob@example.org').delete()
+        sys.stdout.truncate(0)
+
+        call_command(self.cmd, since=cursor)
+        changed = [json.loads(line) for line in sys.stdout.getvalue().splitlines()]
+        self.assertEqual(['delete'], list(set(change['action'] for change in changed)))
+        self.assertEqual('bob@example.org', changed[0]['data']['source'])
+        self.assertIn('cursor {0}.'.format(changed[-1]['seq']), sys.stderr.getvalue())
+
+    def test_compact(self):
+        call_command(self.cmd, compact=True, days=0)
+        self.assertEqual('Dropped 0 changes, 0 kept.', sys.stdout.getvalue().strip())
+
+
+class TestRebalance(BaseCommandTestCase, TestCase):
+
+    cmd = 'vmail-rebalance'
+    arglen = 2
+
+    def test_bad_options(self):
+        self.assertSystemExit('example.org', 'shard1', batch_size=0)
+        self.assertSystemExit('example.org', 'shard1', grace=-1)
+
+    def test_unknown(self):
+        self.assertSystemExit('missing.org', 'default')
+        self.assertSystemExit('example.org', 'shard1')
+        # the domain is not sharded, so already on the default database
+        self.assertSystemExit('example.org', 'default')
+
+
+class TestCommandImports(TestCase):
+
+    def test_fresh_interpreter(self):
+        """Test each command imports on its own, as manage.py imports it."""
+        directory = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                 'management', 'commands')
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path),
+                   DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+        names = [name[:-3] for name in sorted(os.listdir(directory))
+                 if name.startswith('vmail-') and name.endswith('.py')]
+        self.assertIn('vmail-setpasswd', names)
+        for name in names:
+            module = 'vmail.management.commands.' + name
+            process = subprocess.Popen(
+                [sys.executable, '-c', 'from django.utils.importlib import import_module;'
+                                       ' import_module({0!r})'.format(module)],
+                env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            _, errors = process.communicate()
+            self.assertEqual(0, process.returncode, '{0}: {1}'.format(name, errors))
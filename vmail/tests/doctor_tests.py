@@ -0,0 +1,101 @@
+"""
+Test the set-based consistency checks.
+"""
+
+from django.db import connections
+from django.test import TestCase, TransactionTestCase
+
+from .. import doctor, lookup
+from ..models import Domain, MailUser, Alias, LookupEntry
+
+
+class DoctorTest(TestCase):
+    fixtures = ['vmail_model_testdata.json']
+
+    def setUp(self):
+        MailUser.objects.exclude(pk=3).update(shadigest='digest')
+        lookup.rebuild()
+
+    def test_alias_domains(self):
+        example_com = Domain.objects.get(pk=2)
+        alias = Alias.objects.create(domain=example_com, source='info@example.org',
+                                     destination='john@example.org')
+        Alias.objects.create(domain=Domain.objects.get(pk=1), source='@.example.org',
+                             destination='john@example.org')
+        Alias.objects.create(domain=example_com, source='@.example.org',
+                             destination='john@example.com')
+        found = doctor.find_alias_domains('default')
+        self.assertEqual([alias.pk], [pk for pk, _ in found][:1])
+        self.assertEqual('info@example.org is owned by example.com', found[0][1])
+        self.assertEqual(2, len(found))
+
+        self.assertEqual(2, doctor.fix('alias-domain', [pk for pk, _ in found], 'default',
+                                       batch_size=1))
+        self.assertEqual([], doctor.find_alias_domains('default'))
+        self.assertEqual(1, Alias.objects.get(pk=alias.pk).domain_id)
+        self.assertEqual(1, LookupEntry.objects.get(address='info@example.org').domain_id)
+
+    def test_empty_passwords(self):
+        self.assertEqual([(3, 'robert@example.org')], doctor.find_empty_passwords('default'))
+        self.assertEqual(1, doctor.fix('empty-password', [3], 'default'))
+        self.assertFalse(MailUser.objects.get(pk=3).active)
+        self.assertEqual([], doctor.find_empty_passwords('default'))
+
+    def test_inactive_destinations(self):
+        MailUser.objects.filter(pk=3).update(active=False)
+        self.assertEqual([(1, 'bob@example.org > robert@example.org')],
+                         doctor.find_inactive_destinations('default'))
+        self.assertEqual(1, doctor.fix('inactive-destination', [1], 'default'))
+        self.assertFalse(Alias.objects.get(pk=1).active)
+        self.assertFalse(LookupEntry.objects.filter(address='bob@example.org').exists())
+
+    def test_alias_loops(self):
+        domain = Domain.objects.get(pk=1)
+        for source, destination in (('a@example.org', 'b@example.org'),
+                                    ('b@example.org', 'c@example.org'),
+                                    ('c@example.org', 'a@example.org'),
+                                    ('c@example.org', 'd@example.org'),
+                                    ('d@example.org', 'd@example.org')):
+            Alias.objects.create(domain=domain, source=source, destination=destination)
+        loops = doctor.find_alias_loops('default')
+        self.assertEqual(1, len(loops))
+        self.assertEqual('loop through a@example.org, b@example.org, c@example.org',
+                         loops[0][1])
+        self.assertEqual(Alias.objects.get(source='a@example.org').pk, loops[0][0])
+
+    def test_components(self):
+        graph = dict((i, [i + 1]) for i in range(5000))
+        graph[5000] = [0]
+        graph['x'] = ['y']
+        self.assertEqual([5001], [len(c) for c in doctor._components(graph)])
+
+    def test_run(self):
+        results = doctor.run(list(doctor.CHECKS), ['default'], workers=1)
+        self.assertEqual([(name, 'default') for name in doctor.CHECKS],
+                         [job for job, _ in results])
+        self.assertEqual([0, 1, 0, 0], [len(problems) for _, problems in results])
+
+    def test_run_threads(self):
+        doctor.CHECKS['thread'] = doctor.Check('threads', lambda using: [(1, using)], None)
+        try:
+            results = doctor.run(['thread'], ['a', 'b', 'c'], workers=2)
+        finally:
+            del doctor.CHECKS['thread']
+        self.assertEqual([(('thread', using), [(1, using)]) for using in 'abc'], results)
+
+
+class ThreadedDoctorTest(TransactionTestCase):
+    fixtures = ['vmail_model_testdata.json']
+
+    def test_run_threads(self):
+        """Test the checks find the same problems in their threads' own connections."""
+        if connections['default'].settings_dict['NAME'] == ':memory:':
+            self.skipTest("each thread would have its own in-memory test database")
+        MailUser.objects.exclude(pk=3).update(shadigest='digest')
+        lookup.rebuild()
+        domain = Domain.objects.get(pk=1)
+        Alias.objects.create(domain=domain, source='a@example.org', destination='b@example.org')
+        Alias.objects.create(domain=domain, source='b@example.org', destination='a@example.org')
+        results = doctor.run(list(doctor.CHECKS), ['default'])
+        self.assertEqual(doctor.run(list(doctor.CHECKS), ['default'], workers=1), results)
+        self.assertEqual([0, 1, 0, 1], [len(problems) for _, problems in results])
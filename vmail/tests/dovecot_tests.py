@@ -0,0 +1,105 @@
+"""
+Test the credential cache and the Dovecot dict protocol server.
+"""
+
+import json
+import time
+
+from django.test import TestCase
+
+from ..cache import LRUCache
+from ..dovecot import CredentialCache, passdb_reply
+from ..models import MailUser, Domain
+
+
+class LRUCacheTest(TestCase):
+
+    def test_bounded(self):
+        """Test the least recently used entry is evicted."""
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.set('c', 3)
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+
+    def test_ttl(self):
+        cache = LRUCache(ttl=0.01)
+        cache.set('a', 1)
+        self.assertEqual(1, cache.get('a'))
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+
+    def test_delete_matching(self):
+        cache = LRUCache()
+        for key in range(10):
+            cache.set(key, key)
+        cache.delete_matching(lambda key, value: value % 2)
+        self.assertEqual(5, len(cache))
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(2, cache.get(2))
+
+
+class CredentialCacheTest(TestCase):
+    fixtures = ['vmail_model_testdata.json']
+
+    def setUp(self):
+        self.credentials = CredentialCache()
+        self.user = MailUser.objects.get(pk=1)
+        self.user.set_password('password')
+        self.user.save()
+
+    def test_lookup_cached(self):
+        """Test a second lookup does not query the database."""
+        entry = self.credentials.lookup('John@example.org')
+        self.assertEqual(('john@example.org', self.user.shadigest, True),
+                         entry[:3])
+        with self.assertNumQueries(0):
+            self.credentials.lookup('john@example.org')
+
+    def test_unknown_user_cached(self):
+        entry = self.credentials.lookup('nobody@example.org')
+        self.assertIsNone(entry.digest)
+        with self.assertNumQueries(0):
+            self.credentials.lookup('nobody@example.org')
+
+        MailUser.objects.create(username='nobody', domain=self.user.domain)
+        self.assertTrue(self.credentials.lookup('nobody@example.org').active)
+
+    def test_user_save_invalidates(self):
+        self.credentials.lookup('john@example.org')
+        self.user.set_password('new password')
+        self.user.save()
+        entry = self.credentials.lookup('john@example.org')
+        self.assertEqual(self.user.shadigest, entry.digest)
+
+    def test_domain_save_invalidates(self):
+        self.credentials.lookup('john@example.org')
+        domain = Domain.objects.get(pk=1)
+        domain.active = False
+        domain.save()
+        self.assertFalse(self.credentials.lookup('john@example.org').active)
+
+    def test_user_delete_invalidates(self):
+        self.credentials.lookup('john@example.org')
+        self.user.delete()
+        self.assertIsNone(self.credentials.lookup('john@example.org').digest)
+
+    def test_passdb_reply(self):
+        reply = passdb_reply(self.credentials, 'shared/passdb/john@example.org')
+        self.assertEqual('O', reply[0])
+        self.assertEqual({'user': 'john@example.org',
+                          'password': '{SSHA}' + self.user.shadigest},
+                         json.loads(reply[1:]))
+
+        # no password set
+        self.assertEqual('N', passdb_reply(self.credentials, 'shared/passdb/robert@example.org'))
+        self.assertEqual('N', passdb_reply(self.credentials, 'shared/passdb/nobody@example.org'))
+        self.assertEqual('N', passdb_reply(self.credentials, 'shared/userdb/john@example.org'))
+
+        self.user.active = False
+        self.user.save()
+        self.assertEqual('N', passdb_reply(self.credentials, 'shared/passdb/john@example.org'))
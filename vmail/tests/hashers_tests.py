@@ -0,0 +1,124 @@
+"""
+Test the password schemes.
+"""
+
+import multiprocessing
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from .. import hashers
+from ..models import MailUser
+
+
+class HashersTest(TestCase):
+
+    def test_schemes_verify(self):
+        for name in hashers.SCHEMES:
+            salt, digest = hashers.make_password('password', name, cost=10)
+            self.assertEqual(hashers.get_scheme(name), hashers.identify(digest))
+            self.assertEqual((True, name != 'SSHA'),
+                             hashers.check_password('password', digest))
+            self.assertEqual((False, False),
+                             hashers.check_password('password ', digest))
+
+    def test_prefix(self):
+        """Test SSHA is stored without a prefix, and other schemes with one."""
+        self.assertFalse(hashers.make_password('password', 'SSHA')[1].startswith('{'))
+        self.assertTrue(hashers.make_password('password', 'SSHA512')[1].startswith('{SSHA512}'))
+        self.assertEqual('{SSHA}abc', hashers.dovecot_password('abc'))
+        self.assertEqual('{SSHA512}abc', hashers.dovecot_password('{SSHA512}abc'))
+
+    def test_pbkdf2_dovecot_format(self):
+        scheme = hashers.get_scheme('pbkdf2')
+        digest = scheme.encode('password', 'salt', 2)
+        self.assertEqual('{PBKDF2}$1$salt$2$ea6c014dc72d6f8ccd1ed92ace1d41f0d8de8957',
+                         digest)
+        self.assertEqual(2, scheme.cost(digest))
+
+    def test_bad_digests(self):
+        for digest in ('', '{UNKNOWN}abc', '{SSHA512}***', '{PBKDF2}$1$salt', 'abc'):
+            self.assertEqual((False, False), hashers.check_password('password', digest))
+
+
+class MailUserSchemeTest(TestCase):
+    fixtures = ['vmail_model_testdata.json']
+
+    def test_set_password_scheme(self):
+        user = MailUser.objects.get(pk=1)
+        user.set_password('password', scheme='SSHA512')
+        self.assertTrue(user.shadigest.startswith('{SSHA512}'))
+        self.assertTrue(user.check_password('password'))
+
+    @override_settings(VMAIL_PASSWORD_SCHEME='PBKDF2', VMAIL_PASSWORD_COSTS={'PBKDF2': 10})
+    def test_rehash_on_check(self):
+        """Test a correct password is rehashed with the current scheme and cost."""
+        user = MailUser.objects.get(pk=1)
+        user.set_password('password', scheme='SSHA')
+        user.save()
+
+        self.assertFalse(user.check_password('bad password'))
+        self.assertFalse(MailUser.objects.get(pk=1).shadigest.startswith('{'))
+
+        self.assertTrue(user.check_password('password'))
+        user = MailUser.objects.get(pk=1)
+        self.assertTrue(user.shadigest.startswith('{PBKDF2}$1$'))
+        self.assertEqual(10, hashers.get_scheme().cost(user.shadigest))
+
+        with self.settings(VMAIL_PASSWORD_COSTS={'PBKDF2': 20}):
+            self.assertTrue(user.check_password('password'))
+        self.assertEqual(20, hashers.get_scheme().cost(MailUser.objects.get(pk=1).shadigest))
+
+    @override_settings(VMAIL_PASSWORD_SCHEME='SSHA512', VMAIL_PASSWORD_COSTS={'SSHA512': 10})
+    def test_no_rehash_without_cost(self):
+        """Test a cost configured for a scheme without one does not rehash every login."""
+        self.assertIsNone(hashers.get_cost(hashers.get_scheme()))
+        salt, digest = hashers.make_password('password')
+        self.assertEqual((True, False), hashers.check_password('password', digest))
+
+
+class HashPoolTest(TestCase):
+    fixtures = ['vmail_model_testdata.json']
+
+    def tearDown(self):
+        for pool in hashers._pools.values():
+            pool.close()
+        hashers._pools.clear()
+
+    def test_pool(self):
+        pool = hashers.HashPool(2)
+        try:
+            results = [pool.make_password('password {0}'.format(i), 'PBKDF2', cost=10)
+                       for i in range(4)]
+            digests = [result.get()[1] for result in results]
+            self.assertEqual((True, True), pool.check_password('password 3', digests[3]).get())
+            self.assertEqual((False, False), pool.check_password('password 3', digests[2]).get())
+            self.assertEqual((False, False), pool.check_password('password', '').get())
+        finally:
+            pool.close()
+
+    @override_settings(VMAIL_HASH_WORKERS=1)
+    def test_mailuser_uses_pool(self):
+        self.assertIs(hashers.get_pool(), hashers.get_pool())
+        user = MailUser.objects.get(pk=1)
+        user.set_password('password')
+        self.assertTrue(user.check_password('password'))
+        self.assertFalse(user.check_password('bad password'))
+        with self.settings(VMAIL_HASH_WORKERS=0):
+            self.assertIsNone(hashers.get_pool())
+            self.assertTrue(user.check_password('password'))
+
+    @override_settings(VMAIL_HASH_WORKERS=1, VMAIL_HASH_TIMEOUT=0.5)
+    def test_pool_timeout(self):
+        """Test a password the pool never hashes is hashed in the calling thread."""
+        timeouts = []
+
+        class Stuck(object):
+            def get(self, timeout=None):
+                timeouts.append(timeout)
+                raise multiprocessing.TimeoutError
+
+        hashers.get_pool()._apply = lambda func, args: Stuck()
+        salt, digest = hashers.make_password('password', 'PBKDF2', cost=10)
+        self.assertTrue(hashers.check_password('password', digest)[0])
+        self.assertEqual([0.5, 0.5], timeouts)
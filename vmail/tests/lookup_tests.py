@@ -0,0 +1,70 @@
+"""
+Test the incremental maintenance of the lookup entries.
+"""
+
+from django.test import TestCase
+
+from .. import lookup
+from ..models import Domain, MailUser, Alias, LookupEntry
+
+
+class LookupTest(TestCase):
+    fixtures = ['vmail_model_testdata.json']
+
+    def setUp(self):
+        # the fixture is loaded without signals
+        lookup.rebuild()
+
+    def entry(self, address):
+        entries = LookupEntry.objects.filter(address=address)
+        return entries[0] if entries else None
+
+    def test_kinds(self):
+        self.assertEqual(LookupEntry.MAILBOX, self.entry('john@example.org').kind)
+        self.assertEqual(LookupEntry.ALIAS, self.entry('bob@example.org').kind)
+        self.assertEqual(LookupEntry.CATCHALL, self.entry('@example.com').kind)
+        entry = self.entry('robert@example.com')
+        self.assertEqual(LookupEntry.MAILBOX, entry.kind)
+        self.assertEqual('forward_mailuser_to@external.tld,robert@example.com',
+                         entry.destinations)
+
+    def test_mailbox_changes(self):
+        user = MailUser.objects.get(pk=1)
+        user.set_password('password')
+        user.save()
+        self.assertEqual(user.shadigest, self.entry('john@example.org').digest)
+
+        user.username = 'johnny'
+        user.save()
+        self.assertIsNone(self.entry('john@example.org'))
+        self.assertEqual(LookupEntry.MAILBOX, self.entry('johnny@example.org').kind)
+
+        user.active = False
+        user.save()
+        self.assertIsNone(self.entry('johnny@example.org'))
+
+    def test_alias_changes(self):
+        alias = Alias.objects.create(domain_id=1, source='new@example.org',
+                                     destination='john@example.org')
+        self.assertEqual('john@example.org', self.entry('new@example.org').destinations)
+        alias.delete()
+        self.assertIsNone(self.entry('new@example.org'))
+
+    def test_domain_changes(self):
+        domain = Domain.objects.get(pk=1)
+        domain.active = False
+        domain.save()
+        self.assertFalse(LookupEntry.objects.filter(domain=domain).exists())
+
+        domain.active = True
+        domain.fqdn = 'example.net'
+        domain.save()
+        self.assertEqual(LookupEntry.MAILBOX, self.entry('john@example.net').kind)
+        self.assertIsNone(self.entry('john@example.org'))
+
+    def test_unchanged_not_written(self):
+        """Test saving an unchanged mail user does not write its entry."""
+        entry = self.entry('john@example.org')
+        MailUser.objects.get(pk=1).save()
+        self.assertEqual(entry.pk, self.entry('john@example.org').pk)
+        self.assertEqual(0, lookup.rebuild())
@@ -0,0 +1,56 @@
+"""
+Test the in-memory alias matcher.
+"""
+
+from django.test import TestCase
+
+from ..matcher import AliasMatcher, Match, EXACT, CATCHALL, WILDCARD, candidate_sources
+from ..models import Alias
+
+
+class AliasMatcherTest(TestCase):
+    fixtures = ['vmail_model_testdata.json']
+
+    def setUp(self):
+        self.matcher = AliasMatcher([
+            ('john@example.org', 'john@example.com'),
+            ('@example.org', 'postmaster@example.org'),
+            ('@.example.org', 'sub@example.org'),
+            ('@.example.org', 'other@example.org'),
+            ('@.b.example.org', 'b@example.org'),
+        ])
+
+    def test_exact(self):
+        self.assertEqual(Match('john@example.org', EXACT, ('john@example.com',)),
+                         self.matcher.match(' John@Example.org'))
+
+    def test_catchall(self):
+        self.assertEqual(Match('@example.org', CATCHALL, ('postmaster@example.org',)),
+                         self.matcher.match('jane@example.org'))
+        self.assertEqual(CATCHALL, self.matcher.match('@example.org').kind)
+
+    def test_wildcard(self):
+        self.assertEqual(Match('@.example.org', WILDCARD,
+                               ('sub@example.org', 'other@example.org')),
+                         self.matcher.match('jane@a.example.org'))
+        self.assertEqual('@.b.example.org', self.matcher.match('jane@c.b.example.org').source)
+        self.assertEqual('@.example.org', self.matcher.match('jane@b.example.org').source)
+        self.assertEqual('@.example.org', self.matcher.match('@x.y.example.org').source)
+
+    def test_no_match(self):
+        self.assertIsNone(self.matcher.match('jane@example.com'))
+        self.assertIsNone(self.matcher.match('jane@org'))
+        self.assertIsNone(self.matcher.match('jane@notexample.org'))
+        self.assertIsNone(AliasMatcher().match('jane@example.org'))
+
+    def test_candidate_sources(self):
+        self.assertEqual(['john@a.example.org', '@a.example.org', '@.example.org', '@.org'],
+                         candidate_sources('John@a.example.org'))
+
+    def test_load(self):
+        Alias.objects.filter(source='jonny@example.org').update(active=False)
+        matcher = AliasMatcher.load()
+        self.assertEqual(('catch_all_email@example.com',),
+                         matcher.match('unknown@example.com').destinations)
+        self.assertIsNone(matcher.match('jonny@example.org'))
+        self.assertNotIn('@example.com', matcher.sources())
@@ -0,0 +1,122 @@
+"""
+Test the opt-in instrumentation and its exporters.
+"""
+
+import os
+import shutil
+import socket
+import tempfile
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.db import connections
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from .. import metrics
+from ..models import MailUser
+
+
+class MetricsTest(TestCase):
+    fixtures = ['vmail_model_testdata.json']
+
+    def setUp(self):
+        metrics.registry.clear()
+        self.measured = []
+        metrics.call_measured.connect(self.receive)
+
+    def tearDown(self):
+        metrics.call_measured.disconnect(self.receive)
+        metrics.registry.clear()
+
+    def receive(self, sender, **kwargs):
+        self.measured.append(kwargs)
+
+    def test_disabled(self):
+        MailUser.get_from_email('john@example.org')
+        self.assertEqual([], metrics.registry.items())
+        self.assertEqual([], self.measured)
+
+    @override_settings(VMAIL_METRICS=True)
+    def test_models(self):
+        user = MailUser.get_from_email('john@example.org')
+        user.set_password('password')
+        self.assertTrue(user.check_password('password'))
+
+        metric = metrics.registry.get('mailuser.get_from_email')
+        self.assertEqual(1, metric.calls)
+        self.assertTrue(metric.queries >= 1)
+        self.assertEqual(0, metrics.registry.get('mailuser.set_password').queries)
+        self.assertEqual(1, metrics.registry.get('mailuser.check_password').calls)
+        self.assertEqual(['mailuser.get_from_email', 'mailuser.set_password',
+                          'mailuser.check_password'],
+                         [kwargs['name'] for kwargs in self.measured])
+
+    @override_settings(VMAIL_METRICS=True)
+    def test_errors(self):
+        self.assertRaises(MailUser.DoesNotExist, MailUser.get_from_email,
+                          'nobody@example.org')
+        self.assertEqual(1, metrics.registry.get('mailuser.get_from_email').errors)
+        self.assertTrue(self.measured[0]['error'])
+
+    @override_settings(VMAIL_METRICS=True)
+    def test_command_textfile(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'vmail.command.vmail-sync-lookup.prom')
+        try:
+            with self.settings(VMAIL_METRICS_TEXTFILE=os.path.join(directory, 'vmail.prom')):
+                call_command('vmail-sync-lookup', stdout=StringIO())
+            with open(path) as fp:
+                text = fp.read()
+            self.assertEqual([path], [os.path.join(directory, name)
+                                      for name in os.listdir(directory)])
+            self.assertEqual(0o644, os.stat(path).st_mode & 0o777)
+        finally:
+            shutil.rmtree(directory)
+        self.assertIn('# TYPE vmail_calls gauge\n', text)
+        self.assertIn('vmail_calls{name="command.vmail-sync-lookup"} 1\n', text)
+        self.assertTrue(metrics.registry.get('command.vmail-sync-lookup').queries > 0)
+
+    @override_settings(VMAIL_METRICS=True, DEBUG=False)
+    def test_queries_not_kept(self):
+        connection = connections['default']
+        start = len(connection.queries)
+
+        @metrics.instrumented('lookups')
+        def lookups():
+            for i in range(3):
+                MailUser.objects.get(email='john@example.org')
+            return len(connection.queries)
+
+        self.assertEqual(start, lookups())
+        self.assertEqual(start, len(connection.queries))
+        self.assertEqual(None, connection.use_debug_cursor)
+        self.assertEqual(3, metrics.registry.get('lookups').queries)
+
+    def test_format_textfile(self):
+        registry = metrics.Registry()
+        registry.record('a"b', 0.5, 2, 0.25)
+        registry.record('a"b', 1.5, 0, 0.0, error=True)
+        text = metrics.format_textfile(registry)
+        self.assertIn('vmail_calls{name="a\\"b"} 2\n', text)
+        self.assertIn('vmail_call_errors{name="a\\"b"} 1\n', text)
+        self.assertIn('vmail_call_seconds{name="a\\"b"} 2.0\n', text)
+        self.assertIn('vmail_call_seconds_max{name="a\\"b"} 1.5\n', text)
+        self.assertIn('vmail_call_queries{name="a\\"b"} 2\n', text)
+
+    def test_statsd(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.settimeout(5)
+        try:
+            with self.settings(VMAIL_METRICS=True,
+                               VMAIL_METRICS_STATSD=listener.getsockname()):
+                MailUser.get_from_email('john@example.org')
+            packet = listener.recv(4096)
+        finally:
+            listener.close()
+        lines = packet.split('\n')
+        self.assertEqual('vmail.mailuser.get_from_email.calls:1|c', lines[0])
+        self.assertTrue(lines[1].startswith('vmail.mailuser.get_from_email.time:'))
+        self.assertTrue(lines[1].endswith('|ms'))
+        self.assertEqual(4, len(lines))
@@ -12,6 +12,7 @@ from django.db import IntegrityError, transaction
 from django.test import TestCase, TransactionTestCase
 
 from ..models import MailUser, Domain, Alias
+from ..resolver import AliasResolver, ResolveError, MAX_DEPTH
 
 
 class DomainTest(TestCase):
@@ -44,6 +45,70 @@ class DomainTest(TestCase):
         self.assertTrue(domain.active)
 
 
+class DomainCacheTest(TestCase):
+    fixtures = ['vmail_model_testdata.json']
+
+    def setUp(self):
+        Domain.objects.clear_cache()
+
+    def test_get_cached(self):
+        cache = Domain.objects.cache
+        hits, misses = cache.hits, cache.misses
+        with self.assertNumQueries(1):
+            self.assertEqual(1, Domain.objects.get_cached('Example.org').pk)
+            self.assertEqual(1, Domain.objects.get_cached('example.org').pk)
+        self.assertEqual((hits + 1, misses + 1), (cache.hits, cache.misses))
+
+    def test_missing_cached(self):
+        with self.assertNumQueries(1):
+            for _ in range(2):
+                self.assertRaises(Domain.DoesNotExist, Domain.objects.get_cached, 'bad.org')
+        Domain.objects.create(fqdn='bad.org')
+        self.assertEqual('bad.org', Domain.objects.get_cached('bad.org').fqdn)
+
+    def test_invalidated_on_save(self):
+        domain = Domain.objects.get_cached('example.org')
+        domain.fqdn = 'example.net'
+        domain.save()
+        self.assertRaises(Domain.DoesNotExist, Domain.objects.get_cached, 'example.org')
+        Domain.objects.get(pk=1).delete()
+        self.assertRaises(Domain.DoesNotExist, Domain.objects.get_cached, 'example.net')
+
+    def test_get_from_email_queries(self):
+        Domain.objects.get_cached('example.org')
+        with self.assertNumQueries(1):
+            user = MailUser.get_from_email('john@example.org')
+            self.assertEqual('example.org', user.domain.fqdn)
+        with self.assertNumQueries(1):
+            user = MailUser.get_from_email('john@example.com', select_related=True)
+            self.assertEqual('example.com', user.domain.fqdn)
+        self.assertRaises(Domain.DoesNotExist, MailUser.get_from_email,
+                          'john@bad.domain.com', select_related=True)
+        self.assertRaises(MailUser.DoesNotExist, MailUser.get_from_email,
+                          'bad_mailuser@example.org', select_related=True)
+
+    def test_stale_cache_not_saved(self):
+        """Test a user saved with its cached domain gets the domain's current fields."""
+        Domain.objects.get_cached('example.org')
+        Domain.objects.filter(pk=1).update(active=False)
+        user = MailUser.get_from_email('john@example.org')
+        self.assertTrue(user.domain.active)
+        user.set_password('secret')
+        user.save()
+        self.assertFalse(MailUser.objects.get(pk=1).domain_active)
+
+        Domain.objects.filter(pk=1).update(fqdn='example.net')
+        user.save()
+        self.assertEqual('john@example.net', MailUser.objects.get(pk=1).email)
+
+    def test_save_without_domain(self):
+        """Test saving a user reads the domain fields without loading its domain."""
+        user = MailUser.objects.get(pk=1)
+        user.save()
+        self.assertFalse(hasattr(user, '_domain_cache'))
+        self.assertEqual('john@example.org', MailUser.objects.get(pk=1).email)
+
+
 class MailUserTest(TestCase):
     fixtures = ['vmail_model_testdata.json']
 
@@ -69,6 +134,16 @@ class MailUserTest(TestCase):
         hashed_password = base64.b64encode(m.digest() + str(salt))
         self.assertEqual(hashed_password, user.shadigest)
 
+    def test_salt(self):
+        """Test salts are random, and have no whitespace."""
+        user = MailUser.objects.get(pk=1)
+        user.set_password(self.password)
+        salt = user.salt
+        user.set_password(self.password)
+        self.assertNotEqual(salt, user.salt)
+        self.assertEqual(user.SALT_LEN, len(user.salt))
+        self.assertEqual(user.salt.strip(), ''.join(user.salt.split()))
+
     def test_check_password(self):
         """Test check_password returns correct results for a mail user."""
         user = MailUser.objects.get(pk=1)
@@ -130,6 +205,38 @@ class MailUserTest(TestCase):
         user = 'bad_mailuser@example.org'
         self.assertRaises(MailUser.DoesNotExist, MailUser.get_from_email, user)
 
+    def test_email_set_on_save(self):
+        """Test the email address follows the username and domain."""
+        user = MailUser.objects.get(pk=1)
+        user.username = 'Johnny'
+        user.domain = Domain.objects.get(pk=2)
+        user.save()
+        self.assertEqual('johnny@example.com', MailUser.objects.get(pk=1).email)
+
+    def test_domain_rename(self):
+        """Test renaming a domain renames the email addresses of its users."""
+        domain = Domain.objects.get(pk=1)
+        domain.fqdn = 'example.net'
+        domain.save()
+        self.assertEqual(['charles@example.net', 'john@example.net', 'robert@example.net'],
+                         sorted(MailUser.objects.filter(domain=domain)
+                                .values_list('email', flat=True)))
+        self.assertEqual('john@example.com', MailUser.objects.get(pk=2).email)
+
+    def test_domain_deactivate(self):
+        """Test deactivating a domain is copied to its users and aliases."""
+        domain = Domain.objects.get(pk=1)
+        domain.active = False
+        domain.save()
+        self.assertFalse(MailUser.objects.filter(domain=domain, domain_active=True).exists())
+        self.assertFalse(Alias.objects.filter(domain=domain, domain_active=True).exists())
+        self.assertTrue(MailUser.objects.get(pk=2).domain_active)
+
+        domain.active = True
+        domain.save()
+        self.assertFalse(MailUser.objects.filter(domain_active=False).exists())
+        self.assertFalse(Alias.objects.filter(domain_active=False).exists())
+
 
 class AliasTest(TestCase):
     fixtures = ['vmail_model_testdata.json']
@@ -169,6 +276,71 @@ class AliasTest(TestCase):
         self.assertTrue(alias.active)
 
 
+class AliasResolveTest(TestCase):
+    fixtures = ['vmail_model_testdata.json']
+
+    def _destinations(self, address):
+        return sorted(Alias.resolve(address).destinations)
+
+    def test_resolve(self):
+        self.assertEqual(['john@example.org'], self._destinations('jonny@example.org'))
+        self.assertEqual(['forward_mailuser_to@external.tld', 'robert@example.com'],
+                         self._destinations('bob@example.com'))
+        self.assertEqual(2, Alias.resolve('bob@example.com').depth)
+
+    def test_resolve_final(self):
+        """Test local mailboxes and non-local addresses resolve to themselves."""
+        self.assertEqual(['john@example.com'], self._destinations('John@example.com'))
+        self.assertEqual(['someone@external.tld'], self._destinations('someone@external.tld'))
+        self.assertEqual(0, Alias.resolve('john@example.com').depth)
+
+    def test_resolve_catchall(self):
+        self.assertEqual(['catch_all_email@example.com'],
+                         self._destinations('unknown@example.com'))
+        self.assertEqual(['unknown@example.org'], self._destinations('unknown@example.org'))
+
+    def test_resolve_wildcard(self):
+        Alias.objects.create(domain_id=1, source='@.example.org', destination='john@example.org')
+        self.assertEqual(['john@example.org'], self._destinations('jane@mail.example.org'))
+        self.assertEqual(['jane@example.org'], self._destinations('jane@example.org'))
+        self.assertEqual(['@mail.example.org'], self._destinations('@mail.example.org'))
+
+    def test_resolve_cycle(self):
+        domain = Domain.objects.get(pk=1)
+        Alias.objects.create(domain=domain, source='a@example.org', destination='b@example.org')
+        Alias.objects.create(domain=domain, source='b@example.org', destination='c@example.org')
+        Alias.objects.create(domain=domain, source='c@example.org', destination='a@example.org')
+        Alias.objects.create(domain=domain, source='c@example.org', destination='john@example.org')
+        expansion = Alias.resolve('b@example.org')
+        self.assertEqual(frozenset(['john@example.org']), expansion.destinations)
+        self.assertEqual((('a@example.org', 'b@example.org', 'c@example.org', 'a@example.org'),),
+                         expansion.cycles)
+
+    def test_resolve_deep(self):
+        """Test a long alias chain is expanded, and a longer one refused, without recursing."""
+        depth = 1200
+        Alias.objects.bulk_create(
+            Alias(domain_id=1, source='a{0}@example.org'.format(i),
+                  destination='a{0}@example.org'.format(i + 1))
+            for i in range(depth))
+        resolver = AliasResolver(preload=True)
+        self.assertRaises(ResolveError, resolver.expand, 'a0@example.org')
+        expansion = resolver.expand('a{0}@example.org'.format(depth - MAX_DEPTH + 1))
+        self.assertEqual(frozenset(['a{0}@example.org'.format(depth)]), expansion.destinations)
+        self.assertEqual(MAX_DEPTH - 1, expansion.depth)
+
+    def test_resolve_memoized(self):
+        """Test expansions are memoized until an alias changes."""
+        Alias.resolve('bob@example.org')
+        with self.assertNumQueries(0):
+            Alias.resolve('bob@example.org')
+
+        alias = Alias.objects.get(pk=1)
+        alias.active = False
+        alias.save()
+        self.assertEqual(['bob@example.org'], self._destinations('bob@example.org'))
+
+
 class TransactionalAliasTest(TransactionTestCase):
     fixtures = ['vmail_model_testdata.json']
 
@@ -194,3 +366,19 @@ class TransactionalAliasTest(TransactionTestCase):
 
         with self.assertRaises(IntegrityError):
             self._create(source_upper, destination_upper, alias.domain)
+
+
+class TransactionalDomainTest(TransactionTestCase):
+    fixtures = ['vmail_model_testdata.json']
+
+    def test_rename_collision(self):
+        """Test a failed rename leaves the mail users' addresses and flags as they were."""
+        domain = Domain.objects.get(pk=1)
+        domain.fqdn = 'example.com'
+        domain.active = False
+        self.assertRaises(IntegrityError, domain.save)
+        self.assertEqual('example.org', Domain.objects.get(pk=1).fqdn)
+        self.assertEqual(['charles@example.org', 'john@example.org', 'robert@example.org'],
+                         sorted(MailUser.objects.filter(domain=1).values_list('email', flat=True)))
+        self.assertFalse(MailUser.objects.filter(domain=1, domain_active=False).exists())
+        self.assertFalse(Alias.objects.filter(domain=1, domain_active=False).exists())
@@ -0,0 +1,76 @@
+"""
+Test the replica database router.
+"""
+
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from .. import routers
+from ..models import Domain, MailUser
+
+
+@override_settings(VMAIL_DATABASE_REPLICAS=['replica1', 'replica2'])
+class ReplicaRouterTest(TestCase):
+
+    def setUp(self):
+        routers.unpin()
+        self.router = routers.ReplicaRouter()
+
+    def tearDown(self):
+        routers.unpin()
+
+    def test_reads_and_writes(self):
+        self.assertIn(self.router.db_for_read(MailUser), ['replica1', 'replica2'])
+        self.assertIsNone(self.router.db_for_read(User))
+        self.assertIsNone(self.router.db_for_write(User))
+        self.assertFalse(routers.is_pinned())
+
+        self.assertEqual('default', self.router.db_for_write(Domain))
+        self.assertTrue(routers.is_pinned())
+        self.assertEqual('default', self.router.db_for_read(MailUser))
+
+    def test_no_replicas(self):
+        with self.settings(VMAIL_DATABASE_REPLICAS=[]):
+            self.assertEqual('default', self.router.db_for_read(MailUser))
+
+    def test_syncdb(self):
+        self.assertTrue(self.router.allow_syncdb('default', MailUser))
+        self.assertFalse(self.router.allow_syncdb('replica1', MailUser))
+        self.assertIsNone(self.router.allow_syncdb('replica1', User))
+
+    def test_pinned(self):
+        @routers.pinned
+        def handle():
+            return self.router.db_for_read(MailUser)
+
+        self.assertEqual('default', handle())
+        self.assertFalse(routers.is_pinned())
+
+    def test_middleware(self):
+        middleware = routers.StickyPrimaryMiddleware()
+        factory = RequestFactory()
+
+        request = factory.get('/')
+        routers.pin()
+        middleware.process_request(request)
+        self.assertFalse(routers.is_pinned())
+        response = middleware.process_response(request, HttpResponse())
+        self.assertNotIn(routers.STICKY_COOKIE, response.cookies)
+
+        request = factory.post('/')
+        middleware.process_request(request)
+        self.router.db_for_write(MailUser)
+        response = middleware.process_response(request, HttpResponse())
+        self.assertFalse(routers.is_pinned())
+        self.assertEqual(5, response.cookies[routers.STICKY_COOKIE]['max-age'])
+
+        request = factory.get('/')
+        request.COOKIES[routers.STICKY_COOKIE] = '1'
+        middleware.process_request(request)
+        self.assertTrue(routers.is_pinned())
+        self.assertEqual('default', self.router.db_for_read(MailUser))
+        response = middleware.process_response(request, HttpResponse())
+        self.assertNotIn(routers.STICKY_COOKIE, response.cookies)
@@ -0,0 +1,247 @@
+"""
+Test the sharding of mail users and aliases by domain.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import StringIO
+from unittest import skipUnless
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from .. import bulk, changes, routers, shards
+from ..maps import build_maps, VIRTUAL_MAILBOX_MAPS, VIRTUAL_ALIAS_MAPS
+from ..matcher import AliasMatcher
+from ..models import Domain, MailUser, Alias, LookupEntry, Change
+from ..resolver import AliasResolver
+
+
+@override_settings(VMAIL_SHARDS=['shard1', 'shard2'])
+class ShardRouterTest(TestCase):
+
+    def setUp(self):
+        self.router = routers.ShardRouter()
+
+    def test_assign(self):
+        shard = shards.assign('example.org')
+        self.assertIn(shard, ['shard1', 'shard2'])
+        self.assertEqual(shard, shards.assign('EXAMPLE.org'))
+        with self.settings(VMAIL_SHARDS=[]):
+            self.assertEqual('', shards.assign('example.org'))
+
+    def test_routes_by_domain(self):
+        domain = Domain(pk=1, fqdn='example.org', shard='shard2')
+        user = MailUser(username='john', domain=domain)
+        self.assertEqual('shard2', self.router.db_for_read(MailUser, instance=domain))
+        self.assertEqual('shard2', self.router.db_for_write(MailUser, instance=user))
+        self.assertEqual('shard2', self.router.db_for_write(Alias, instance=domain))
+        self.assertIsNone(self.router.db_for_read(Domain, instance=domain))
+        self.assertIsNone(self.router.db_for_read(MailUser))
+        self.assertIsNone(self.router.db_for_write(MailUser, instance=Domain(fqdn='a.org')))
+        with self.settings(VMAIL_SHARDS=[]):
+            self.assertIsNone(self.router.db_for_write(MailUser, instance=user))
+
+    def test_syncdb(self):
+        self.assertTrue(self.router.allow_syncdb('shard1', MailUser))
+        self.assertFalse(self.router.allow_syncdb('shard1', User))
+        self.assertIsNone(self.router.allow_syncdb('default', MailUser))
+
+    def test_shard_for(self):
+        with self.settings(VMAIL_SHARDS=[]):
+            Domain.objects.create(fqdn='example.org', shard='shard1')
+        self.assertEqual('shard1', Domain.objects.shard_for('example.org'))
+        self.assertIsNone(Domain.objects.shard_for('missing.org'))
+        with self.settings(VMAIL_SHARDS=[]):
+            self.assertIsNone(Domain.objects.shard_for('example.org'))
+
+
+@skipUnless('other' in settings.DATABASES, "needs an 'other' database as the shard")
+@override_settings(VMAIL_SHARDS=['other'])
+class ShardTest(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        Domain.objects.clear_cache()
+
+    def tearDown(self):
+        Domain.objects.clear_cache()
+
+    def create_domain(self, fqdn):
+        # created before sharding, with its rows on the default database
+        with self.settings(VMAIL_SHARDS=[]):
+            domain = Domain.objects.create(fqdn=fqdn)
+        for username in ('john', 'jane'):
+            user = MailUser.objects.create(username=username, domain=domain)
+            user.set_password('secret')
+            user.save()
+        Alias.objects.create(domain=domain, source='info@' + fqdn, destination='john@' + fqdn)
+        return domain
+
+    def test_new_domain(self):
+        call_command('vmail-addmbox', 'john@example.org', create_domain=True,
+                     password='secret', stdout=StringIO.StringIO())
+        domain = Domain.objects.get(fqdn='example.org')
+        self.assertEqual('other', domain.shard)
+        self.assertTrue(Domain.objects.using('other').filter(pk=domain.pk).exists())
+        self.assertFalse(MailUser.objects.filter(email='john@example.org').exists())
+
+        user = MailUser.get_from_email('john@example.org')
+        self.assertEqual('other', user._state.db)
+        self.assertTrue(user.check_password('secret'))
+        user = MailUser.get_from_email('john@example.org', select_related=True)
+        self.assertEqual('other', user._state.db)
+        self.assertTrue(LookupEntry.objects.using('other')
+                        .filter(address='john@example.org').exists())
+
+        domain.active = False
+        domain.save()
+        self.assertFalse(Domain.objects.using('other').get(pk=domain.pk).active)
+        self.assertFalse(MailUser.objects.using('other').get(pk=user.pk).domain_active)
+
+        domain.delete()
+        self.assertFalse(Domain.objects.using('other').exists())
+        self.assertFalse(MailUser.objects.using('other').exists())
+        self.assertFalse(LookupEntry.objects.using('other').exists())
+        self.assertTrue(Change.objects.using('other')
+                        .filter(model='mailuser', action=Change.DELETE).exists())
+
+    def test_bulk(self):
+        domain = Domain.objects.create(fqdn='example.org')
+        user = MailUser.objects.using('other').create(username='john', domain=domain)
+        self.assertEqual((1, []), bulk.set_passwords([('john@example.org', 'secret')],
+                                                     workers=1))
+        self.assertTrue(MailUser.objects.using('other').get(pk=user.pk)
+                        .check_password('secret'))
+
+        self.assertEqual((1, 1, 0), bulk.set_domains_active(
+            Domain.objects.filter(pk=domain.pk), False, members=True))
+        self.assertFalse(Domain.objects.using('other').get(pk=domain.pk).active)
+        self.assertFalse(MailUser.objects.using('other').get(pk=user.pk).active)
+        self.assertEqual(['mailuser'], list(Change.objects.using('other')
+                                            .values_list('model', flat=True).distinct()))
+
+        other = self.create_domain('example.com')
+        self.assertRaises(ValueError, bulk.move_mailboxes,
+                          MailUser.objects.filter(domain=other), domain)
+
+    def test_move_domain(self):
+        domain = self.create_domain('example.org')
+        cursor = changes.latest('other')
+        self.assertEqual(3, shards.move_domain(domain, 'other', batch_size=1, grace=0))
+        self.assertEqual('other', Domain.objects.get(pk=domain.pk).shard)
+
+        self.assertFalse(MailUser.objects.filter(domain=domain).exists())
+        self.assertFalse(Alias.objects.filter(domain=domain).exists())
+        self.assertFalse(LookupEntry.objects.filter(domain=domain).exists())
+        self.assertEqual(3, LookupEntry.objects.using('other').filter(domain=domain).count())
+        self.assertEqual(['alias', 'mailuser', 'mailuser'],
+                         sorted(change.model for change in changes.since(cursor, using='other')
+                                if change.action == Change.CREATE))
+
+        user = MailUser.get_from_email('jane@example.org')
+        self.assertEqual('other', user._state.db)
+        self.assertTrue(user.check_password('secret'))
+        self.assertEqual(2, Change.objects.filter(model='mailuser', action=Change.DELETE)
+                         .count())
+
+        # and back again
+        self.assertEqual(3, shards.move_domain(domain, 'default', grace=0))
+        self.assertEqual('', Domain.objects.get(pk=domain.pk).shard)
+        self.assertEqual(2, MailUser.objects.filter(domain=domain).count())
+        self.assertFalse(MailUser.objects.using('other').exists())
+        self.assertRaises(ValueError, shards.move_domain, domain, 'default')
+
+    def test_copy(self):
+        """Test a copy keeps the later change, and drops the deleted rows."""
+        domain = self.create_domain('example.org')
+        shards.copy_domains([domain.pk])
+        shards._copy(MailUser, domain, 'default', 'other', None, None, 1)
+        john = MailUser.objects.get(email='john@example.org')
+        copied = MailUser.objects.using('other').get(email='john@example.org')
+        self.assertEqual((john.created, john.modified), (copied.created, copied.modified))
+
+        john.set_password('changed')
+        john.save()
+        MailUser.objects.filter(email='jane@example.org').delete()
+        shards._copy(MailUser, domain, 'default', 'other', john.modified, None, 1)
+        self.assertEqual(['john@example.org'], list(MailUser.objects.using('other')
+                                                    .values_list('email', flat=True)))
+        self.assertTrue(MailUser.objects.using('other').get(email='john@example.org')
+                        .check_password('changed'))
+
+    def test_delete_domain(self):
+        call_command('vmail-addmbox', 'john@example.org', create_domain=True,
+                     password='secret', stdout=StringIO.StringIO())
+        domain = Domain.objects.get(fqdn='example.org')
+        Alias.objects.using('other').create(domain=domain, source='info@example.org',
+                                            destination='john@example.org')
+        self.assertEqual((1, 1), bulk.delete_domain(domain, batch_size=1))
+        self.assertFalse(Domain.objects.using('other').exists())
+        self.assertFalse(LookupEntry.objects.using('other').exists())
+        self.assertEqual(['alias', 'mailuser'], sorted(
+            Change.objects.using('other').filter(action=Change.DELETE)
+            .exclude(model='domain').values_list('model', flat=True)))
+
+    def test_list(self):
+        self.create_domain('example.org')
+        call_command('vmail-addmbox', 'john@example.com', create_domain=True,
+                     password='secret', stdout=StringIO.StringIO())
+        stdout, stderr = StringIO.StringIO(), StringIO.StringIO()
+        call_command('vmail-list', 'mailboxes', format='csv', stdout=stdout, stderr=stderr)
+        self.assertEqual(['john@example.org', 'jane@example.org', 'john@example.com'],
+                         [line.split(',')[0] for line in stdout.getvalue().splitlines()[1:]])
+        call_command('vmail-list', 'mailboxes', domain='example.com', stdout=stdout,
+                     stderr=stderr)
+        self.assertIn('Listed 1 mailboxes.', stderr.getvalue())
+
+    def test_readers(self):
+        """Test the maps, resolver, matcher and exporters read every shard."""
+        self.create_domain('example.org')
+        call_command('vmail-addmbox', 'john@example.com', create_domain=True,
+                     password='secret', stdout=StringIO.StringIO())
+        domain = Domain.objects.get(fqdn='example.com')
+        Alias.objects.using('other').create(domain=domain, source='info@example.com',
+                                            destination='john@example.com')
+
+        maps = build_maps()
+        self.assertEqual('1', maps[VIRTUAL_MAILBOX_MAPS].get('john@example.com'))
+        self.assertEqual('1', maps[VIRTUAL_MAILBOX_MAPS].get('john@example.org'))
+        self.assertEqual('john@example.com', maps[VIRTUAL_ALIAS_MAPS].get('info@example.com'))
+        self.assertEqual(['info@example.com', 'info@example.org'],
+                         AliasMatcher.load().sources())
+        self.assertEqual(frozenset(['john@example.com']),
+                         AliasResolver().expand('info@example.com').destinations)
+        self.assertEqual(frozenset(['john@example.com']),
+                         AliasResolver(preload=True).expand('info@example.com').destinations)
+
+        directory = tempfile.mkdtemp()
+        try:
+            call_command('vmail-export-passwd', directory, stdout=StringIO.StringIO())
+            with open(os.path.join(directory, 'example.com.passwd')) as fp:
+                self.assertTrue(fp.read().startswith('john@example.com:'))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_batch_chunk(self):
+        """Test a failed line of a chunk is rolled back on the shard too."""
+        call_command('vmail-addmbox', 'john@example.com', create_domain=True,
+                     password='secret', stdout=StringIO.StringIO())
+        stdin, sys.stdin = sys.stdin, StringIO.StringIO('\n'.join([
+            'addmbox jane@example.com',
+            'setpasswd nobody@example.com secret',
+            'addalias example.com info@example.com john@example.com',
+        ]))
+        try:
+            self.assertRaises(CommandError, call_command, 'vmail-batch', '-', chunk_size=2,
+                              stdout=StringIO.StringIO(), stderr=StringIO.StringIO())
+        finally:
+            sys.stdin = stdin
+        self.assertEqual(2, MailUser.objects.using('other').count())
+        self.assertTrue(Alias.objects.using('other').filter(source='info@example.com').exists())
@@ -0,0 +1,151 @@
+"""
+Test the in-memory lookup tables and the socketmap server.
+"""
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import StringIO
+
+from django.test import TestCase
+
+from ..daemon import make_server, parse_address
+from ..maps import MapIndex
+from ..models import MailUser, Domain, Alias
+from ..socketmap import (SocketmapHandler, NetstringError, encode_netstring,
+                         read_netstring)
+
+
+class MapIndexTest(TestCase):
+    fixtures = ['vmail_model_testdata.json']
+
+    def setUp(self):
+        self.index = MapIndex()
+        self.index.load()
+
+    def test_domains(self):
+        self.assertEqual('1', self.index.lookup('virtual_mailbox_domains', 'example.org'))
+        self.assertIsNone(self.index.lookup('virtual_mailbox_domains', 'bad.domain.com'))
+
+    def test_mailboxes(self):
+        self.assertEqual('1', self.index.lookup('virtual_mailbox_maps', 'John@Example.org'))
+        self.assertEqual('john.smith@example.com',
+                         self.index.lookup('email2email', 'john.smith@example.com'))
+        self.assertIsNone(self.index.lookup('virtual_mailbox_maps', 'bob@example.org'))
+
+    def test_aliases(self):
+        self.assertEqual('forward_mailuser_to@external.tld,robert@example.com',
+                         self.index.lookup('virtual_alias_maps', 'robert@example.com'))
+        self.assertEqual('catch_all_email@example.com',
+                         self.index.lookup('virtual_alias_maps', '@example.com'))
+
+    def test_wildcard_aliases(self):
+        Alias.objects.create(domain_id=1, source='@.example.org', destination='john@example.org')
+        self.index.load()
+        self.assertEqual('john@example.org',
+                         self.index.lookup('virtual_alias_maps', '@a.b.example.org'))
+        self.assertIsNone(self.index.lookup('virtual_alias_maps', 'jane@a.example.org'))
+        self.assertIsNone(self.index.lookup('virtual_alias_maps', '@example.org'))
+        self.assertEqual('1', self.index.lookup('virtual_mailbox_domains', 'a.b.example.org'))
+        self.assertIsNone(self.index.lookup('virtual_mailbox_domains', 'a.example.com'))
+
+    def test_inactive_excluded(self):
+        """Test inactive rows, and rows of inactive domains, are not loaded."""
+        MailUser.objects.filter(pk=1).update(active=False)
+        domain = Domain.objects.get(pk=2)
+        domain.active = False
+        domain.save()
+        self.index.load()
+        self.assertIsNone(self.index.lookup('virtual_mailbox_maps', 'john@example.org'))
+        self.assertIsNone(self.index.lookup('virtual_mailbox_domains', 'example.com'))
+        self.assertIsNone(self.index.lookup('virtual_alias_maps', 'bob@example.com'))
+        self.assertEqual('robert@example.org',
+                         self.index.lookup('virtual_alias_maps', 'bob@example.org'))
+
+    def test_reload(self):
+        Alias.objects.create(domain_id=1, source='new@example.org',
+                             destination='john@example.org')
+        self.assertIsNone(self.index.lookup('virtual_alias_maps', 'new@example.org'))
+        self.index.load()
+        self.assertEqual('john@example.org',
+                         self.index.lookup('virtual_alias_maps', 'new@example.org'))
+
+    def test_unknown_map(self):
+        self.assertRaises(KeyError, self.index.lookup, 'bad_map', 'example.org')
+
+
+class NetstringTest(TestCase):
+
+    def test_round_trip(self):
+        data = encode_netstring('OK john@example.org')
+        self.assertEqual('19:OK john@example.org,', data)
+        rfile = StringIO.StringIO(data + encode_netstring(''))
+        self.assertEqual('OK john@example.org', read_netstring(rfile))
+        self.assertEqual('', read_netstring(rfile))
+        self.assertIsNone(read_netstring(rfile))
+
+    def test_malformed(self):
+        for data in ('5:abc', 'x:abc,', '3:abc;', '999999999:a,'):
+            self.assertRaises(NetstringError, read_netstring, StringIO.StringIO(data))
+
+
+class SocketmapServerTest(TestCase):
+    fixtures = ['vmail_model_testdata.json']
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'socketmap')
+        self.server = make_server('unix:' + self.path, SocketmapHandler)
+        self.server.index = MapIndex()
+        self.server.index.load()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_lookups(self):
+        """Test many requests are answered on a single connection."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        rfile = sock.makefile('rb')
+        requests = [
+            ('virtual_mailbox_domains example.com', 'OK 1'),
+            ('virtual_alias_maps jonny@example.org', 'OK john@example.org'),
+            ('virtual_mailbox_maps nobody@example.org', 'NOTFOUND '),
+            ('bad_map example.org', 'PERM Unknown map: bad_map.'),
+        ]
+        for request, reply in requests:
+            sock.sendall(encode_netstring(request))
+            self.assertEqual(reply, read_netstring(rfile))
+        sock.close()
+
+    def test_wildcard_subdomain(self):
+        """Test mail to a subdomain is accepted and rewritten by a parent's wildcard."""
+        Alias.objects.create(domain_id=1, source='@.example.org', destination='john@example.org')
+        self.server.index.load()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        rfile = sock.makefile('rb')
+        # the lookups Postfix makes for jane@mail.example.org
+        requests = [
+            ('virtual_mailbox_domains mail.example.org', 'OK 1'),
+            ('virtual_alias_maps jane@mail.example.org', 'NOTFOUND '),
+            ('virtual_alias_maps @mail.example.org', 'OK john@example.org'),
+            ('virtual_mailbox_domains mail.example.com', 'NOTFOUND '),
+        ]
+        for request, reply in requests:
+            sock.sendall(encode_netstring(request))
+            self.assertEqual(reply, read_netstring(rfile))
+        sock.close()
+
+    def test_parse_address(self):
+        self.assertEqual((socket.AF_INET, ('127.0.0.1', 2525)), parse_address('inet::2525'))
+        self.assertEqual((socket.AF_UNIX, '/tmp/map'), parse_address('unix:/tmp/map'))
+        self.assertRaises(ValueError, parse_address, 'inet:localhost')
+        self.assertRaises(ValueError, parse_address, '/tmp/map')